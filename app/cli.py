@@ -0,0 +1,92 @@
+"""
+Служебные команды:
+
+    python -m app.cli migrate
+    python -m app.cli migrate-blobs
+    python -m app.cli audit-maintain
+    python -m app.cli gc-uploads
+    python -m app.cli migrate-layout
+"""
+import argparse
+import time
+
+from sqlalchemy.exc import OperationalError
+
+from app.db.migrations import upgrade
+from app.db.session import SessionLocal, engine
+from app.services.audit_maintenance import maintain
+from app.services.storage import migrate_layout, migrate_legacy_files
+from app.services.uploads import collect_expired_sessions
+
+
+def cmd_migrate(args):
+    # в compose база может подниматься дольше приложения
+    for attempt in range(args.retries + 1):
+        try:
+            applied = upgrade(engine, log=print)
+            break
+        except OperationalError:
+            if attempt == args.retries:
+                raise
+            time.sleep(1)
+    print(f"applied migrations: {applied}")
+
+
+def cmd_migrate_blobs(args):
+    with SessionLocal() as db:
+        migrated = migrate_legacy_files(db, batch_size=args.batch_size)
+    print(f"migrated documents: {migrated}")
+
+
+def cmd_migrate_layout(args):
+    moved = migrate_layout(batch_size=args.batch_size, pause=args.pause, grace=args.grace, log=print)
+    print(f"moved files: {moved}")
+
+
+def cmd_audit_maintain(args):
+    result = maintain(rollup_days=args.days)
+    if result is None:
+        print("audit maintenance is already running elsewhere")
+        return
+    print(f"created partitions: {', '.join(result['created']) or '-'}")
+    print(f"dropped partitions: {', '.join(result['dropped']) or '-'}")
+    print(f"daily rollup rows: {result['rolled_up']}")
+
+
+def cmd_gc_uploads(args):
+    with SessionLocal() as db:
+        removed = collect_expired_sessions(db)
+    print(f"removed upload files: {removed}")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m app.cli")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("migrate", help="применить миграции схемы")
+    p.add_argument("--retries", type=int, default=30)
+    p.set_defaults(func=cmd_migrate)
+
+    p = sub.add_parser("migrate-blobs", help="перевести старые файлы на blob'ы по sha256")
+    p.add_argument("--batch-size", type=int, default=500)
+    p.set_defaults(func=cmd_migrate_blobs)
+
+    p = sub.add_parser("migrate-layout", help="разложить файлы хранилища по каталогам ab/cd/")
+    p.add_argument("--batch-size", type=int, default=1000)
+    p.add_argument("--pause", type=float, default=0.5, help="пауза между пачками, секунд")
+    p.add_argument("--grace", type=float, default=5.0, help="через сколько секунд удалять старое имя")
+    p.set_defaults(func=cmd_migrate_layout)
+
+    p = sub.add_parser("audit-maintain", help="секции журнала, срок хранения, суточные итоги")
+    p.add_argument("--days", type=int, default=2, help="за сколько последних дней пересчитать итоги")
+    p.set_defaults(func=cmd_audit_maintain)
+
+    p = sub.add_parser("gc-uploads", help="удалить просроченные сессии докачки")
+    p.set_defaults(func=cmd_gc_uploads)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
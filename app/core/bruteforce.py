@@ -1,31 +1,27 @@
-import time
-from collections import defaultdict, deque
-from fastapi import Request, HTTPException
+from app.core.config import settings
+from app.core.limiter import make_counter
+from app.core.metrics import record_decision
 
 
 class BruteForceProtector:
-    def __init__(self, limit: int, window_seconds: int):
+    def __init__(self, limit: int, window_seconds: int, max_keys: int = 100_000,
+                 scope: str = "login"):
         self.limit = limit
         self.window = window_seconds
-        self.attempts = defaultdict(deque)
+        self.scope = scope
+        self.attempts = make_counter(scope, window_seconds, max_keys)
 
     def register_fail(self, key: str):
-        now = time.time()
-        q = self.attempts[key]
-
-        while q and now - q[0] > self.window:
-            q.popleft()
-
-        q.append(now)
+        self.attempts.add(key)
 
     def is_blocked(self, key: str) -> bool:
-        now = time.time()
-        q = self.attempts[key]
-
-        while q and now - q[0] > self.window:
-            q.popleft()
-
-        return len(q) >= self.limit
+        blocked = self.attempts.count(key) >= self.limit
+        record_decision(self.scope, not blocked)
+        return blocked
 
 
-bruteforce = BruteForceProtector(limit=5, window_seconds=60)
+bruteforce = BruteForceProtector(
+    limit=5,
+    window_seconds=60,
+    max_keys=settings.BRUTEFORCE_MAX_KEYS,
+)
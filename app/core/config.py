@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic_settings import BaseSettings
 
 
@@ -6,6 +8,40 @@ class Settings(BaseSettings):
 
     SECRET_KEY: str = "CHANGE_ME_SUPER_SECRET"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60
+    # класть id и роль в JWT: запросы с таким токеном не ходят в БД,
+    # но смена роли вступит в силу только с новым токеном
+    JWT_EMBED_PRINCIPAL: bool = False
+
+    # bcrypt: стоимость и пул процессов (0 = по числу ядер)
+    BCRYPT_ROUNDS: int = 12
+    BCRYPT_POOL_WORKERS: int = 0
+    BCRYPT_MAX_PENDING: int = 32
+    BCRYPT_WAIT_TIMEOUT: float = 0.1
+
+    # где лимитеры хранят счётчики: память процесса, разделяемая память
+    # хоста (несколько воркеров) или Postgres (несколько реплик)
+    RATE_LIMIT_BACKEND: Literal["memory", "shm", "postgres"] = "memory"
+    RATE_LIMIT_SYNC_INTERVAL: float = 0.5
+    RATE_LIMIT_SHM_SLOTS: int = 65536
+
+    # сколько ключей (пользователь/ip) держат в памяти лимитеры
+    RATE_LIMIT_MAX_KEYS: int = 100000
+    BRUTEFORCE_MAX_KEYS: int = 100000
+
+    # /metrics: доля запросов с замером задержки и SQL (счётчики - всегда)
+    METRICS_ENABLED: bool = True
+    METRICS_SAMPLE_RATE: float = 1.0
+
+    PRINCIPAL_CACHE_TTL: int = 60
+    PRINCIPAL_CACHE_SIZE: int = 10000
+
+    # кэш прав на документы: пользователей в кэше, время жизни набора,
+    # как часто сверять версию с БД (изменения из других процессов видны
+    # с этой задержкой; 0 - сверять при каждой проверке), максимум id в наборе
+    ACL_CACHE_SIZE: int = 10000
+    ACL_CACHE_TTL: int = 600
+    ACL_RECHECK_SECONDS: float = 1.0
+    ACL_CACHE_MAX_IDS: int = 100000
 
     DB_HOST: str = "db"
     DB_PORT: int = 5432
@@ -13,7 +49,59 @@ class Settings(BaseSettings):
     DB_USER: str = "sed_user"
     DB_PASSWORD: str = "sed_password"
 
+    # sync - psycopg2 и обычные def-обработчики, async - asyncpg и async def
+    DB_MODE: Literal["sync", "async"] = "sync"
+
     STORAGE_PATH: str = "/data/storage"
+    # раскладка новых файлов: fanout - ab/cd/<sha256>, flat - все в корне;
+    # читаются обе, перенос старых - `python -m app.cli migrate-layout`
+    STORAGE_LAYOUT: Literal["flat", "fanout"] = "fanout"
+
+    # кто отдаёт байты файла: direct - приложение, x-accel - nginx
+    # (X-Accel-Redirect на internal location X_ACCEL_PREFIX, смотрящий в
+    # STORAGE_PATH), x-sendfile - Apache/lighttpd (абсолютный путь)
+    DOWNLOAD_DELIVERY: Literal["direct", "x-accel", "x-sendfile"] = "direct"
+    X_ACCEL_PREFIX: str = "/protected/"
+    MAX_UPLOAD_BYTES: int = 1024 * 1024 * 1024
+
+    # сжатие новых файлов в хранилище (zstd - нужен пакет zstandard);
+    # уровень 0 - по умолчанию для кодека, мелкие и уже сжатые файлы не трогаем
+    STORAGE_CODEC: Literal["none", "gzip", "zstd"] = "none"
+    STORAGE_CODEC_LEVEL: int = 0
+    STORAGE_COMPRESS_MIN_BYTES: int = 4096
+
+    # пакетная загрузка: максимум файлов в пакете, потоков записи/хэширования,
+    # суммарный размер распакованных файлов
+    BATCH_UPLOAD_MAX_FILES: int = 10000
+    BATCH_UPLOAD_WORKERS: int = 4
+    BATCH_UPLOAD_MAX_BYTES: int = 4 * 1024 * 1024 * 1024
+
+    # архив нескольких документов одним запросом: максимум документов
+    ARCHIVE_MAX_DOCUMENTS: int = 1000
+
+    # докачиваемые загрузки: срок жизни сессии без активности, размер куска
+    UPLOAD_SESSION_TTL: int = 24 * 3600
+    UPLOAD_CHUNK_MAX_BYTES: int = 64 * 1024 * 1024
+    UPLOAD_SESSIONS_PER_USER: int = 20
+    # куски считаются отдельно от общего лимита запросов к документам
+    UPLOAD_CHUNK_RATE_LIMIT: int = 600
+
+    # проверка целостности файлов (sha256)
+    INTEGRITY_STRICT: bool = False
+    INTEGRITY_REVERIFY_SECONDS: int = 3600
+    INTEGRITY_CACHE_SIZE: int = 10000
+
+    # фоновая запись журнала доступа
+    AUDIT_QUEUE_SIZE: int = 10000
+    AUDIT_BATCH_SIZE: int = 500
+    AUDIT_FLUSH_INTERVAL: float = 1.0
+    AUDIT_OVERFLOW: Literal["block", "drop", "spill"] = "block"
+    AUDIT_SPILL_PATH: str = ""
+
+    # секции access_logs по месяцам: создание наперёд, срок хранения (0 - вечно)
+    AUDIT_PARTITIONS_AHEAD: int = 3
+    AUDIT_RETENTION_MONTHS: int = 12
+    AUDIT_MAINTENANCE_INTERVAL: float = 3600.0
 
     @property
     def DATABASE_URL(self) -> str:
@@ -22,5 +110,12 @@ class Settings(BaseSettings):
             f"@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
         )
 
+    @property
+    def ASYNC_DATABASE_URL(self) -> str:
+        return (
+            f"postgresql+asyncpg://{self.DB_USER}:{self.DB_PASSWORD}"
+            f"@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
+        )
+
 
 settings = Settings()
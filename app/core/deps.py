@@ -1,20 +1,53 @@
+from dataclasses import dataclass
+
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy import event, select
 
+from app.core.cache import TTLCache
 from app.core.config import settings
-from app.db.session import get_db
-from app.db.models import User
+from app.db.session import get_db, get_async_db
+from app.db.models import User, Role
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
 
-def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db),
-) -> User:
+@dataclass(frozen=True, slots=True)
+class Principal:
+    """
+    Лёгкий снимок пользователя, не привязанный к сессии БД
+    """
+    id: int
+    username: str
+    role: Role
+
+
+# кэш в пределах процесса: username -> Principal
+principal_cache = TTLCache(
+    maxsize=settings.PRINCIPAL_CACHE_SIZE,
+    ttl=settings.PRINCIPAL_CACHE_TTL,
+)
+
+
+def invalidate_principal(username: str):
+    principal_cache.pop(username)
+
+
+@event.listens_for(User, "after_insert")
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_on_user_change(mapper, connection, target: User):
+    # регистрация, смена роли, удаление - сбрасываем запись
+    invalidate_principal(target.username)
+
+
+def _cached_principal(token: str) -> tuple[str, Principal | None]:
+    """
+    Проверяет токен; возвращает (username, Principal если он известен без БД)
+    """
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
         username = payload.get("sub")
@@ -23,7 +56,47 @@ def get_current_user(
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-    user = db.scalar(select(User).where(User.username == username))
-    if not user:
+    # токен сам несёт id и роль - БД не нужна
+    if settings.JWT_EMBED_PRINCIPAL and "uid" in payload and "role" in payload:
+        return username, Principal(id=payload["uid"], username=username, role=Role(payload["role"]))
+
+    return username, principal_cache.get(username)
+
+
+def _principal_query(username: str):
+    return select(User.id, User.username, User.role).where(User.username == username)
+
+
+def _remember(username: str, row) -> Principal:
+    if not row:
         raise HTTPException(status_code=401, detail="User not found")
-    return user
+
+    principal = Principal(id=row.id, username=row.username, role=row.role)
+    principal_cache.set(username, principal)
+    return principal
+
+
+def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db),
+) -> Principal:
+    username, principal = _cached_principal(token)
+    if principal is not None:
+        return principal
+    return _remember(username, db.execute(_principal_query(username)).first())
+
+
+async def get_current_user_async(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db),
+) -> Principal:
+    username, principal = _cached_principal(token)
+    if principal is not None:
+        return principal
+    return _remember(username, (await db.execute(_principal_query(username))).first())
+
+
+def require_admin(current_user: Principal = Depends(get_current_user)) -> Principal:
+    if current_user.role != Role.admin:
+        raise HTTPException(status_code=403, detail="Admin only")
+    return current_user
@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import settings
+
+
+class _Window:
+    """
+    Состояние одного ключа: начало текущего окна и два счётчика
+    (предыдущее и текущее окно)
+    """
+    __slots__ = ("start", "prev", "curr")
+
+    def __init__(self, start: float):
+        self.start = start
+        self.prev = 0
+        self.curr = 0
+
+
+class SlidingWindowCounter:
+    """
+    Скользящее окно на двух счётчиках: O(1) памяти и времени на ключ.
+
+    Оценка числа событий за последние window секунд:
+        prev * (доля предыдущего окна, попадающая в скользящее) + curr
+
+    Число ключей ограничено max_keys (вытесняется давно не используемый),
+    ключи без событий за два окна периодически удаляются - их состояние
+    ничем не отличается от отсутствующего.
+    """
+
+    def __init__(self, window_seconds: float, max_keys: int = 100_000):
+        self.window = window_seconds
+        self.max_keys = max_keys
+        self.evicted = 0
+        self._entries: OrderedDict[str, _Window] = OrderedDict()
+        self._lock = threading.Lock()
+        self._next_sweep = 0.0
+
+    def _get(self, key: str, now: float, create: bool) -> _Window | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            if not create:
+                return None
+            entry = self._entries[key] = _Window(now - now % self.window)
+            if len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+                self.evicted += 1
+        else:
+            self._entries.move_to_end(key)
+            self._roll(entry, now)
+        return entry
+
+    def _roll(self, entry: _Window, now: float):
+        start = now - now % self.window
+        if start == entry.start:
+            return
+        # ровно одно окно назад - текущий счётчик становится предыдущим
+        entry.prev = entry.curr if start - entry.start == self.window else 0
+        entry.curr = 0
+        entry.start = start
+
+    def _estimate(self, entry: _Window, now: float) -> float:
+        elapsed = (now - entry.start) / self.window
+        return entry.prev * (1.0 - elapsed) + entry.curr
+
+    def _sweep(self, now: float):
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.window
+
+        # порядок в OrderedDict - по последнему обращению,
+        # поэтому простаивающие ключи лежат в начале
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            self._roll(entry, now)
+            if entry.prev or entry.curr:
+                break
+            del self._entries[key]
+
+    def add(self, key: str, amount: int = 1):
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            self._get(key, now, create=True).curr += amount
+
+    def count(self, key: str) -> float:
+        now = time.time()
+        with self._lock:
+            entry = self._get(key, now, create=False)
+            return 0.0 if entry is None else self._estimate(entry, now)
+
+    def try_acquire(self, key: str, limit: int) -> bool:
+        """
+        Атомарно: если лимит не исчерпан - учитываем событие и возвращаем True
+        """
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            entry = self._get(key, now, create=True)
+            if self._estimate(entry, now) >= limit:
+                return False
+            entry.curr += 1
+            return True
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def make_counter(scope: str, window_seconds: float, max_keys: int):
+    """
+    Счётчик для лимитера с бэкендом из настроек RATE_LIMIT_BACKEND
+    """
+    if settings.RATE_LIMIT_BACKEND == "shm":
+        from app.core.shared_limiter import ShmCounter
+
+        return ShmCounter(
+            name=f"{settings.APP_NAME.lower()}_{scope}",
+            window_seconds=window_seconds,
+            sync_interval=settings.RATE_LIMIT_SYNC_INTERVAL,
+            slots=settings.RATE_LIMIT_SHM_SLOTS,
+            max_keys=max_keys,
+        )
+
+    if settings.RATE_LIMIT_BACKEND == "postgres":
+        from app.core.shared_limiter import PostgresCounter
+        from app.db.session import engine
+
+        return PostgresCounter(
+            scope=scope,
+            engine=engine,
+            window_seconds=window_seconds,
+            sync_interval=settings.RATE_LIMIT_SYNC_INTERVAL,
+            max_keys=max_keys,
+        )
+
+    return SlidingWindowCounter(window_seconds, max_keys)
+
+
+async def call_limiter(fn, *args):
+    """
+    Вызов лимитера из async-обработчика: postgres-бэкенд ходит в БД
+    синхронно, поэтому его уводим из event loop
+    """
+    if settings.RATE_LIMIT_BACKEND == "postgres":
+        return await run_in_threadpool(fn, *args)
+    return fn(*args)
@@ -0,0 +1,300 @@
+"""
+Метрики процесса в текстовом формате Prometheus (/metrics).
+
+Без внешних зависимостей: счётчики и гистограммы под одной блокировкой,
+значения-снимки (очереди, кэши) считаются в момент выдачи. При нескольких
+воркерах у каждого свои значения - Prometheus собирает их по отдельности.
+"""
+import hashlib
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Callable
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+
+def _labels_text(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield self.name, _labels_text(self.labelnames, labels), value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # labels -> [счётчики корзин..., +Inf, сумма]
+        self._values: dict[tuple, list[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(labels)
+            if row is None:
+                row = self._values[labels] = [0] * (len(self.buckets) + 2)
+            row[index] += 1
+            row[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(row)) for labels, row in self._values.items()]
+        for labels, row in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), row):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield (
+                    f"{self.name}_bucket",
+                    _labels_text(self.labelnames + ("le",), labels + (le,)),
+                    cumulative,
+                )
+            yield f"{self.name}_count", _labels_text(self.labelnames, labels), cumulative
+            yield f"{self.name}_sum", _labels_text(self.labelnames, labels), row[-1]
+
+
+class Gauge:
+    """
+    Значение снимается функцией в момент выдачи метрик. kind="counter" -
+    для уже существующих счётчиков (например, AuditWriter.written)
+    """
+
+    def __init__(self, name: str, help: str, read: Callable[[], float | dict[tuple, float]],
+                 labelnames: tuple[str, ...] = (), kind: str = "gauge"):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labelnames = labelnames
+        self.read = read
+
+    def samples(self):
+        value = self.read()
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for labels, current in items:
+            yield self.name, _labels_text(self.labelnames, labels), current
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, read, labelnames=(), kind="gauge") -> Gauge:
+        return self.register(Gauge(name, help, read, labelnames, kind))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    "http_requests_total", "HTTP requests", ("method", "route", "status"))
+http_latency = registry.histogram(
+    "http_request_duration_seconds", "Time until the last response byte is sent (sampled)",
+    ("method", "route"))
+http_response_bytes = registry.counter(
+    "http_response_bytes_total", "Response body bytes", ("route",))
+request_sql_statements = registry.histogram(
+    "http_request_sql_statements", "SQL statements per request (sampled)",
+    ("method", "route"), buckets=COUNT_BUCKETS)
+request_sql_seconds = registry.histogram(
+    "http_request_sql_seconds", "Time spent in SQL per request (sampled)", ("method", "route"))
+
+sql_statements = registry.counter("db_statements_total", "SQL statements executed", ("engine",))
+sql_seconds = registry.counter("db_statement_seconds_total", "Time spent executing SQL", ("engine",))
+pool_wait = registry.histogram(
+    "db_pool_checkout_wait_seconds", "Wait for a pooled connection", ("engine",))
+
+hash_bytes = registry.counter("hash_bytes_total", "Bytes hashed with sha256", ("op",))
+hash_seconds = registry.counter("hash_seconds_total", "Time spent in sha256", ("op",))
+
+limiter_decisions = registry.counter(
+    "limiter_decisions_total", "Rate limiter and brute-force decisions", ("scope", "decision"))
+
+
+@dataclass
+class RequestStats:
+    sql_statements: int = 0
+    sql_seconds: float = 0.0
+
+
+# статистика текущего запроса (только для попавших в выборку)
+current_request: ContextVar[RequestStats | None] = ContextVar("current_request", default=None)
+
+
+def record_sql(engine_name: str, seconds: float):
+    sql_statements.inc(engine_name)
+    sql_seconds.inc(engine_name, amount=seconds)
+    stats = current_request.get()
+    if stats is not None:
+        stats.sql_statements += 1
+        stats.sql_seconds += seconds
+
+
+def instrument_engine(engine, name: str):
+    """
+    Счётчики SQL по событиям движка (для async - его sync_engine)
+    """
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["metrics_started"].pop()
+        record_sql(name, time.perf_counter() - started)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        stack = context.connection.info.get("metrics_started") if context.connection else None
+        if stack:
+            stack.pop()
+
+
+def timed_pool(pool_class, name: str):
+    """
+    Подкласс пула, который меряет ожидание свободного соединения
+    """
+    class TimedPool(pool_class):
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                return super()._do_get()
+            finally:
+                pool_wait.observe(time.perf_counter() - started, name)
+
+    TimedPool.__name__ = f"Timed{pool_class.__name__}"
+    return TimedPool
+
+
+class MeteredHash:
+    """
+    hashlib.sha256 с учётом байт и времени; итог пишется при hexdigest()
+    """
+    __slots__ = ("op", "_h", "_bytes", "_seconds")
+
+    def __init__(self, op: str):
+        self.op = op
+        self._h = hashlib.sha256()
+        self._bytes = 0
+        self._seconds = 0.0
+
+    def update(self, data: bytes):
+        started = time.perf_counter()
+        self._h.update(data)
+        self._seconds += time.perf_counter() - started
+        self._bytes += len(data)
+
+    def hexdigest(self) -> str:
+        hash_bytes.inc(self.op, amount=self._bytes)
+        hash_seconds.inc(self.op, amount=self._seconds)
+        self._bytes = 0
+        self._seconds = 0.0
+        return self._h.hexdigest()
+
+
+def record_decision(scope: str, allowed: bool):
+    limiter_decisions.inc(scope, "allowed" if allowed else "limited")
+
+
+class MetricsMiddleware:
+    """
+    Чистый ASGI-middleware: не буферизует тело ответа, время считается
+    до отправки последнего байта (включая передачу файла)
+    """
+
+    def __init__(self, app, sample_rate: float = 1.0):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        sampled = self.sample_rate >= 1.0 or random.random() < self.sample_rate
+        stats = RequestStats() if sampled else None
+        token = current_request.set(stats)
+        started = time.perf_counter()
+        status = 500
+        sent = 0
+
+        async def metered_send(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, metered_send)
+        finally:
+            current_request.reset(token)
+            # шаблон пути, а не сам путь - иначе метки размножаются по id
+            route = scope.get("route")
+            route_label = getattr(route, "path", "unmatched")
+            method = scope["method"]
+
+            http_requests.inc(method, route_label, str(status))
+            http_response_bytes.inc(route_label, amount=sent)
+            if stats is not None:
+                http_latency.observe(time.perf_counter() - started, method, route_label)
+                request_sql_statements.observe(stats.sql_statements, method, route_label)
+                request_sql_seconds.observe(stats.sql_seconds, method, route_label)
+
+
+def render_metrics() -> str:
+    return registry.render()
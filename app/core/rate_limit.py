@@ -1,31 +1,36 @@
-import time
-from collections import defaultdict, deque
-from typing import Deque, Dict, Tuple
+from app.core.config import settings
+from app.core.limiter import make_counter
+from app.core.metrics import record_decision
 
 
 class RateLimiter:
-    def __init__(self, max_requests: int, window_seconds: int):
+    def __init__(self, max_requests: int, window_seconds: int, max_keys: int = 100_000,
+                 scope: str = "rate"):
         self.max_requests = max_requests
         self.window_seconds = window_seconds
-        self.storage: Dict[str, Deque[float]] = defaultdict(deque)
+        self.scope = scope
+        self.storage = make_counter(scope, window_seconds, max_keys)
 
     def check(self, key: str) -> bool:
         """
         True = можно
         False = лимит превышен
         """
-        now = time.time()
-        q = self.storage[key]
-
-        # очищаем старые запросы
-        while q and q[0] < now - self.window_seconds:
-            q.popleft()
-
-        if len(q) >= self.max_requests:
-            return False
-
-        q.append(now)
-        return True
-
-
-rate_limiter = RateLimiter(max_requests=20, window_seconds=10)
+        allowed = self.storage.try_acquire(key, self.max_requests)
+        record_decision(self.scope, allowed)
+        return allowed
+
+
+rate_limiter = RateLimiter(
+    max_requests=20,
+    window_seconds=10,
+    max_keys=settings.RATE_LIMIT_MAX_KEYS,
+)
+
+# PUT кусков докачиваемой загрузки: частые и мелкие, свой лимит
+chunk_rate_limiter = RateLimiter(
+    max_requests=settings.UPLOAD_CHUNK_RATE_LIMIT,
+    window_seconds=10,
+    max_keys=settings.RATE_LIMIT_MAX_KEYS,
+    scope="upload_chunk",
+)
@@ -1,23 +1,154 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 from jose import jwt
 from passlib.context import CryptContext
 
 from app.core.config import settings
+from app.core.metrics import registry
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# min/max = rounds: хэши с другой стоимостью считаются устаревшими
+# и пересчитываются при следующем входе
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__max_rounds=settings.BCRYPT_ROUNDS,
+)
 
 ALGORITHM = "HS256"
 
 
-def hash_password(password: str) -> str:
+class HasherBusy(Exception):
+    pass
+
+
+def _hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+def _verify_and_update(password: str, password_hash: str) -> tuple[bool, str | None]:
+    return pwd_context.verify_and_update(password, password_hash)
+
+
+
+
+class PasswordHasherPool:
+    """
+    bcrypt в отдельных процессах: вычисления не занимают потоки
+    веб-сервера. Ожидающих задач не больше max_pending - остальные
+    сразу получают HasherBusy (503), а не копятся в очереди.
+    """
+
+    def __init__(self, workers: int, max_pending: int, wait_timeout: float):
+        self.workers = workers or os.cpu_count() or 1
+        self.wait_timeout = wait_timeout
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(self.workers + max_pending)
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
+        return self._executor
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            self.rejected += 1
+            raise HasherBusy()
+        try:
+            return self._get_executor().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    async def run_async(self, fn, *args):
+        # свободный слот берём сразу, ожидание слота - вне event loop
+        if not self._slots.acquire(blocking=False):
+            acquired = await asyncio.to_thread(self._slots.acquire, True, self.wait_timeout)
+            if not acquired:
+                self.rejected += 1
+                raise HasherBusy()
+        try:
+            return await asyncio.wrap_future(self._get_executor().submit(fn, *args))
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+hasher_pool = PasswordHasherPool(
+    workers=settings.BCRYPT_POOL_WORKERS,
+    max_pending=settings.BCRYPT_MAX_PENDING,
+    wait_timeout=settings.BCRYPT_WAIT_TIMEOUT,
+)
+registry.gauge(
+    "bcrypt_rejected_total", "Password hashing requests rejected as busy",
+    lambda: hasher_pool.rejected, kind="counter",
+)
+
+_dummy_hash: str | None = None
+
+
+def hash_password(password: str) -> str:
+    return hasher_pool.run(_hash, password)
+
+
 def verify_password(password: str, password_hash: str) -> bool:
-    return pwd_context.verify(password, password_hash)
+    ok, _ = verify_and_update_password(password, password_hash)
+    return ok
+
+
+def verify_and_update_password(password: str, password_hash: str) -> tuple[bool, str | None]:
+    """
+    Возвращает (пароль верный, новый хэш если стоимость bcrypt изменилась)
+    """
+    return hasher_pool.run(_verify_and_update, password, password_hash)
+
+
+def verify_dummy(password: str) -> None:
+    """
+    Проверка против фиктивного хэша для несуществующего пользователя: тот же
+    пул, та же очередь и тот же HasherBusy (503), что и для настоящего -
+    ни код ответа, ни время не выдают, есть ли такой пользователь.
+    Первый вызов вместо проверки считает сам хэш - это та же стоимость bcrypt
+    """
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password("dummy-password")
+        return
+    verify_and_update_password(password, _dummy_hash)
+
+
+async def hash_password_async(password: str) -> str:
+    return await hasher_pool.run_async(_hash, password)
+
+
+async def verify_and_update_password_async(password: str, password_hash: str) -> tuple[bool, str | None]:
+    return await hasher_pool.run_async(_verify_and_update, password, password_hash)
+
+
+async def verify_dummy_async(password: str) -> None:
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = await hash_password_async("dummy-password")
+        return
+    await verify_and_update_password_async(password, _dummy_hash)
 
 
-def create_access_token(subject: str, expires_minutes: int = 60) -> str:
+def create_access_token(subject: str, expires_minutes: int = 60, claims: dict | None = None) -> str:
     expire = datetime.utcnow() + timedelta(minutes=expires_minutes)
-    payload = {"sub": subject, "exp": expire}
+    payload = {**(claims or {}), "sub": subject, "exp": expire}
     return jwt.encode(payload, settings.SECRET_KEY, algorithm=ALGORITHM)
@@ -0,0 +1,324 @@
+"""
+Общее состояние лимитеров для нескольких воркеров/реплик.
+
+Каждый процесс держит локальную копию счётчиков ключа и ходит в общее
+хранилище только когда копия устарела (sync_interval), сменилось окно
+или ключ близок к лимиту. Локальные приращения досылаются пачкой
+фоновым потоком.
+"""
+import abc
+import fcntl
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing import resource_tracker, shared_memory
+
+from sqlalchemy import delete, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.core.logging import get_security_logger
+from app.db.models import RateLimitCounter
+
+sec_logger = get_security_logger()
+
+
+class _Synced:
+    __slots__ = ("index", "prev", "curr", "pending", "synced_at")
+
+    def __init__(self):
+        self.index = -1
+        self.prev = 0
+        self.curr = 0
+        self.pending = 0
+        self.synced_at = float("-inf")
+
+
+class SharedCounter(abc.ABC):
+    """
+    Скользящее окно на двух счётчиках (как SlidingWindowCounter),
+    но счётчики лежат в общем хранилище. Наследники реализуют
+    _push, _push_many и _expire.
+    """
+
+    # ближе этой доли лимита решение принимается только по общему состоянию
+    near_limit_ratio = 0.8
+
+    def __init__(self, window_seconds: float, sync_interval: float, max_keys: int = 100_000):
+        self.window = window_seconds
+        self.sync_interval = sync_interval
+        self.max_keys = max_keys
+        self.round_trips = 0
+        self._local: OrderedDict[str, _Synced] = OrderedDict()
+        self._lock = threading.Lock()
+        self._flusher: threading.Thread | None = None
+
+    @abc.abstractmethod
+    def _push(self, key: str, index: int, amount: int) -> tuple[int, int]:
+        """
+        Прибавляет amount к счётчику окна index и возвращает
+        (счётчик окна index - 1, счётчик окна index)
+        """
+
+    @abc.abstractmethod
+    def _push_many(self, items: list[tuple[str, int, int]]):
+        """
+        Досылает пачку приращений (key, index, amount) из flush(),
+        прочитанные счётчики не нужны
+        """
+
+    @abc.abstractmethod
+    def _expire(self, now: float):
+        """Убирает из хранилища счётчики окон старше предыдущего"""
+
+    def _entry(self, key: str) -> _Synced:
+        entry = self._local.get(key)
+        if entry is None:
+            entry = self._local[key] = _Synced()
+            if len(self._local) > self.max_keys:
+                evicted_key, evicted = self._local.popitem(last=False)
+                if evicted.pending:
+                    self._push(evicted_key, evicted.index, evicted.pending)
+        else:
+            self._local.move_to_end(key)
+        return entry
+
+    def _sync(self, key: str, entry: _Synced, now: float):
+        index = int(now // self.window)
+        if entry.pending and 0 <= entry.index != index:
+            # приращения прошлого окна относятся к нему;
+            # у нового ключа окна ещё нет - они уходят в текущее
+            self._push(key, entry.index, entry.pending)
+            entry.pending = 0
+
+        entry.prev, entry.curr = self._push(key, index, entry.pending)
+        entry.index = index
+        entry.pending = 0
+        entry.synced_at = now
+        self.round_trips += 1
+
+    def _fresh(self, key: str, now: float) -> _Synced:
+        self._ensure_flusher()
+        entry = self._entry(key)
+        if entry.index != int(now // self.window) or now - entry.synced_at >= self.sync_interval:
+            self._sync(key, entry, now)
+        return entry
+
+    def _estimate(self, entry: _Synced, now: float) -> float:
+        elapsed = now / self.window - entry.index
+        return entry.prev * (1.0 - elapsed) + entry.curr + entry.pending
+
+    def add(self, key: str, amount: int = 1):
+        # явные события (неудачный вход) отправляются сразу,
+        # чтобы блокировка действовала во всех воркерах
+        now = time.time()
+        with self._lock:
+            entry = self._entry(key)
+            entry.pending += amount
+            self._sync(key, entry, now)
+
+    def count(self, key: str) -> float:
+        now = time.time()
+        with self._lock:
+            return self._estimate(self._fresh(key, now), now)
+
+    def try_acquire(self, key: str, limit: int) -> bool:
+        now = time.time()
+        with self._lock:
+            entry = self._fresh(key, now)
+            if self._estimate(entry, now) + 1 >= limit * self.near_limit_ratio:
+                if entry.synced_at != now:
+                    self._sync(key, entry, now)
+                if self._estimate(entry, now) >= limit:
+                    return False
+            entry.pending += 1
+            return True
+
+    def flush(self):
+        now = time.time()
+        with self._lock:
+            items = []
+            for key, entry in self._local.items():
+                if entry.pending:
+                    items.append((key, entry.index, entry.pending))
+                    entry.curr += entry.pending
+                    entry.pending = 0
+        if items:
+            self._push_many(items)
+        self._expire(now)
+
+    def _ensure_flusher(self):
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.sync_interval)
+            try:
+                self.flush()
+            except Exception:
+                sec_logger.exception("Rate limit counters flush failed")
+
+    def __len__(self) -> int:
+        return len(self._local)
+
+
+class ShmCounter(SharedCounter):
+    """
+    Счётчики в разделяемой памяти - для воркеров одного хоста.
+    Открытая адресация: слот = hash ключа, номер окна, prev, curr.
+    Слоты с истёкшими окнами переиспользуются, при переполнении
+    вытесняется слот с самым старым окном.
+    """
+
+    SLOT = struct.Struct("<QqII")
+    PROBES = 8
+
+    def __init__(self, name: str, window_seconds: float, sync_interval: float,
+                 slots: int = 65536, max_keys: int = 100_000):
+        super().__init__(window_seconds, sync_interval, max_keys)
+        self.slots = slots
+        size = slots * self.SLOT.size
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            self._shm = shared_memory.SharedMemory(name=name)
+        # сегмент живёт, пока жив хоть один воркер: не даём
+        # resource_tracker удалить его при выходе первого процесса
+        resource_tracker.unregister(self._shm._name, "shared_memory")
+
+        lock_path = os.path.join(tempfile.gettempdir(), f"{name}.lock")
+        self._lock_fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        h = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little")
+        return h or 1
+
+    def _push(self, key: str, index: int, amount: int) -> tuple[int, int]:
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        try:
+            return self._add(self._hash(key), index, amount)
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _push_many(self, items: list[tuple[str, int, int]]):
+        # вся пачка под одной блокировкой
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        try:
+            for key, index, amount in items:
+                self._add(self._hash(key), index, amount)
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _expire(self, now: float):
+        # удалять нечего: слоты с истёкшими окнами переиспользуются в _add
+        pass
+
+    def _add(self, h: int, index: int, amount: int) -> tuple[int, int]:
+        # вызывается под flock
+        buf = self._shm.buf
+        victim, victim_index = None, None
+        for probe in range(self.PROBES):
+            pos = ((h + probe) % self.slots) * self.SLOT.size
+            slot_hash, slot_index, prev, curr = self.SLOT.unpack_from(buf, pos)
+            if slot_hash == h:
+                victim = pos
+                break
+            if slot_hash == 0 or slot_index < index - 1:
+                # пустой или простаивающий слот
+                victim = pos
+                break
+            if victim_index is None or slot_index < victim_index:
+                victim, victim_index = pos, slot_index
+
+        slot_hash, slot_index, prev, curr = self.SLOT.unpack_from(buf, victim)
+        if slot_hash != h:
+            slot_index, prev, curr = index, 0, 0
+        if slot_index != index:
+            prev = curr if index == slot_index + 1 else 0
+            curr = 0
+        curr += amount
+        self.SLOT.pack_into(buf, victim, h, index, prev, curr)
+        return prev, curr
+
+
+class PostgresCounter(SharedCounter):
+    """
+    Счётчики в таблице rate_limit_counters - для нескольких реплик.
+    Приращение - атомарный upsert, старые окна удаляются пачкой.
+    """
+
+    PUSH_SQL = text(
+        """
+        WITH up AS (
+            INSERT INTO rate_limit_counters (scope, key, window_index, count)
+            VALUES (:scope, :key, :index, :amount)
+            ON CONFLICT (scope, key, window_index)
+            DO UPDATE SET count = rate_limit_counters.count + EXCLUDED.count
+            RETURNING count
+        )
+        SELECT
+            (SELECT count FROM rate_limit_counters
+             WHERE scope = :scope AND key = :key AND window_index = :index - 1),
+            (SELECT count FROM up)
+        """
+    )
+
+    def __init__(self, scope: str, engine, window_seconds: float, sync_interval: float,
+                 max_keys: int = 100_000):
+        super().__init__(window_seconds, sync_interval, max_keys)
+        self.scope = scope
+        self.engine = engine
+        self._next_expire = 0.0
+
+    def _push(self, key: str, index: int, amount: int) -> tuple[int, int]:
+        params = {"scope": self.scope, "key": key, "index": index, "amount": amount}
+        with self.engine.begin() as conn:
+            if amount:
+                prev, curr = conn.execute(self.PUSH_SQL, params).one()
+                return prev or 0, curr
+
+            # только чтение: строк для ключей без событий не создаём
+            counts = dict(
+                conn.execute(
+                    select(RateLimitCounter.window_index, RateLimitCounter.count).where(
+                        RateLimitCounter.scope == self.scope,
+                        RateLimitCounter.key == key,
+                        RateLimitCounter.window_index.in_((index - 1, index)),
+                    )
+                ).all()
+            )
+        return counts.get(index - 1, 0), counts.get(index, 0)
+
+    def _push_many(self, items: list[tuple[str, int, int]]):
+        stmt = pg_insert(RateLimitCounter).values(
+            [
+                {"scope": self.scope, "key": key, "window_index": index, "count": amount}
+                for key, index, amount in items
+            ]
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["scope", "key", "window_index"],
+            set_={"count": RateLimitCounter.count + stmt.excluded.count},
+        )
+        with self.engine.begin() as conn:
+            conn.execute(stmt)
+
+    def _expire(self, now: float):
+        if now < self._next_expire:
+            return
+        self._next_expire = now + self.window
+
+        oldest = int(now // self.window) - 1
+        with self.engine.begin() as conn:
+            conn.execute(
+                delete(RateLimitCounter).where(
+                    RateLimitCounter.scope == self.scope,
+                    RateLimitCounter.window_index < oldest,
+                )
+            )
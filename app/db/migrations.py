@@ -0,0 +1,407 @@
+"""
+Версионированные миграции схемы.
+
+Применяются командой `python -m app.cli migrate` (один процесс, под
+advisory-блокировкой), при старте приложение только сверяет версию.
+Миграции с transactional=False выполняются вне транзакции - это нужно
+для CREATE INDEX CONCURRENTLY, который не блокирует запись в таблицу.
+"""
+import logging
+from dataclasses import dataclass
+from typing import Callable
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import ProgrammingError
+
+logger = logging.getLogger(__name__)
+
+# произвольная константа для pg_advisory_lock
+MIGRATION_LOCK_ID = 72_0451
+
+# documents.file_sha256 -> blobs.sha256
+DOCUMENT_BLOB_FK = "documents_file_sha256_fkey"
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    upgrade: Callable[[Connection], None]
+    transactional: bool = True
+
+
+def _execute_all(conn: Connection, statements: list[str]):
+    for stmt in statements:
+        conn.execute(text(stmt))
+
+
+def create_index_concurrently(conn: Connection, name: str, ddl: str):
+    """
+    ddl - CREATE INDEX CONCURRENTLY IF NOT EXISTS ...
+    Если прошлая попытка оборвалась, от неё остаётся невалидный индекс:
+    его удаляем и строим заново.
+    """
+    invalid = conn.scalar(
+        text(
+            "SELECT NOT i.indisvalid FROM pg_index i "
+            "JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"
+        ),
+        {"name": name},
+    )
+    if invalid:
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    conn.execute(text(ddl))
+
+
+def _0001_baseline(conn: Connection):
+    # схема, которую раньше создавал Base.metadata.create_all;
+    # IF NOT EXISTS - чтобы принять уже существующие базы
+    _execute_all(conn, [
+        """
+        DO $$ BEGIN
+            CREATE TYPE role AS ENUM ('user', 'executor', 'admin');
+        EXCEPTION WHEN duplicate_object THEN NULL; END $$
+        """,
+        """
+        DO $$ BEGIN
+            CREATE TYPE documenttype AS ENUM ('contract', 'invoice', 'report');
+        EXCEPTION WHEN duplicate_object THEN NULL; END $$
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            username VARCHAR(50) NOT NULL UNIQUE,
+            password_hash VARCHAR(255) NOT NULL,
+            role role NOT NULL,
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS documents (
+            id SERIAL PRIMARY KEY,
+            title VARCHAR(255) NOT NULL,
+            doc_type documenttype NOT NULL,
+            original_filename VARCHAR(255) NOT NULL,
+            stored_filename VARCHAR(255) NOT NULL,
+            file_sha256 VARCHAR(64) NOT NULL,
+            owner_id INTEGER NOT NULL REFERENCES users (id),
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS document_access (
+            id SERIAL PRIMARY KEY,
+            document_id INTEGER NOT NULL REFERENCES documents (id),
+            user_id INTEGER NOT NULL REFERENCES users (id),
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            CONSTRAINT uq_document_user UNIQUE (document_id, user_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS access_logs (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER,
+            action VARCHAR(50) NOT NULL,
+            document_id INTEGER,
+            success BOOLEAN NOT NULL,
+            reason VARCHAR(255),
+            ip VARCHAR(50),
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+        )
+        """,
+    ])
+
+
+def _0002_blobs(conn: Connection):
+    _execute_all(conn, [
+        """
+        CREATE TABLE IF NOT EXISTS blobs (
+            sha256 VARCHAR(64) PRIMARY KEY,
+            stored_filename VARCHAR(255) NOT NULL,
+            size BIGINT NOT NULL,
+            ref_count INTEGER NOT NULL,
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+        )
+        """,
+    ])
+    # NOT VALID: новые строки проверяются сразу, а у документов, загруженных
+    # до blob'ов, строк ещё нет - их создаёт `python -m app.cli migrate-blobs`
+    # и он же затем проверяет ограничение
+    conn.execute(text(
+        f"""
+        DO $$ BEGIN
+            ALTER TABLE documents ADD CONSTRAINT {DOCUMENT_BLOB_FK}
+                FOREIGN KEY (file_sha256) REFERENCES blobs (sha256) NOT VALID;
+        EXCEPTION WHEN duplicate_object THEN NULL; END $$
+        """
+    ))
+    legacy = conn.scalar(text(
+        "SELECT EXISTS (SELECT 1 FROM documents d "
+        "WHERE NOT EXISTS (SELECT 1 FROM blobs b WHERE b.sha256 = d.file_sha256))"
+    ))
+    if not legacy:
+        conn.execute(text(f"ALTER TABLE documents VALIDATE CONSTRAINT {DOCUMENT_BLOB_FK}"))
+
+
+def _0003_rate_limit_counters(conn: Connection):
+    _execute_all(conn, [
+        """
+        CREATE TABLE IF NOT EXISTS rate_limit_counters (
+            scope VARCHAR(32) NOT NULL,
+            key VARCHAR(255) NOT NULL,
+            window_index BIGINT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (scope, key, window_index)
+        )
+        """,
+    ])
+
+
+def _0004_query_indexes(conn: Connection):
+    # индексы под фактические запросы роутеров
+    indexes = {
+        # проверка дубликата при загрузке: owner_id + file_sha256
+        "ix_documents_owner_sha256":
+            "ON documents (owner_id, file_sha256)",
+        # список документов владельца с курсором по id
+        "ix_documents_owner_id":
+            "ON documents (owner_id, id)",
+        # ссылки на blob (проверка внешнего ключа при удалении blob'а)
+        "ix_documents_file_sha256":
+            "ON documents (file_sha256)",
+        # документы, выданные пользователю (EXISTS в списке, ACL)
+        "ix_document_access_user_doc":
+            "ON document_access (user_id, document_id)",
+        # журнал: выборки по времени с фильтрами по пользователю/документу
+        "ix_access_logs_created_user_doc":
+            "ON access_logs (created_at, user_id, document_id)",
+        "ix_access_logs_user_created":
+            "ON access_logs (user_id, created_at)",
+    }
+    for name, definition in indexes.items():
+        create_index_concurrently(
+            conn, name, f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} {definition}"
+        )
+
+    # дублируют первичные ключи (index=True на id) и только замедляют запись
+    conn.execute(text("DROP INDEX CONCURRENTLY IF EXISTS ix_documents_id"))
+    conn.execute(text("DROP INDEX CONCURRENTLY IF EXISTS ix_users_id"))
+
+
+def _0005_partition_access_logs(conn: Connection):
+    partitioned = conn.scalar(
+        text("SELECT relkind = 'p' FROM pg_class WHERE relname = 'access_logs'")
+    )
+    if not partitioned:
+        # существующая таблица становится секцией "всё до следующего месяца",
+        # дальше секции по месяцам создаёт обслуживание журнала
+        bound = conn.scalar(text(
+            "SELECT date_trunc('month', now() at time zone 'utc') + interval '1 month'"
+        ))
+        # долгие шаги - без блокировки записи: PK секции (id, created_at)
+        # строится CONCURRENTLY, а CHECK с границей проверяется VALIDATE
+        # (SHARE UPDATE EXCLUSIVE) - тогда ATTACH не сканирует строки
+        create_index_concurrently(
+            conn,
+            "access_logs_legacy_pkey",
+            "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS access_logs_legacy_pkey "
+            "ON access_logs (id, created_at)",
+        )
+        _execute_all(conn, [
+            "ALTER TABLE access_logs DROP CONSTRAINT IF EXISTS access_logs_legacy_bound",
+            "ALTER TABLE access_logs ADD CONSTRAINT access_logs_legacy_bound "
+            f"CHECK (created_at < '{bound.isoformat()}') NOT VALID",
+            "ALTER TABLE access_logs VALIDATE CONSTRAINT access_logs_legacy_bound",
+        ])
+
+        # сама замена - одной короткой транзакцией
+        with conn.engine.begin() as tx:
+            _execute_all(tx, [
+                "ALTER TABLE access_logs RENAME TO access_logs_legacy",
+                "ALTER TABLE access_logs_legacy DROP CONSTRAINT access_logs_pkey",
+                "ALTER TABLE access_logs_legacy ADD PRIMARY KEY USING INDEX access_logs_legacy_pkey",
+                "ALTER INDEX ix_access_logs_created_user_doc RENAME TO ix_access_logs_legacy_created_user_doc",
+                "ALTER INDEX ix_access_logs_user_created RENAME TO ix_access_logs_legacy_user_created",
+                """
+                CREATE TABLE access_logs (
+                    id INTEGER NOT NULL DEFAULT nextval('access_logs_id_seq'),
+                    user_id INTEGER,
+                    action VARCHAR(50) NOT NULL,
+                    document_id INTEGER,
+                    success BOOLEAN NOT NULL,
+                    reason VARCHAR(255),
+                    ip VARCHAR(50),
+                    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+                    PRIMARY KEY (id, created_at)
+                ) PARTITION BY RANGE (created_at)
+                """,
+                "ALTER SEQUENCE access_logs_id_seq OWNED BY access_logs.id",
+                "CREATE INDEX ix_access_logs_created_user_doc ON access_logs (created_at, user_id, document_id)",
+                "CREATE INDEX ix_access_logs_user_created ON access_logs (user_id, created_at)",
+                "ALTER TABLE access_logs ATTACH PARTITION access_logs_legacy "
+                f"FOR VALUES FROM (MINVALUE) TO ('{bound.isoformat()}')",
+                # после ATTACH ограничение дублирует границу секции
+                "ALTER TABLE access_logs_legacy DROP CONSTRAINT access_logs_legacy_bound",
+                # страховка на случай, если секции наперёд не успели создать;
+                # попавшие сюда строки ensure_partitions переносит в свою секцию
+                "CREATE TABLE access_logs_default PARTITION OF access_logs DEFAULT",
+            ])
+
+    _execute_all(conn, [
+        """
+        CREATE TABLE IF NOT EXISTS access_log_daily (
+            id BIGSERIAL PRIMARY KEY,
+            day DATE NOT NULL,
+            user_id INTEGER,
+            document_id INTEGER,
+            action VARCHAR(50) NOT NULL,
+            success BOOLEAN NOT NULL,
+            count BIGINT NOT NULL,
+            CONSTRAINT uq_access_log_daily
+                UNIQUE NULLS NOT DISTINCT (day, user_id, document_id, action, success)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_access_log_daily_day_id ON access_log_daily (day, id)",
+    ])
+
+
+def _0006_blob_codec(conn: Connection):
+    # ADD COLUMN с константным DEFAULT не переписывает таблицу
+    conn.execute(text(
+        "ALTER TABLE blobs "
+        "ADD COLUMN IF NOT EXISTS codec VARCHAR(16) NOT NULL DEFAULT 'identity', "
+        "ADD COLUMN IF NOT EXISTS stored_size BIGINT"
+    ))
+
+
+def _0007_upload_sessions(conn: Connection):
+    _execute_all(conn, [
+        """
+        CREATE TABLE IF NOT EXISTS upload_sessions (
+            id VARCHAR(32) PRIMARY KEY,
+            owner_id INTEGER NOT NULL REFERENCES users (id),
+            title VARCHAR(255) NOT NULL,
+            doc_type documenttype NOT NULL,
+            original_filename VARCHAR(255) NOT NULL,
+            total_size BIGINT NOT NULL,
+            expected_sha256 VARCHAR(64),
+            received BIGINT NOT NULL,
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            expires_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_upload_sessions_owner_id ON upload_sessions (owner_id)",
+        "CREATE INDEX IF NOT EXISTS ix_upload_sessions_expires_at ON upload_sessions (expires_at)",
+    ])
+
+
+def _0008_document_search(conn: Connection):
+    # полнотекстовый поиск по названию и имени файла (GET /documents/search);
+    # выражение совпадает с DOCUMENT_SEARCH_VECTOR в models.py
+    create_index_concurrently(
+        conn,
+        "ix_documents_search",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_documents_search ON documents USING gin (("
+        "setweight(to_tsvector('simple', regexp_replace(title, '[^[:alnum:]]+', ' ', 'g')), 'A')"
+        " || setweight(to_tsvector('simple', regexp_replace(original_filename, '[^[:alnum:]]+', ' ', 'g')), 'B')"
+        "))",
+    )
+
+
+def _0009_acl_versions(conn: Connection):
+    _execute_all(conn, [
+        """
+        CREATE TABLE IF NOT EXISTS acl_versions (
+            user_id INTEGER PRIMARY KEY REFERENCES users (id),
+            version BIGINT NOT NULL
+        )
+        """,
+    ])
+
+
+MIGRATIONS: list[Migration] = [
+    Migration(1, "baseline", _0001_baseline),
+    Migration(2, "blobs", _0002_blobs),
+    Migration(3, "rate_limit_counters", _0003_rate_limit_counters),
+    Migration(4, "query_indexes", _0004_query_indexes, transactional=False),
+    Migration(5, "partition_access_logs", _0005_partition_access_logs, transactional=False),
+    Migration(6, "blob_codec", _0006_blob_codec),
+    Migration(7, "upload_sessions", _0007_upload_sessions),
+    Migration(8, "document_search", _0008_document_search, transactional=False),
+    Migration(9, "acl_versions", _0009_acl_versions),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+class SchemaOutdated(RuntimeError):
+    pass
+
+
+def current_version(conn: Connection) -> int:
+    try:
+        return conn.scalar(text("SELECT max(version) FROM schema_migrations")) or 0
+    except ProgrammingError:
+        # таблицы ещё нет - миграции не применялись
+        conn.rollback()
+        return 0
+
+
+def check_schema_version(engine: Engine):
+    """
+    Проверка при старте: один запрос, без изменений схемы
+    """
+    with engine.connect() as conn:
+        version = current_version(conn)
+    if version < LATEST_VERSION:
+        raise SchemaOutdated(
+            f"Database schema version {version} < {LATEST_VERSION}, "
+            f"run `python -m app.cli migrate`"
+        )
+
+
+def upgrade(engine: Engine, log: Callable[[str], None] | None = None) -> int:
+    """
+    Применяет недостающие миграции. Возвращает число применённых.
+    Ход применения пишется в log (по умолчанию - logger модуля).
+    """
+    log = log or logger.info
+    applied = 0
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # несколько реплик могут запустить миграции одновременно
+        conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        try:
+            conn.execute(text(
+                "CREATE TABLE IF NOT EXISTS schema_migrations ("
+                " version INTEGER PRIMARY KEY,"
+                " name VARCHAR(100) NOT NULL,"
+                " applied_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (now() at time zone 'utc'))"
+            ))
+            version = current_version(conn)
+            conn.commit()
+
+            for migration in MIGRATIONS:
+                if migration.version <= version:
+                    continue
+                log(f"applying {migration.version:04d}_{migration.name}")
+                if migration.transactional:
+                    with engine.begin() as tx:
+                        migration.upgrade(tx)
+                        _record(tx, migration)
+                else:
+                    # соединение в AUTOCOMMIT: каждый оператор - отдельно
+                    migration.upgrade(conn)
+                    _record(conn, migration)
+                    conn.commit()
+                applied += 1
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+    return applied
+
+
+def _record(conn: Connection, migration: Migration):
+    conn.execute(
+        text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name)"),
+        {"version": migration.version, "name": migration.name},
+    )
@@ -1,8 +1,8 @@
 import enum
-from datetime import datetime
+from datetime import date, datetime
 
 from sqlalchemy import (
-    String, Integer, DateTime, Enum, ForeignKey, Boolean, UniqueConstraint
+    String, Integer, BigInteger, Date, DateTime, Enum, ForeignKey, Boolean, UniqueConstraint, Index, text
 )
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
@@ -24,7 +24,7 @@ class DocumentType(str, enum.Enum):
 class User(Base):
     __tablename__ = "users"
 
-    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
     username: Mapped[str] = mapped_column(String(50), unique=True, nullable=False)
     password_hash: Mapped[str] = mapped_column(String(255), nullable=False)
     role: Mapped[Role] = mapped_column(Enum(Role), default=Role.user, nullable=False)
@@ -32,10 +32,45 @@ class User(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
 
+class Blob(Base):
+    """
+    Содержимое файла в хранилище: один файл на каждый уникальный sha256,
+    ref_count - сколько документов на него ссылается
+    """
+    __tablename__ = "blobs"
+
+    sha256: Mapped[str] = mapped_column(String(64), primary_key=True)
+    stored_filename: Mapped[str] = mapped_column(String(255), nullable=False)
+    size: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    # identity | gzip | zstd; stored_size - размер файла на диске
+    codec: Mapped[str] = mapped_column(String(16), default="identity", server_default="identity", nullable=False)
+    stored_size: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+    ref_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+# поисковый вектор документа: слова названия (вес A) и имени файла (вес B),
+# знаки препинания - разделители ("report_2024.pdf" -> report, 2024, pdf).
+# Запрос должен использовать ровно это выражение, иначе индекс
+# ix_documents_search (миграция 0006) не применится
+DOCUMENT_SEARCH_VECTOR = (
+    "setweight(to_tsvector('simple', regexp_replace(title, '[^[:alnum:]]+', ' ', 'g')), 'A')"
+    " || setweight(to_tsvector('simple', regexp_replace(original_filename, '[^[:alnum:]]+', ' ', 'g')), 'B')"
+)
+
+
 class Document(Base):
     __tablename__ = "documents"
+    # создаются миграциями 0002 и 0006 (CONCURRENTLY), здесь - для справки
+    __table_args__ = (
+        Index("ix_documents_owner_sha256", "owner_id", "file_sha256"),
+        Index("ix_documents_owner_id", "owner_id", "id"),
+        Index("ix_documents_file_sha256", "file_sha256"),
+        Index("ix_documents_search", text(DOCUMENT_SEARCH_VECTOR), postgresql_using="gin"),
+    )
 
-    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
 
     title: Mapped[str] = mapped_column(String(255), nullable=False)
     doc_type: Mapped[DocumentType] = mapped_column(Enum(DocumentType), nullable=False)
@@ -43,7 +78,7 @@ class Document(Base):
     original_filename: Mapped[str] = mapped_column(String(255), nullable=False)
     stored_filename: Mapped[str] = mapped_column(String(255), nullable=False)
 
-    file_sha256: Mapped[str] = mapped_column(String(64), nullable=False)
+    file_sha256: Mapped[str] = mapped_column(ForeignKey("blobs.sha256"), nullable=False)
 
     owner_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
 
@@ -52,6 +87,28 @@ class Document(Base):
     owner = relationship("User")
 
 
+class UploadSession(Base):
+    """
+    Докачиваемая загрузка: куски пишутся в файл .upload-<id> по смещению,
+    received - сколько байт подряд уже принято
+    """
+    __tablename__ = "upload_sessions"
+
+    id: Mapped[str] = mapped_column(String(32), primary_key=True)
+    owner_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False, index=True)
+
+    title: Mapped[str] = mapped_column(String(255), nullable=False)
+    doc_type: Mapped[DocumentType] = mapped_column(Enum(DocumentType), nullable=False)
+    original_filename: Mapped[str] = mapped_column(String(255), nullable=False)
+
+    total_size: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    expected_sha256: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    received: Mapped[int] = mapped_column(BigInteger, default=0, nullable=False)
+
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True)
+
+
 class DocumentAccess(Base):
     """
     Таблица "назначенных пользователей" (кто имеет доступ к документу)
@@ -59,6 +116,7 @@ class DocumentAccess(Base):
     __tablename__ = "document_access"
     __table_args__ = (
         UniqueConstraint("document_id", "user_id", name="uq_document_user"),
+        Index("ix_document_access_user_doc", "user_id", "document_id"),
     )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -68,13 +126,30 @@ class DocumentAccess(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
 
+class AclVersion(Base):
+    """
+    Версия прав пользователя: растёт при каждой выдаче/отзыве доступа,
+    по ней процессы узнают, что кэш ACL устарел (app/services/acl.py)
+    """
+    __tablename__ = "acl_versions"
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
+    version: Mapped[int] = mapped_column(BigInteger, nullable=False)
+
+
 class AccessLog(Base):
     """
     Журнал доступа: фиксируем ВСЕ попытки доступа
     """
     __tablename__ = "access_logs"
+    # секционирована по месяцам (миграция 0003), ключ секции входит в PK
+    __table_args__ = (
+        Index("ix_access_logs_created_user_doc", "created_at", "user_id", "document_id"),
+        Index("ix_access_logs_user_created", "user_id", "created_at"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
 
-    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
 
     action: Mapped[str] = mapped_column(String(50), nullable=False)  # upload/download/view/delete
@@ -84,4 +159,40 @@ class AccessLog(Base):
     reason: Mapped[str | None] = mapped_column(String(255), nullable=True)
 
     ip: Mapped[str | None] = mapped_column(String(50), nullable=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(DateTime, primary_key=True, default=datetime.utcnow)
+
+
+class AccessLogDaily(Base):
+    """
+    Суточные итоги журнала: число событий по (user, document, action, success).
+    Переживают удаление старых секций access_logs
+    """
+    __tablename__ = "access_log_daily"
+    __table_args__ = (
+        UniqueConstraint(
+            "day", "user_id", "document_id", "action", "success",
+            name="uq_access_log_daily",
+            postgresql_nulls_not_distinct=True,
+        ),
+        Index("ix_access_log_daily_day_id", "day", "id"),
+    )
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    day: Mapped[date] = mapped_column(Date, nullable=False)
+    user_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    document_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    action: Mapped[str] = mapped_column(String(50), nullable=False)
+    success: Mapped[bool] = mapped_column(Boolean, nullable=False)
+    count: Mapped[int] = mapped_column(BigInteger, nullable=False)
+
+
+class RateLimitCounter(Base):
+    """
+    Общие счётчики лимитеров (скользящее окно) для нескольких реплик
+    """
+    __tablename__ = "rate_limit_counters"
+
+    scope: Mapped[str] = mapped_column(String(32), primary_key=True)
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    window_index: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
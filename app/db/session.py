@@ -1,12 +1,46 @@
 from sqlalchemy import create_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
 from app.core.config import settings
+from app.core.metrics import instrument_engine, registry, timed_pool
 
-engine = create_engine(settings.DATABASE_URL, pool_pre_ping=True)
+engine = create_engine(
+    settings.DATABASE_URL,
+    pool_pre_ping=True,
+    poolclass=timed_pool(QueuePool, "sync"),
+)
+instrument_engine(engine, "sync")
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# async-движок создаётся только в режиме DB_MODE=async
+async_engine = None
+AsyncSessionLocal = None
+if settings.DB_MODE == "async":
+    async_engine = create_async_engine(
+        settings.ASYNC_DATABASE_URL,
+        pool_pre_ping=True,
+        poolclass=timed_pool(AsyncAdaptedQueuePool, "async"),
+    )
+    instrument_engine(async_engine.sync_engine, "async")
+    AsyncSessionLocal = async_sessionmaker(
+        async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+    )
+
+
+def _pool_state() -> dict[tuple, float]:
+    state = {}
+    for name, eng in (("sync", engine), ("async", async_engine)):
+        if eng is not None:
+            state[(name, "checked_out")] = eng.pool.checkedout()
+            state[(name, "idle")] = eng.pool.checkedin()
+    return state
+
+
+registry.gauge("db_pool_connections", "Pooled connections by state", _pool_state, ("engine", "state"))
+
 
 def get_db():
     db = SessionLocal()
@@ -14,3 +48,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -1,19 +1,88 @@
-from fastapi import FastAPI
+from fastapi import APIRouter, FastAPI
+from fastapi.responses import PlainTextResponse
+from fastapi.routing import APIRoute
 
-from app.db.base import Base
-from app.db.session import engine
+from app.core.config import settings
+from app.db.migrations import check_schema_version
+from app.db.session import engine, async_engine
 from app.routers.documents import router as documents_router
 from app.routers.auth import router as auth_router
+from app.routers.audit import router as audit_router
+from app.routers.uploads import router as uploads_router
+from app.services.audit import audit_writer
+from app.services.storage import check_codec
+from app.services.audit_maintenance import audit_maintenance
+from app.core.security import hasher_pool
+from app.core.metrics import MetricsMiddleware, render_metrics
 
 app = FastAPI(title="SED API")
 
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware, sample_rate=settings.METRICS_SAMPLE_RATE)
+
 @app.on_event("startup")
 def on_startup():
-    Base.metadata.create_all(bind=engine)
+    # схему меняет только `python -m app.cli migrate`
+    check_schema_version(engine)
+    check_codec()
+    audit_writer.start()
+    audit_maintenance.start()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    # дописываем накопленные события журнала
+    audit_maintenance.stop()
+    audit_writer.stop()
+    hasher_pool.shutdown()
+    if async_engine is not None:
+        await async_engine.dispose()
+
+
+def include_missing(router: APIRouter, replaced: list[APIRouter]):
+    """
+    Подключает только те маршруты, у которых нет версии в replaced:
+    в режиме async синхронными остаются эндпоинты без async-версии
+    """
+    taken = {
+        (route.path, method)
+        for other in replaced
+        for route in other.routes
+        if isinstance(route, APIRoute)
+        for method in route.methods
+    }
+    remaining = APIRouter()
+    remaining.routes = [
+        route
+        for route in router.routes
+        if not any((route.path, method) in taken for method in route.methods)
+    ]
+    app.include_router(remaining)
+
+
+async_routers: list[APIRouter] = []
+if settings.DB_MODE == "async":
+    from app.routers.auth_async import router as auth_async_router
+    from app.routers.documents_async import router as documents_async_router
+
+    async_routers = [auth_async_router, documents_async_router]
+
+# синхронные - первыми: иначе /documents/search, /documents/access/grant
+# и т.п. перехватили бы async-маршруты /documents/{doc_id}...
+include_missing(auth_router, async_routers)
+include_missing(uploads_router, async_routers)
+include_missing(documents_router, async_routers)
+include_missing(audit_router, async_routers)
+for router in async_routers:
+    app.include_router(router)
 
-app.include_router(auth_router)
-app.include_router(documents_router)
 
 @app.get("/")
 def root():
     return {"status": "ok", "message": "SED API is running"}
+
+
+if settings.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
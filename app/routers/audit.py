@@ -0,0 +1,168 @@
+from datetime import date, datetime
+from typing import Literal
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import Session
+
+from app.db.session import get_db
+from app.db.models import AccessLog, AccessLogDaily
+from app.core.deps import Principal, require_admin
+from app.routers.documents import enforce_rate_limit
+from app.services.audit import log_access
+from app.services.audit_export import iter_export
+
+router = APIRouter(prefix="/audit", tags=["Audit"])
+
+
+def parse_cursor(cursor: str, parse_key):
+    """
+    Курсор "<ключ>~<id>" последней строки предыдущей страницы
+    """
+    try:
+        key, row_id = cursor.rsplit("~", 1)
+        return parse_key(key), int(row_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def apply_filters(stmt, model, user_id, document_id, action, success):
+    if user_id is not None:
+        stmt = stmt.where(model.user_id == user_id)
+    if document_id is not None:
+        stmt = stmt.where(model.document_id == document_id)
+    if action is not None:
+        stmt = stmt.where(model.action == action)
+    if success is not None:
+        stmt = stmt.where(model.success == success)
+    return stmt
+
+
+@router.get("/events")
+def list_events(
+    response: Response,
+    since: datetime | None = Query(None),
+    until: datetime | None = Query(None),
+    user_id: int | None = Query(None),
+    document_id: int | None = Query(None),
+    action: str | None = Query(None),
+    success: bool | None = Query(None),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str | None = Query(None),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(require_admin),
+):
+    """
+    События журнала, новые первыми. Границы по времени отсекают
+    лишние секции access_logs ещё на этапе планирования запроса
+    """
+    enforce_rate_limit(current_user)
+
+    stmt = (
+        select(
+            AccessLog.id,
+            AccessLog.created_at,
+            AccessLog.user_id,
+            AccessLog.document_id,
+            AccessLog.action,
+            AccessLog.success,
+            AccessLog.reason,
+            AccessLog.ip,
+        )
+        .order_by(AccessLog.created_at.desc(), AccessLog.id.desc())
+        .limit(limit)
+    )
+    stmt = apply_filters(stmt, AccessLog, user_id, document_id, action, success)
+    if since is not None:
+        stmt = stmt.where(AccessLog.created_at >= since)
+    if until is not None:
+        stmt = stmt.where(AccessLog.created_at < until)
+    if cursor is not None:
+        stmt = stmt.where(
+            tuple_(AccessLog.created_at, AccessLog.id) < parse_cursor(cursor, datetime.fromisoformat)
+        )
+
+    rows = [row._asdict() for row in db.execute(stmt)]
+    if len(rows) == limit:
+        last = rows[-1]
+        response.headers["X-Next-Cursor"] = f"{last['created_at'].isoformat()}~{last['id']}"
+    return rows
+
+
+@router.get("/daily")
+def list_daily(
+    response: Response,
+    day_from: date | None = Query(None),
+    day_to: date | None = Query(None),
+    user_id: int | None = Query(None),
+    document_id: int | None = Query(None),
+    action: str | None = Query(None),
+    success: bool | None = Query(None),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str | None = Query(None),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(require_admin),
+):
+    """
+    Суточные итоги (access_log_daily), в том числе за удалённые секции
+    """
+    enforce_rate_limit(current_user)
+
+    stmt = (
+        select(
+            AccessLogDaily.id,
+            AccessLogDaily.day,
+            AccessLogDaily.user_id,
+            AccessLogDaily.document_id,
+            AccessLogDaily.action,
+            AccessLogDaily.success,
+            AccessLogDaily.count,
+        )
+        .order_by(AccessLogDaily.day.desc(), AccessLogDaily.id.desc())
+        .limit(limit)
+    )
+    stmt = apply_filters(stmt, AccessLogDaily, user_id, document_id, action, success)
+    if day_from is not None:
+        stmt = stmt.where(AccessLogDaily.day >= day_from)
+    if day_to is not None:
+        stmt = stmt.where(AccessLogDaily.day <= day_to)
+    if cursor is not None:
+        stmt = stmt.where(
+            tuple_(AccessLogDaily.day, AccessLogDaily.id) < parse_cursor(cursor, date.fromisoformat)
+        )
+
+    rows = [row._asdict() for row in db.execute(stmt)]
+    if len(rows) == limit:
+        last = rows[-1]
+        response.headers["X-Next-Cursor"] = f"{last['day'].isoformat()}~{last['id']}"
+    return rows
+
+
+@router.get("/export")
+def export_events(
+    request: Request,
+    format: Literal["ndjson", "csv"] = Query("ndjson"),
+    gzip: bool = Query(False),
+    since: datetime | None = Query(None),
+    until: datetime | None = Query(None),
+    user_id: int | None = Query(None),
+    current_user: Principal = Depends(require_admin),
+):
+    """
+    Полная выгрузка журнала потоком, в порядке (created_at, id)
+    """
+    enforce_rate_limit(current_user)
+    log_access("audit_export", True, current_user.id, None, None, request)
+
+    filename = f"access_logs-{datetime.utcnow():%Y%m%dT%H%M%S}.{format}"
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
+
+    return StreamingResponse(
+        iter_export(format, gzip, since, until, user_id),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
@@ -5,9 +5,15 @@ from sqlalchemy import select
 
 from app.db.session import get_db
 from app.db.models import User, Role
-from app.core.security import hash_password, verify_password, create_access_token
+from app.core.security import (
+    HasherBusy,
+    hash_password,
+    verify_and_update_password,
+    verify_dummy,
+    create_access_token,
+)
 from app.core.config import settings
-from app.core.deps import get_current_user
+from app.core.deps import Principal, get_current_user
 from app.core.bruteforce import bruteforce
 from app.core.logging import get_security_logger
 
@@ -16,6 +22,15 @@ sec_logger = get_security_logger()
 router = APIRouter(prefix="/auth", tags=["Auth"])
 
 
+def busy_error() -> HTTPException:
+    # пул bcrypt переполнен - быстрый отказ вместо очереди
+    return HTTPException(
+        status_code=503,
+        detail="Server busy, try again later",
+        headers={"Retry-After": "1"},
+    )
+
+
 @router.post("/register")
 def register(username: str, password: str, db: Session = Depends(get_db)):
     username = username.strip()
@@ -29,9 +44,14 @@ def register(username: str, password: str, db: Session = Depends(get_db)):
     if exists:
         raise HTTPException(status_code=400, detail="User already exists")
 
+    try:
+        password_hash = hash_password(password)
+    except HasherBusy:
+        raise busy_error()
+
     user = User(
         username=username,
-        password_hash=hash_password(password),
+        password_hash=password_hash,
         role=Role.user,
     )
     db.add(user)
@@ -55,16 +75,34 @@ def login(
         raise HTTPException(status_code=429, detail="Too many login attempts")
 
     user = db.scalar(select(User).where(User.username == form.username))
-    if not user or not verify_password(form.password, user.password_hash):
+    try:
+        if user:
+            ok, new_hash = verify_and_update_password(form.password, user.password_hash)
+        else:
+            verify_dummy(form.password)
+            ok, new_hash = False, None
+    except HasherBusy:
+        sec_logger.warning(f"Login rejected, hasher busy user={form.username} ip={ip}")
+        raise busy_error()
+
+    if not ok:
         bruteforce.register_fail(key)
         sec_logger.warning(f"Login failed user={form.username} ip={ip}")
         raise HTTPException(status_code=401, detail="Invalid username or password")
 
-    token = create_access_token(user.username, settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+    # стоимость bcrypt поменялась - сохраняем пересчитанный хэш
+    if new_hash:
+        user.password_hash = new_hash
+        db.commit()
+
+    claims = None
+    if settings.JWT_EMBED_PRINCIPAL:
+        claims = {"uid": user.id, "role": user.role.value}
+    token = create_access_token(user.username, settings.ACCESS_TOKEN_EXPIRE_MINUTES, claims)
     sec_logger.info(f"Login success user={user.username} ip={ip}")
     return {"access_token": token, "token_type": "bearer"}
 
 
 @router.get("/me")
-def me(current_user: User = Depends(get_current_user)):
+def me(current_user: Principal = Depends(get_current_user)):
     return {"id": current_user.id, "username": current_user.username, "role": current_user.role}
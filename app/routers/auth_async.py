@@ -0,0 +1,104 @@
+"""
+async-версия /auth для DB_MODE=async (asyncpg, AsyncSession)
+"""
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+
+from app.db.session import get_async_db
+from app.db.models import User, Role
+from app.core.security import (
+    HasherBusy,
+    hash_password_async,
+    verify_and_update_password_async,
+    verify_dummy_async,
+    create_access_token,
+)
+from app.core.config import settings
+from app.core.deps import Principal, get_current_user_async
+from app.core.bruteforce import bruteforce
+from app.core.limiter import call_limiter
+from app.core.logging import get_security_logger
+from app.routers.auth import busy_error
+
+sec_logger = get_security_logger()
+
+router = APIRouter(prefix="/auth", tags=["Auth"])
+
+
+@router.post("/register")
+async def register(username: str, password: str, db: AsyncSession = Depends(get_async_db)):
+    username = username.strip()
+
+    if len(username) < 3:
+        raise HTTPException(status_code=400, detail="Username too short")
+    if len(password) < 4:
+        raise HTTPException(status_code=400, detail="Password too short")
+
+    exists = await db.scalar(select(User).where(User.username == username))
+    if exists:
+        raise HTTPException(status_code=400, detail="User already exists")
+
+    try:
+        password_hash = await hash_password_async(password)
+    except HasherBusy:
+        raise busy_error()
+
+    user = User(
+        username=username,
+        password_hash=password_hash,
+        role=Role.user,
+    )
+    db.add(user)
+    await db.commit()
+    await db.refresh(user)
+
+    return {"id": user.id, "username": user.username, "role": user.role}
+
+
+@router.post("/login")
+async def login(
+    request: Request,
+    form: OAuth2PasswordRequestForm = Depends(),
+    db: AsyncSession = Depends(get_async_db),
+):
+    ip = request.client.host if request.client else "unknown"
+    key = f"{form.username}:{ip}"
+
+    if await call_limiter(bruteforce.is_blocked, key):
+        sec_logger.warning(f"Bruteforce blocked for user={form.username} ip={ip}")
+        raise HTTPException(status_code=429, detail="Too many login attempts")
+
+    user = await db.scalar(select(User).where(User.username == form.username))
+    try:
+        if user:
+            ok, new_hash = await verify_and_update_password_async(form.password, user.password_hash)
+        else:
+            await verify_dummy_async(form.password)
+            ok, new_hash = False, None
+    except HasherBusy:
+        sec_logger.warning(f"Login rejected, hasher busy user={form.username} ip={ip}")
+        raise busy_error()
+
+    if not ok:
+        await call_limiter(bruteforce.register_fail, key)
+        sec_logger.warning(f"Login failed user={form.username} ip={ip}")
+        raise HTTPException(status_code=401, detail="Invalid username or password")
+
+    # стоимость bcrypt поменялась - сохраняем пересчитанный хэш
+    if new_hash:
+        user.password_hash = new_hash
+        await db.commit()
+
+    claims = None
+    if settings.JWT_EMBED_PRINCIPAL:
+        claims = {"uid": user.id, "role": user.role.value}
+    token = create_access_token(user.username, settings.ACCESS_TOKEN_EXPIRE_MINUTES, claims)
+    sec_logger.info(f"Login success user={user.username} ip={ip}")
+    return {"access_token": token, "token_type": "bearer"}
+
+
+@router.get("/me")
+async def me(current_user: Principal = Depends(get_current_user_async)):
+    return {"id": current_user.id, "username": current_user.username, "role": current_user.role}
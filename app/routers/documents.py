@@ -1,99 +1,177 @@
 import os
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Query, Request
-from fastapi.responses import FileResponse
+import re
+from datetime import datetime
+from typing import Literal
+
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import select
+from pydantic import BaseModel, Field
+from sqlalchemy import Float, select, delete, exists, func, insert, literal_column, or_, text, true, tuple_
 
 from app.core.rate_limit import rate_limiter
 from app.core.logging import get_security_logger
-from app.services.storage import sha256_file
+from app.services.integrity import verify_file, is_verified, iter_verified
+from app.services.delivery import (
+    CONTENT_CODINGS,
+    RangeNotSatisfiable,
+    accepts_encoding,
+    attachment_disposition,
+    etag_for,
+    offload_response,
+    validator_headers,
+    is_not_modified,
+    requested_ranges,
+    partial_response,
+)
 from app.db.session import get_db
-from app.db.models import Document, DocumentType, DocumentAccess, User, Role
-from app.services.storage import save_upload
-from app.services.audit import log_access
+from app.db.models import DOCUMENT_SEARCH_VECTOR, AccessLog, Blob, Document, DocumentType, DocumentAccess, User, Role
+from app.services.storage import (
+    UploadTooLarge,
+    blob_path,
+    codec_of,
+    stage_upload,
+    hash_upload,
+    discard_staged,
+    find_blob,
+    acquire_blob,
+    acquire_blobs,
+    release_blob,
+    purge_tombstone,
+    restore_tombstone,
+)
+from app.services.acl import acl_cache, bump_versions, can_access
+from app.services.audit import access_row, log_access
+from app.services.archive import ArchiveEntry, iter_zip, unique_names
+from app.services.batch_upload import (
+    BatchTooLarge,
+    StagedFile,
+    collect_sources,
+    stage_sources,
+    discard_batch,
+)
 from app.core.config import settings
-from app.core.deps import get_current_user
+from app.core.deps import Principal, get_current_user
 
 router = APIRouter(prefix="/documents", tags=["Documents"])
 
 sec_logger = get_security_logger()
 
 
-def can_access_document(db: Session, user: User, doc: Document) -> bool:
-    if user.role == Role.admin:
-        return True
-    if doc.owner_id == user.id:
-        return True
+def enforce_rate_limit(user: Principal):
+    # общий лимит запросов к документам на пользователя
+    if not rate_limiter.check(f"user:{user.id}"):
+        raise HTTPException(status_code=429, detail="Too many requests")
+
 
-    allowed = db.scalar(
-        select(DocumentAccess).where(
-            DocumentAccess.document_id == doc.id,
+def can_access_document(db: Session, user: Principal, doc: Document) -> bool:
+    # владелец и админ - сразу, выданный доступ - по кэшу ACL
+    return can_access(db, user, doc)
+
+
+def visible_documents_clause(user: Principal):
+    """
+    То же правило, что и can_access_document, но в виде SQL-условия,
+    чтобы фильтровать документы одним запросом
+    """
+    if user.role == Role.admin:
+        return true()
+    return or_(
+        Document.owner_id == user.id,
+        exists().where(
+            DocumentAccess.document_id == Document.id,
             DocumentAccess.user_id == user.id,
-        )
+        ),
     )
-    return allowed is not None
 
 
-@router.post("/upload")
-def upload_document(
-    request: Request,
-    title: str = Query(..., min_length=1),
-    doc_type: DocumentType = Query(...),
-    file: UploadFile = File(...),
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
-):
-    rate_limiter.check(request)
+def document_summary(doc: Document) -> dict:
+    return {
+        "id": doc.id,
+        "title": doc.title,
+        "doc_type": doc.doc_type,
+        "original_filename": doc.original_filename,
+        "owner_id": doc.owner_id,
+        "created_at": doc.created_at,
+    }
 
-    stored_filename, full_path, sha256 = save_upload(file)
 
+def duplicate_query(owner_id: int, sha256: str):
     # защита от повторной загрузки одинакового файла (для этого владельца)
-    duplicate = db.scalar(
-        select(Document).where(
-            Document.owner_id == current_user.id,
-            Document.file_sha256 == sha256,
-        )
+    return select(Document).where(
+        Document.owner_id == owner_id,
+        Document.file_sha256 == sha256,
     )
-    if duplicate:
-        # удаляем лишний файл
-        if os.path.exists(full_path):
-            os.remove(full_path)
 
-        sec_logger.warning(
-            f"Duplicate upload blocked user={current_user.username} doc_id={duplicate.id}"
-        )
-        log_access(
-            db=db,
-            action="upload",
-            success=False,
-            user_id=current_user.id,
-            document_id=None,
-            reason="duplicate_upload",
-            request=request,
-        )
-        raise HTTPException(status_code=409, detail="Duplicate file upload blocked")
 
-    doc = Document(
+def duplicate_error(request: Request, user: Principal, duplicate: Document) -> HTTPException:
+    sec_logger.warning(
+        f"Duplicate upload blocked user={user.username} doc_id={duplicate.id}"
+    )
+    log_access(
+        action="upload",
+        success=False,
+        user_id=user.id,
+        document_id=None,
+        reason="duplicate_upload",
+        request=request,
+    )
+    return HTTPException(status_code=409, detail="Duplicate file upload blocked")
+
+
+# --- общее для sync- и async-роутера (documents_async.py) -------------------
+# запросы к БД у роутеров свои, проверки, журнал и правки кэша ACL - отсюда
+
+def can_manage_document(user: Principal, doc: Document) -> bool:
+    # удалять и выдавать доступ может только владелец или админ
+    return user.role == Role.admin or doc.owner_id == user.id
+
+
+def found_document(request: Request, action: str, user: Principal, doc_id: int, doc: Document | None) -> Document:
+    if not doc:
+        log_access(action, False, user.id, doc_id, "not_found", request)
+        raise HTTPException(status_code=404, detail="Document not found")
+    return doc
+
+
+def ensure_allowed(request: Request, action: str, user: Principal, doc_id: int, allowed: bool):
+    if not allowed:
+        log_access(action, False, user.id, doc_id, "forbidden", request)
+        raise HTTPException(status_code=403, detail="Access denied")
+
+
+def checksum_error(request: Request, user: Principal) -> HTTPException:
+    log_access("upload", False, user.id, None, "checksum_mismatch", request)
+    return HTTPException(status_code=400, detail="Checksum mismatch")
+
+
+def too_large_error(request: Request, user: Principal) -> HTTPException:
+    log_access("upload", False, user.id, None, "too_large", request)
+    return HTTPException(status_code=413, detail="File too large")
+
+
+def new_document(
+    user: Principal,
+    title: str,
+    doc_type: DocumentType,
+    filename: str,
+    stored_filename: str,
+    sha256: str,
+) -> Document:
+    return Document(
         title=title,
         doc_type=doc_type,
-        original_filename=file.filename,
+        original_filename=filename,
         stored_filename=stored_filename,
         file_sha256=sha256,
-        owner_id=current_user.id,
+        owner_id=user.id,
     )
-    db.add(doc)
-    db.commit()
-    db.refresh(doc)
 
-    log_access(
-        db=db,
-        action="upload",
-        success=True,
-        user_id=current_user.id,
-        document_id=doc.id,
-        request=request,
-    )
 
+def uploaded(request: Request, user: Principal, doc: Document) -> dict:
+    # после commit: свой документ - в кэш ACL владельца, запись в журнал
+    acl_cache.document_added(user.id, [doc.id])
+    log_access("upload", True, user.id, doc.id, None, request)
     return {
         "id": doc.id,
         "title": doc.title,
@@ -103,69 +181,706 @@ def upload_document(
     }
 
 
+def check_grant(user: Principal, doc: Document | None, target_user: User | None):
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if not can_manage_document(user, doc):
+        raise HTTPException(status_code=403, detail="No rights to grant access")
+    if not target_user:
+        raise HTTPException(status_code=404, detail="Target user not found")
+
+
+def access_query(doc_id: int, user_id: int):
+    return select(DocumentAccess).where(
+        DocumentAccess.document_id == doc_id,
+        DocumentAccess.user_id == user_id,
+    )
+
+
+def granted(versions: dict[int, int], doc_id: int, user_id: int) -> dict:
+    acl_cache.granted(versions, [doc_id])
+    return {"status": "granted", "doc_id": doc_id, "user_id": user_id}
+
+
+def delete_grants_query(doc_id: int):
+    # выданные доступы удаляются вместе с документом (внешний ключ)
+    return delete(DocumentAccess).where(DocumentAccess.document_id == doc_id).returning(DocumentAccess.user_id)
+
+
+def deleted(request: Request, user: Principal, doc: Document, grantees: list[int]) -> dict:
+    acl_cache.document_removed(doc.id, [doc.owner_id, *grantees])
+    log_access("delete", True, user.id, doc.id, None, request)
+    return {"status": "deleted", "id": doc.id}
+
+
+def list_documents_query(
+    user: Principal,
+    limit: int,
+    after_id: int | None,
+    doc_type: DocumentType | None,
+    owner_id: int | None,
+):
+    # показываем только доступные документы: фильтр доступа и пагинация
+    # выполняются в одном запросе, курсор - id последнего документа страницы
+    stmt = (
+        select(
+            Document.id,
+            Document.title,
+            Document.doc_type,
+            Document.original_filename,
+            Document.owner_id,
+            Document.created_at,
+        )
+        .where(visible_documents_clause(user))
+        .order_by(Document.id.desc())
+        .limit(limit)
+    )
+    if after_id is not None:
+        stmt = stmt.where(Document.id < after_id)
+    if doc_type is not None:
+        stmt = stmt.where(Document.doc_type == doc_type)
+    if owner_id is not None:
+        stmt = stmt.where(Document.owner_id == owner_id)
+    return stmt
+
+
+def search_tsquery(q: str) -> str | None:
+    """
+    Строка поиска -> tsquery: все слова обязательны, каждое как префикс
+    ("дог 2024" -> "дог:* & 2024:*"). В запрос попадают только буквы и цифры.
+    """
+    words = [w for w in re.split(r"[\W_]+", q.lower()) if w][:8]
+    if not words:
+        return None
+    return " & ".join(f"{word}:*" for word in words)
+
+
+def search_documents_query(
+    user: Principal,
+    tsquery: str,
+    limit: int,
+    cursor: tuple[float, int] | None,
+    doc_type: DocumentType | None,
+):
+    # совпадения ищутся по GIN-индексу, ранжируются только найденные;
+    # курсор - (score, id) последнего результата страницы
+    vector = literal_column(DOCUMENT_SEARCH_VECTOR)
+    query = func.to_tsquery(literal_column("'simple'"), tsquery)
+    # real -> double precision: курсор переживает round-trip через float
+    score = func.ts_rank(vector, query).cast(Float(precision=53)).label("score")
+    stmt = (
+        select(
+            Document.id,
+            Document.title,
+            Document.doc_type,
+            Document.original_filename,
+            Document.owner_id,
+            Document.created_at,
+            score,
+        )
+        .where(vector.op("@@")(query), visible_documents_clause(user))
+        .order_by(score.desc(), Document.id.desc())
+        .limit(limit)
+    )
+    if cursor is not None:
+        stmt = stmt.where(tuple_(score, Document.id) < cursor)
+    if doc_type is not None:
+        stmt = stmt.where(Document.doc_type == doc_type)
+    return stmt
+
+
+def check_view_integrity(request: Request, doc: Document, user: Principal):
+    # просмотр метаданных не читает файл, если не включён строгий режим
+    file_path = blob_path(doc.stored_filename)
+    if settings.INTEGRITY_STRICT and os.path.exists(file_path):
+        if not verify_file(file_path, doc.file_sha256):
+            sec_logger.error(f"Integrity FAIL doc_id={doc.id} user={user.username}")
+            log_access("view", False, user.id, doc.id, "integrity_fail", request)
+            raise HTTPException(status_code=409, detail="Integrity check failed")
+
+
+def compressed_response(
+    request: Request,
+    doc: Document,
+    user: Principal,
+    file_path: str,
+    coding: str | None,
+    headers: dict[str, str],
+) -> Response:
+    """
+    Отдача сжатого blob'а: байты с диска с Content-Encoding (coding)
+    или распаковка на лету. Range для сжатых файлов не поддерживается -
+    заголовок игнорируется и отдаётся весь файл.
+    """
+    log_access("download", True, user.id, doc.id, None, request)
+    headers = {**headers, "Content-Disposition": attachment_disposition(doc.original_filename)}
+    if coding:
+        headers["Content-Encoding"] = coding
+
+    verified = is_verified(file_path, doc.file_sha256)
+    if not verified and settings.INTEGRITY_STRICT:
+        if not verify_file(file_path, doc.file_sha256):
+            sec_logger.error(f"Integrity FAIL doc_id={doc.id} user={user.username}")
+            log_access("download", False, user.id, doc.id, "integrity_fail", request)
+            raise HTTPException(status_code=409, detail="Integrity check failed")
+        verified = True
+
+    if verified and coding:
+        return FileResponse(path=file_path, media_type="application/octet-stream", headers=headers)
+
+    def on_mismatch():
+        sec_logger.error(f"Integrity FAIL doc_id={doc.id} user={user.username}")
+        log_access("download", False, user.id, doc.id, "integrity_fail", request)
+
+    # размер распакованного содержимого заранее не известен - chunked
+    return StreamingResponse(
+        iter_verified(file_path, doc.file_sha256, on_mismatch, passthrough=coding is not None),
+        media_type="application/octet-stream",
+        headers=headers,
+    )
+
+
+def offloaded_response(
+    request: Request,
+    doc: Document,
+    user: Principal,
+    file_path: str,
+    coding: str | None,
+    headers: dict[str, str],
+) -> Response:
+    """
+    Файл отдаёт прокси (DOWNLOAD_DELIVERY). Сверить хэш по ходу отдачи он
+    не может, поэтому ещё не проверенный файл проверяется заранее - дальше
+    действует кэш проверок. Range обрабатывает прокси.
+    """
+    if not verify_file(file_path, doc.file_sha256):
+        sec_logger.error(f"Integrity FAIL doc_id={doc.id} user={user.username}")
+        log_access("download", False, user.id, doc.id, "integrity_fail", request)
+        raise HTTPException(status_code=409, detail="Integrity check failed")
+
+    log_access("download", True, user.id, doc.id, None, request)
+    headers = {**headers, "Content-Disposition": attachment_disposition(doc.original_filename)}
+    if coding:
+        headers["Content-Encoding"] = coding
+    return offload_response(file_path, headers)
+
+
+def download_response(request: Request, doc: Document, user: Principal) -> Response:
+    """
+    Отдача файла документа после проверки доступа: условные запросы,
+    Range, проверка целостности и запись в журнал
+    """
+    # сжатый файл уходит как есть (Content-Encoding), если клиент это принимает
+    codec = codec_of(doc.stored_filename)
+    coding = CONTENT_CODINGS.get(codec)
+    encoded = coding is not None and accepts_encoding(request, coding)
+
+    # условный запрос: у клиента актуальная копия, файл не трогаем
+    etag = etag_for(doc.file_sha256, coding if encoded else None)
+    headers = validator_headers(etag, doc.created_at, ranges=coding is None)
+    if coding is not None:
+        headers["Vary"] = "Accept-Encoding"
+    if is_not_modified(request, etag, doc.created_at):
+        log_access("download", True, user.id, doc.id, "not_modified", request)
+        return Response(status_code=304, headers=headers)
+
+    file_path = blob_path(doc.stored_filename)
+    if not os.path.exists(file_path):
+        log_access("download", False, user.id, doc.id, "file_missing", request)
+        raise HTTPException(status_code=404, detail="File missing in storage")
+
+    # распаковку на лету прокси не сделает - такой ответ остаётся за приложением
+    if settings.DOWNLOAD_DELIVERY != "direct" and (coding is None or encoded):
+        return offloaded_response(request, doc, user, file_path, coding, headers)
+
+    if coding is not None:
+        return compressed_response(request, doc, user, file_path, coding if encoded else None, headers)
+
+    size = os.path.getsize(file_path)
+    try:
+        ranges = requested_ranges(request, etag, size)
+    except RangeNotSatisfiable:
+        log_access("download", False, user.id, doc.id, "bad_range", request)
+        raise HTTPException(
+            status_code=416,
+            detail="Range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+
+    log_access("download", True, user.id, doc.id, None, request)
+
+    def integrity_fail():
+        sec_logger.error(f"Integrity FAIL doc_id={doc.id} user={user.username}")
+        log_access("download", False, user.id, doc.id, "integrity_fail", request)
+        raise HTTPException(status_code=409, detail="Integrity check failed")
+
+    # файл уже проверен и не менялся - отдаём как есть;
+    # в строгом режиме и для Range проверяем заранее, до отдачи первого байта
+    # (полный хэш считается один раз, дальше действует кэш проверок)
+    verified = is_verified(file_path, doc.file_sha256)
+    if not verified and (settings.INTEGRITY_STRICT or ranges):
+        if not verify_file(file_path, doc.file_sha256):
+            integrity_fail()
+        verified = True
+
+    if ranges:
+        return partial_response(
+            file_path,
+            ranges,
+            size,
+            media_type="application/octet-stream",
+            headers={
+                **headers,
+                "Content-Disposition": attachment_disposition(doc.original_filename),
+            },
+        )
+
+    if verified:
+        return FileResponse(
+            path=file_path,
+            filename=doc.original_filename,
+            media_type="application/octet-stream",
+            headers=headers,
+        )
+
+    # иначе хэш считается во время отдачи, при несовпадении поток обрывается
+    def on_mismatch():
+        sec_logger.error(f"Integrity FAIL doc_id={doc.id} user={user.username}")
+        log_access("download", False, user.id, doc.id, "integrity_fail", request)
+
+    return StreamingResponse(
+        iter_verified(file_path, doc.file_sha256, on_mismatch),
+        media_type="application/octet-stream",
+        headers={
+            **headers,
+            "Content-Length": str(size),
+            "Content-Disposition": attachment_disposition(doc.original_filename),
+        },
+    )
+
+
+@router.post("/upload")
+def upload_document(
+    request: Request,
+    title: str = Query(..., min_length=1),
+    doc_type: DocumentType = Query(...),
+    sha256: str | None = Query(None, pattern="^[0-9a-f]{64}$"),
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    enforce_rate_limit(current_user)
+
+    def find_duplicate(digest: str) -> Document | None:
+        return db.scalar(duplicate_query(current_user.id, digest))
+
+    tmp_path = None
+    try:
+        # клиент заранее сообщил sha256 и такое содержимое уже хранится:
+        # файл не пишется на диск, только сверяется хэш потока
+        if sha256 and find_blob(db, sha256):
+            duplicate = find_duplicate(sha256)
+            if duplicate:
+                raise duplicate_error(request, current_user, duplicate)
+            actual, size = hash_upload(file)
+        else:
+            tmp_path, actual, size = stage_upload(file)
+
+        if sha256 and actual != sha256:
+            raise checksum_error(request, current_user)
+
+        duplicate = find_duplicate(actual)
+        if duplicate:
+            raise duplicate_error(request, current_user, duplicate)
+
+        stored_filename = acquire_blob(db, actual, size, tmp_path)
+        if stored_filename is None:
+            # blob удалили после find_blob: содержимое всё-таки пишется на диск
+            file.file.seek(0)
+            tmp_path, actual, size = stage_upload(file)
+            stored_filename = acquire_blob(db, actual, size, tmp_path)
+        doc = new_document(current_user, title, doc_type, file.filename, stored_filename, actual)
+        db.add(doc)
+        db.commit()
+        db.refresh(doc)
+    except UploadTooLarge:
+        raise too_large_error(request, current_user)
+    finally:
+        # лишний временный файл (дубликат, ошибка)
+        discard_staged(tmp_path)
+
+    return uploaded(request, current_user, doc)
+
+
+@router.post("/upload/batch")
+def upload_batch(
+    request: Request,
+    doc_type: DocumentType = Query(...),
+    files: list[UploadFile] = File(...),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """
+    Много файлов за один запрос: части multipart и/или архивы zip/tar.
+    Заголовок документа - имя файла. Дубликаты и ошибки не прерывают пакет,
+    результат возвращается по каждому файлу в исходном порядке.
+    """
+    enforce_rate_limit(current_user)
+
+    try:
+        sources = collect_sources(files)
+        staged = stage_sources(sources)
+    except BatchTooLarge as e:
+        log_access("upload", False, current_user.id, None, "batch_too_large", request)
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception:
+        log_access("upload", False, current_user.id, None, "bad_archive", request)
+        raise HTTPException(status_code=400, detail="Cannot read archive")
+
+    try:
+        # дубликаты для всего пакета - одним запросом
+        digests = {item.sha256 for item in staged if item.sha256}
+        existing = set(
+            db.scalars(
+                select(Document.file_sha256).where(
+                    Document.owner_id == current_user.id,
+                    Document.file_sha256.in_(digests),
+                )
+            )
+        )
+
+        results: list[dict] = []
+        audit_rows: list[dict] = []
+        accepted: dict[str, StagedFile] = {}
+        for item in staged:
+            if item.error or item.sha256 in existing or item.sha256 in accepted:
+                reason = item.error or "duplicate_upload"
+                results.append({"filename": item.filename, "status": "rejected", "reason": reason})
+                audit_rows.append(access_row("upload", False, current_user.id, None, reason, request))
+                continue
+            accepted[item.sha256] = item
+            results.append({"filename": item.filename, "status": "created", "sha256": item.sha256})
+
+        stored = acquire_blobs(db, {sha: (item.size, item.tmp_path) for sha, item in accepted.items()})
+        docs = {
+            sha: Document(
+                title=item.filename,
+                doc_type=doc_type,
+                original_filename=item.filename,
+                stored_filename=stored[sha],
+                file_sha256=sha,
+                owner_id=current_user.id,
+            )
+            for sha, item in accepted.items()
+        }
+        db.add_all(docs.values())
+        db.flush()
+
+        for result in results:
+            if result["status"] == "created":
+                result["id"] = docs[result["sha256"]].id
+                audit_rows.append(
+                    access_row("upload", True, current_user.id, result["id"], None, request)
+                )
+        # журнал пакета пишется в той же транзакции, что и документы
+        if audit_rows:
+            db.execute(insert(AccessLog), audit_rows)
+        db.commit()
+        acl_cache.document_added(current_user.id, [doc.id for doc in docs.values()])
+    finally:
+        # отклонённые файлы и остатки при ошибке
+        discard_batch(staged)
+
+    sec_logger.info(
+        f"Batch upload user={current_user.username} files={len(staged)} created={len(docs)}"
+    )
+    return {
+        "created": len(docs),
+        "rejected": len(staged) - len(docs),
+        "results": results,
+    }
+
+
 @router.get("/")
 def list_documents(
+    response: Response,
+    limit: int = Query(50, ge=1, le=500),
+    after_id: int | None = Query(None, ge=1),
+    doc_type: DocumentType | None = Query(None),
+    owner_id: int | None = Query(None),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
 ):
-    from fastapi import HTTPException, Request
-    from app.core.rate_limit import rate_limiter
+    enforce_rate_limit(current_user)
 
-    key = f"user:{current_user.id}"
-    if not rate_limiter.check(key):
-        raise HTTPException(status_code=429, detail="Too many requests")
-    # показываем только доступные документы
-    docs = db.scalars(select(Document).order_by(Document.id.desc())).all()
-
-    visible = []
-    for d in docs:
-        if can_access_document(db, current_user, d):
-            visible.append(
-                {
-                    "id": d.id,
-                    "title": d.title,
-                    "doc_type": d.doc_type,
-                    "original_filename": d.original_filename,
-                    "owner_id": d.owner_id,
-                    "created_at": d.created_at,
-                }
-            )
+    stmt = list_documents_query(current_user, limit, after_id, doc_type, owner_id)
+    visible = [row._asdict() for row in db.execute(stmt)]
+    if len(visible) == limit:
+        response.headers["X-Next-After-Id"] = str(visible[-1]["id"])
     return visible
 
 
-@router.post("/{doc_id}/grant")
-def grant_access(
-    doc_id: int,
-    user_id: int,
+class BulkAccess(BaseModel):
+    # доступ выдаётся/снимается для всех пар document_ids × user_ids
+    document_ids: list[int] = Field(..., min_length=1, max_length=10000)
+    user_ids: list[int] = Field(..., min_length=1, max_length=10000)
+
+
+BULK_ACCESS_MAX_PAIRS = 100_000
+
+_BULK_GRANT_SQL = text("""
+    INSERT INTO document_access (document_id, user_id, created_at)
+    SELECT d, u, now() at time zone 'utc'
+    FROM unnest(CAST(:document_ids AS integer[])) AS d
+    CROSS JOIN unnest(CAST(:user_ids AS integer[])) AS u
+    ON CONFLICT ON CONSTRAINT uq_document_user DO NOTHING
+""")
+
+
+def validate_bulk_access(db: Session, current_user: Principal, body: BulkAccess) -> tuple[list[int], list[int]]:
+    """
+    Проверка пакета: документы существуют и принадлежат пользователю
+    (или он админ), пользователи существуют - по одному запросу на каждое
+    """
+    doc_ids = sorted(set(body.document_ids))
+    user_ids = sorted(set(body.user_ids))
+    if len(doc_ids) * len(user_ids) > BULK_ACCESS_MAX_PAIRS:
+        raise HTTPException(status_code=413, detail="Too many document/user pairs")
+
+    owners = dict(
+        db.execute(select(Document.id, Document.owner_id).where(Document.id.in_(doc_ids))).tuples().all()
+    )
+    missing = [doc_id for doc_id in doc_ids if doc_id not in owners]
+    if missing:
+        raise HTTPException(status_code=404, detail={"message": "Document not found", "ids": missing})
+
+    if current_user.role != Role.admin:
+        foreign = [doc_id for doc_id, owner_id in owners.items() if owner_id != current_user.id]
+        if foreign:
+            raise HTTPException(status_code=403, detail={"message": "No rights to grant access", "ids": foreign})
+
+    found = set(db.scalars(select(User.id).where(User.id.in_(user_ids))))
+    missing = [user_id for user_id in user_ids if user_id not in found]
+    if missing:
+        raise HTTPException(status_code=404, detail={"message": "Target user not found", "ids": missing})
+
+    return doc_ids, user_ids
+
+
+# объявлены до /{doc_id}/grant, иначе "access" попадёт в doc_id
+@router.post("/access/grant")
+def bulk_grant_access(
+    body: BulkAccess,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
 ):
-    doc = db.get(Document, doc_id)
-    if not doc:
-        raise HTTPException(status_code=404, detail="Document not found")
+    enforce_rate_limit(current_user)
+    doc_ids, user_ids = validate_bulk_access(db, current_user, body)
 
-    # выдавать доступ может только владелец или админ
-    if not (current_user.role == Role.admin or doc.owner_id == current_user.id):
-        raise HTTPException(status_code=403, detail="No rights to grant access")
+    applied = db.execute(_BULK_GRANT_SQL, {"document_ids": doc_ids, "user_ids": user_ids}).rowcount
+    versions = bump_versions(db, user_ids)
+    db.commit()
+    acl_cache.granted(versions, doc_ids)
 
-    target_user = db.get(User, user_id)
-    if not target_user:
-        raise HTTPException(status_code=404, detail="Target user not found")
+    total = len(doc_ids) * len(user_ids)
+    sec_logger.info(f"Bulk grant user={current_user.username} pairs={total} applied={applied}")
+    return {"status": "granted", "applied": applied, "skipped": total - applied}
+
+
+@router.post("/access/revoke")
+def bulk_revoke_access(
+    body: BulkAccess,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    enforce_rate_limit(current_user)
+    doc_ids, user_ids = validate_bulk_access(db, current_user, body)
+
+    applied = db.execute(
+        delete(DocumentAccess).where(
+            DocumentAccess.document_id.in_(doc_ids),
+            DocumentAccess.user_id.in_(user_ids),
+        )
+    ).rowcount
+    versions = bump_versions(db, user_ids)
+    db.commit()
+    acl_cache.revoked(versions, doc_ids)
 
-    exists = db.scalar(
-        select(DocumentAccess).where(
-            DocumentAccess.document_id == doc_id,
-            DocumentAccess.user_id == user_id,
+    total = len(doc_ids) * len(user_ids)
+    sec_logger.info(f"Bulk revoke user={current_user.username} pairs={total} applied={applied}")
+    return {"status": "revoked", "applied": applied, "skipped": total - applied}
+
+
+def archive_query(
+    user: Principal,
+    ids: list[int] | None,
+    doc_type: DocumentType | None,
+    owner_id: int | None,
+):
+    """
+    Документы для архива вместе с правом доступа - одним запросом.
+    По списку ids возвращаются и недоступные (allowed = false),
+    чтобы отказать с их перечнем; по фильтру - только доступные.
+    """
+    allowed = visible_documents_clause(user)
+    stmt = (
+        select(Document, Blob.size, allowed.label("allowed"))
+        .outerjoin(Blob, Blob.sha256 == Document.file_sha256)
+    )
+    if ids:
+        return stmt.where(Document.id.in_(ids))
+
+    stmt = stmt.where(allowed).order_by(Document.id.desc()).limit(settings.ARCHIVE_MAX_DOCUMENTS + 1)
+    if doc_type is not None:
+        stmt = stmt.where(Document.doc_type == doc_type)
+    if owner_id is not None:
+        stmt = stmt.where(Document.owner_id == owner_id)
+    return stmt
+
+
+# объявлен до /{doc_id}, иначе "search" попадёт в doc_id
+@router.get("/search")
+def search_documents(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: str | None = Query(None),
+    doc_type: DocumentType | None = Query(None),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """
+    Поиск по названию и имени файла среди доступных документов,
+    лучшие совпадения первыми; следующая страница - по X-Next-Cursor
+    """
+    enforce_rate_limit(current_user)
+
+    tsquery = search_tsquery(q)
+    if tsquery is None:
+        return []
+    after = None
+    if cursor:
+        # "<score>~<id>" последнего результата предыдущей страницы
+        try:
+            score, doc_id = cursor.rsplit("~", 1)
+            after = (float(score), int(doc_id))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    rows = [
+        row._asdict()
+        for row in db.execute(search_documents_query(current_user, tsquery, limit, after, doc_type))
+    ]
+    if len(rows) == limit:
+        last = rows[-1]
+        response.headers["X-Next-Cursor"] = f"{last['score']!r}~{last['id']}"
+    return rows
+
+
+# объявлен до /{doc_id}, иначе "archive" попадёт в doc_id
+@router.get("/archive")
+def download_archive(
+    request: Request,
+    ids: list[int] | None = Query(None),
+    doc_type: DocumentType | None = Query(None),
+    owner_id: int | None = Query(None),
+    compression: Literal["store", "deflate"] = Query("store"),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """
+    Несколько документов одним zip-архивом: либо список ids, либо фильтр
+    (doc_type, owner_id) по доступным документам. Права проверяются
+    одним запросом, журнал всего архива пишется одной вставкой.
+    """
+    enforce_rate_limit(current_user)
+
+    ids = list(dict.fromkeys(ids or []))
+    if not ids and doc_type is None and owner_id is None:
+        raise HTTPException(status_code=400, detail="Specify ids or a filter")
+    if len(ids) > settings.ARCHIVE_MAX_DOCUMENTS:
+        raise HTTPException(status_code=413, detail="Too many documents in archive")
+
+    rows = db.execute(archive_query(current_user, ids, doc_type, owner_id)).all()
+    if len(rows) > settings.ARCHIVE_MAX_DOCUMENTS:
+        raise HTTPException(status_code=413, detail="Too many documents in archive")
+
+    def record(audit_rows: list[dict]):
+        if audit_rows:
+            db.execute(insert(AccessLog), audit_rows)
+            db.commit()
+
+    if ids:
+        found = {row.Document.id: row for row in rows}
+        missing = [doc_id for doc_id in ids if doc_id not in found]
+        forbidden = [doc_id for doc_id in ids if doc_id in found and not found[doc_id].allowed]
+        if missing or forbidden:
+            record(
+                [access_row("download", False, current_user.id, doc_id, "not_found", request) for doc_id in missing]
+                + [access_row("download", False, current_user.id, doc_id, "forbidden", request) for doc_id in forbidden]
+            )
+            if missing:
+                raise HTTPException(status_code=404, detail={"message": "Document not found", "ids": missing})
+            raise HTTPException(status_code=403, detail={"message": "Access denied", "ids": forbidden})
+        rows = [found[doc_id] for doc_id in ids]
+
+    audit_rows: list[dict] = []
+    present, lost = [], []
+    for row in rows:
+        doc = row.Document
+        if os.path.exists(blob_path(doc.stored_filename)):
+            present.append(row)
+            audit_rows.append(access_row("download", True, current_user.id, doc.id, "archive", request))
+        else:
+            lost.append(doc.id)
+            audit_rows.append(access_row("download", False, current_user.id, doc.id, "file_missing", request))
+    record(audit_rows)
+
+    def on_mismatch(doc_id: int):
+        def report():
+            sec_logger.error(f"Integrity FAIL doc_id={doc_id} user={current_user.username}")
+            log_access("download", False, current_user.id, doc_id, "integrity_fail", request)
+        return report
+
+    names = unique_names([row.Document.original_filename for row in present])
+    entries = [
+        ArchiveEntry(
+            name=name,
+            path=blob_path(row.Document.stored_filename),
+            sha256=row.Document.file_sha256,
+            size=row.size,
+            modified=row.Document.created_at,
+            on_mismatch=on_mismatch(row.Document.id),
         )
+        for name, row in zip(names, present)
+    ]
+
+    # файлы, которых нет в хранилище, в архив не попадают
+    headers = {"Content-Disposition": f'attachment; filename="documents-{datetime.utcnow():%Y%m%dT%H%M%S}.zip"'}
+    if lost:
+        headers["X-Missing-Documents"] = ",".join(map(str, lost))
+    return StreamingResponse(
+        iter_zip(entries, deflate=compression == "deflate"),
+        media_type="application/zip",
+        headers=headers,
     )
-    if exists:
+
+
+@router.post("/{doc_id}/grant")
+def grant_access(
+    doc_id: int,
+    user_id: int,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    check_grant(current_user, db.get(Document, doc_id), db.get(User, user_id))
+    if db.scalar(access_query(doc_id, user_id)):
         return {"status": "already granted"}
 
-    da = DocumentAccess(document_id=doc_id, user_id=user_id)
-    db.add(da)
+    db.add(DocumentAccess(document_id=doc_id, user_id=user_id))
+    versions = bump_versions(db, [user_id])
     db.commit()
-
-    return {"status": "granted", "doc_id": doc_id, "user_id": user_id}
+    return granted(versions, doc_id, user_id)
 
 
 @router.get("/{doc_id}")
@@ -173,36 +888,16 @@ def get_document(
     request: Request,
     doc_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
 ):
-    rate_limiter.check(request)
-    doc = db.get(Document, doc_id)
-    if not doc:
-        log_access(db, "view", False, current_user.id, doc_id, "not_found", request)
-        raise HTTPException(status_code=404, detail="Document not found")
+    enforce_rate_limit(current_user)
+    doc = found_document(request, "view", current_user, doc_id, db.get(Document, doc_id))
+    ensure_allowed(request, "view", current_user, doc_id, can_access_document(db, current_user, doc))
 
-    if not can_access_document(db, current_user, doc):
-        log_access(db, "view", False, current_user.id, doc_id, "forbidden", request)
-        raise HTTPException(status_code=403, detail="Access denied")
+    log_access("view", True, current_user.id, doc_id, None, request)
+    check_view_integrity(request, doc, current_user)
 
-    log_access(db, "view", True, current_user.id, doc_id, None, request)
-
-    file_path = os.path.join(settings.STORAGE_PATH, doc.stored_filename)
-    if os.path.exists(file_path):
-        current_hash = sha256_file(file_path)
-        if current_hash != doc.file_sha256:
-            sec_logger.error(f"Integrity FAIL doc_id={doc.id} user={current_user.username}")
-            log_access(db, "view", False, current_user.id, doc_id, "integrity_fail", request)
-            raise HTTPException(status_code=409, detail="Integrity check failed")
-
-    return {
-        "id": doc.id,
-        "title": doc.title,
-        "doc_type": doc.doc_type,
-        "original_filename": doc.original_filename,
-        "owner_id": doc.owner_id,
-        "created_at": doc.created_at,
-    }
+    return document_summary(doc)
 
 
 @router.get("/{doc_id}/download")
@@ -210,36 +905,13 @@ def download_document(
     request: Request,
     doc_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
 ):
-    rate_limiter.check(request)
-    doc = db.get(Document, doc_id)
-    if not doc:
-        log_access(db, "download", False, current_user.id, doc_id, "not_found", request)
-        raise HTTPException(status_code=404, detail="Document not found")
-
-    if not can_access_document(db, current_user, doc):
-        log_access(db, "download", False, current_user.id, doc_id, "forbidden", request)
-        raise HTTPException(status_code=403, detail="Access denied")
-
-    file_path = os.path.join(settings.STORAGE_PATH, doc.stored_filename)
-    if not os.path.exists(file_path):
-        log_access(db, "download", False, current_user.id, doc_id, "file_missing", request)
-        raise HTTPException(status_code=404, detail="File missing in storage")
+    enforce_rate_limit(current_user)
+    doc = found_document(request, "download", current_user, doc_id, db.get(Document, doc_id))
+    ensure_allowed(request, "download", current_user, doc_id, can_access_document(db, current_user, doc))
 
-    log_access(db, "download", True, current_user.id, doc_id, None, request)
-    
-    current_hash = sha256_file(file_path)
-    if current_hash != doc.file_sha256:
-        sec_logger.error(f"Integrity FAIL doc_id={doc.id} user={current_user.username}")
-        log_access(db, "download", False, current_user.id, doc_id, "integrity_fail", request)
-        raise HTTPException(status_code=409, detail="Integrity check failed")
-
-    return FileResponse(
-        path=file_path,
-        filename=doc.original_filename,
-        media_type="application/octet-stream",
-    )
+    return download_response(request, doc, current_user)
 
 
 @router.delete("/{doc_id}")
@@ -247,26 +919,22 @@ def delete_document(
     request: Request,
     doc_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
 ):
-    doc = db.get(Document, doc_id)
-    if not doc:
-        log_access(db, "delete", False, current_user.id, doc_id, "not_found", request)
-        raise HTTPException(status_code=404, detail="Document not found")
+    doc = found_document(request, "delete", current_user, doc_id, db.get(Document, doc_id))
+    ensure_allowed(request, "delete", current_user, doc_id, can_manage_document(current_user, doc))
 
-    # удалять может только владелец или админ
-    if not (current_user.role == Role.admin or doc.owner_id == current_user.id):
-        log_access(db, "delete", False, current_user.id, doc_id, "forbidden", request)
-        raise HTTPException(status_code=403, detail="Access denied")
-
-    file_path = os.path.join(settings.STORAGE_PATH, doc.stored_filename)
+    grantees = db.scalars(delete_grants_query(doc_id)).all()
 
+    # файл удаляется только когда на blob не осталось ссылок
     db.delete(doc)
-    db.commit()
-
-    if os.path.exists(file_path):
-        os.remove(file_path)
-
-    log_access(db, "delete", True, current_user.id, doc_id, None, request)
-
-    return {"status": "deleted", "id": doc_id}
\ No newline at end of file
+    db.flush()
+    tombstone = release_blob(db, doc.file_sha256)
+    try:
+        db.commit()
+    except Exception:
+        restore_tombstone(tombstone)
+        raise
+    purge_tombstone(tombstone)
+
+    return deleted(request, current_user, doc, grantees)
@@ -0,0 +1,202 @@
+"""
+async-версия /documents для DB_MODE=async: запросы к БД через AsyncSession,
+работа с файлами - в пуле потоков, чтобы не занимать event loop
+"""
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.rate_limit import rate_limiter
+from app.core.limiter import call_limiter
+from app.db.session import get_async_db
+from app.db.models import Blob, Document, DocumentType, DocumentAccess, User
+from app.services.storage import (
+    UploadTooLarge,
+    stage_upload,
+    hash_upload,
+    discard_staged,
+    acquire_blob_async,
+    release_blob_async,
+    purge_tombstone,
+    restore_tombstone,
+)
+from app.services.acl import bump_versions_async, can_access_async
+from app.services.audit import log_access
+from app.core.deps import Principal, get_current_user_async
+from app.routers.documents import (
+    access_query,
+    can_manage_document,
+    check_grant,
+    checksum_error,
+    deleted,
+    document_summary,
+    duplicate_query,
+    duplicate_error,
+    ensure_allowed,
+    found_document,
+    granted,
+    list_documents_query,
+    check_view_integrity,
+    delete_grants_query,
+    download_response,
+    new_document,
+    too_large_error,
+    uploaded,
+)
+
+router = APIRouter(prefix="/documents", tags=["Documents"])
+
+
+async def enforce_rate_limit(user: Principal):
+    # общий лимит запросов к документам на пользователя
+    if not await call_limiter(rate_limiter.check, f"user:{user.id}"):
+        raise HTTPException(status_code=429, detail="Too many requests")
+
+
+async def can_access_document(db: AsyncSession, user: Principal, doc: Document) -> bool:
+    # владелец и админ - сразу, выданный доступ - по кэшу ACL
+    return await can_access_async(db, user, doc)
+
+
+@router.post("/upload")
+async def upload_document(
+    request: Request,
+    title: str = Query(..., min_length=1),
+    doc_type: DocumentType = Query(...),
+    sha256: str | None = Query(None, pattern="^[0-9a-f]{64}$"),
+    file: UploadFile = File(...),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user_async),
+):
+    await enforce_rate_limit(current_user)
+
+    tmp_path = None
+    try:
+        # клиент заранее сообщил sha256 и такое содержимое уже хранится:
+        # файл не пишется на диск, только сверяется хэш потока
+        if sha256 and await db.get(Blob, sha256):
+            duplicate = await db.scalar(duplicate_query(current_user.id, sha256))
+            if duplicate:
+                raise duplicate_error(request, current_user, duplicate)
+            actual, size = await run_in_threadpool(hash_upload, file)
+        else:
+            tmp_path, actual, size = await run_in_threadpool(stage_upload, file)
+
+        if sha256 and actual != sha256:
+            raise checksum_error(request, current_user)
+
+        duplicate = await db.scalar(duplicate_query(current_user.id, actual))
+        if duplicate:
+            raise duplicate_error(request, current_user, duplicate)
+
+        stored_filename = await acquire_blob_async(db, actual, size, tmp_path)
+        if stored_filename is None:
+            # blob удалили после проверки: содержимое всё-таки пишется на диск
+            await file.seek(0)
+            tmp_path, actual, size = await run_in_threadpool(stage_upload, file)
+            stored_filename = await acquire_blob_async(db, actual, size, tmp_path)
+        doc = new_document(current_user, title, doc_type, file.filename, stored_filename, actual)
+        db.add(doc)
+        await db.commit()
+        await db.refresh(doc)
+    except UploadTooLarge:
+        raise too_large_error(request, current_user)
+    finally:
+        # лишний временный файл (дубликат, ошибка)
+        await run_in_threadpool(discard_staged, tmp_path)
+
+    return uploaded(request, current_user, doc)
+
+
+@router.get("/")
+async def list_documents(
+    response: Response,
+    limit: int = Query(50, ge=1, le=500),
+    after_id: int | None = Query(None, ge=1),
+    doc_type: DocumentType | None = Query(None),
+    owner_id: int | None = Query(None),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user_async),
+):
+    await enforce_rate_limit(current_user)
+
+    stmt = list_documents_query(current_user, limit, after_id, doc_type, owner_id)
+    visible = [row._asdict() for row in await db.execute(stmt)]
+    if len(visible) == limit:
+        response.headers["X-Next-After-Id"] = str(visible[-1]["id"])
+    return visible
+
+
+@router.post("/{doc_id}/grant")
+async def grant_access(
+    doc_id: int,
+    user_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user_async),
+):
+    check_grant(current_user, await db.get(Document, doc_id), await db.get(User, user_id))
+    if await db.scalar(access_query(doc_id, user_id)):
+        return {"status": "already granted"}
+
+    db.add(DocumentAccess(document_id=doc_id, user_id=user_id))
+    versions = await bump_versions_async(db, [user_id])
+    await db.commit()
+    return granted(versions, doc_id, user_id)
+
+
+@router.get("/{doc_id}")
+async def get_document(
+    request: Request,
+    doc_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user_async),
+):
+    await enforce_rate_limit(current_user)
+    doc = found_document(request, "view", current_user, doc_id, await db.get(Document, doc_id))
+    ensure_allowed(request, "view", current_user, doc_id, await can_access_document(db, current_user, doc))
+
+    log_access("view", True, current_user.id, doc_id, None, request)
+    await run_in_threadpool(check_view_integrity, request, doc, current_user)
+
+    return document_summary(doc)
+
+
+@router.get("/{doc_id}/download")
+async def download_document(
+    request: Request,
+    doc_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user_async),
+):
+    await enforce_rate_limit(current_user)
+    doc = found_document(request, "download", current_user, doc_id, await db.get(Document, doc_id))
+    ensure_allowed(request, "download", current_user, doc_id, await can_access_document(db, current_user, doc))
+
+    # stat, проверка целостности и открытие файла - вне event loop
+    return await run_in_threadpool(download_response, request, doc, current_user)
+
+
+@router.delete("/{doc_id}")
+async def delete_document(
+    request: Request,
+    doc_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user_async),
+):
+    doc = found_document(request, "delete", current_user, doc_id, await db.get(Document, doc_id))
+    ensure_allowed(request, "delete", current_user, doc_id, can_manage_document(current_user, doc))
+
+    grantees = (await db.scalars(delete_grants_query(doc_id))).all()
+
+    # файл удаляется только когда на blob не осталось ссылок
+    await db.delete(doc)
+    await db.flush()
+    tombstone = await release_blob_async(db, doc.file_sha256)
+    try:
+        await db.commit()
+    except Exception:
+        await run_in_threadpool(restore_tombstone, tombstone)
+        raise
+    await run_in_threadpool(purge_tombstone, tombstone)
+
+    return deleted(request, current_user, doc, grantees)
@@ -0,0 +1,247 @@
+"""
+Докачиваемая загрузка больших файлов кусками:
+
+    POST   /documents/uploads               - открыть сессию
+    PUT    /documents/uploads/{id}?offset=N - кусок (тело - сырые байты)
+    GET    /documents/uploads/{id}          - сколько уже принято
+    POST   /documents/uploads/{id}/finalize - собрать документ
+    DELETE /documents/uploads/{id}          - отменить
+"""
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.deps import Principal, get_current_user
+from app.core.limiter import call_limiter
+from app.core.rate_limit import chunk_rate_limiter
+from app.db.models import DocumentType, UploadSession
+from app.db.session import get_db
+from app.routers.documents import (
+    checksum_error,
+    duplicate_error,
+    duplicate_query,
+    enforce_rate_limit,
+    new_document,
+    uploaded,
+)
+from app.services.audit import log_access
+from app.services.storage import acquire_blob, discard_staged
+from app.services.uploads import (
+    ChunkConflict,
+    ChunkMismatch,
+    create_session,
+    drop_session,
+    lock_session,
+    stage_session,
+    write_chunk,
+)
+
+router = APIRouter(prefix="/documents/uploads", tags=["Uploads"])
+
+
+def session_state(upload: UploadSession) -> dict:
+    return {
+        "id": upload.id,
+        "offset": upload.received,
+        "size": upload.total_size,
+        "expires_at": upload.expires_at.isoformat(),
+    }
+
+
+def owned_session(db: Session, session_id: str, user: Principal) -> UploadSession:
+    """
+    Сессия под блокировкой строки; чужая сессия неотличима от несуществующей
+    """
+    upload = lock_session(db, session_id)
+    if upload is None or upload.owner_id != user.id:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    if upload.expires_at < datetime.utcnow():
+        drop_session(db, upload)
+        db.commit()
+        raise HTTPException(status_code=410, detail="Upload session expired")
+    return upload
+
+
+@router.post("")
+def open_upload(
+    request: Request,
+    title: str = Query(..., min_length=1),
+    doc_type: DocumentType = Query(...),
+    filename: str = Query(..., min_length=1, max_length=255),
+    size: int = Query(..., ge=1),
+    sha256: str | None = Query(None, pattern="^[0-9a-f]{64}$"),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    enforce_rate_limit(current_user)
+
+    if size > settings.MAX_UPLOAD_BYTES:
+        log_access("upload", False, current_user.id, None, "too_large", request)
+        raise HTTPException(status_code=413, detail="File too large")
+
+    # известный заранее дубликат не стоит докачивать
+    duplicate = sha256 and db.scalar(duplicate_query(current_user.id, sha256))
+    if duplicate:
+        raise duplicate_error(request, current_user, duplicate)
+
+    active = db.scalar(
+        select(func.count()).select_from(UploadSession).where(
+            UploadSession.owner_id == current_user.id,
+            UploadSession.expires_at >= datetime.utcnow(),
+        )
+    )
+    if active >= settings.UPLOAD_SESSIONS_PER_USER:
+        raise HTTPException(status_code=429, detail="Too many open upload sessions")
+
+    upload = create_session(
+        db,
+        owner_id=current_user.id,
+        title=title,
+        doc_type=doc_type,
+        original_filename=filename,
+        total_size=size,
+        expected_sha256=sha256,
+    )
+    db.commit()
+    return session_state(upload)
+
+
+@router.get("/{session_id}")
+def upload_status(
+    session_id: str,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    upload = owned_session(db, session_id, current_user)
+    db.commit()
+    return session_state(upload)
+
+
+def _apply_chunk(
+    db: Session,
+    session_id: str,
+    user: Principal,
+    offset: int,
+    data: bytes,
+    chunk_sha256: str | None,
+) -> dict:
+    upload = owned_session(db, session_id, user)
+    try:
+        write_chunk(upload, offset, data, chunk_sha256)
+    except ChunkConflict as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=409,
+            detail="Offset mismatch",
+            headers={"Upload-Offset": str(e.received)},
+        )
+    except ChunkMismatch as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    db.commit()
+    return session_state(upload)
+
+
+@router.put("/{session_id}")
+async def upload_chunk(
+    session_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    chunk_sha256: str | None = Header(None, alias="X-Chunk-Sha256", pattern="^[0-9a-f]{64}$"),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """
+    Кусок с указанного смещения. Повтор уже принятого куска безопасен,
+    при расхождении смещений 409 и актуальное смещение в Upload-Offset.
+    """
+    # большой файл - сотни кусков: общий лимит документов их не касается
+    if not await call_limiter(chunk_rate_limiter.check, f"user:{current_user.id}"):
+        raise HTTPException(status_code=429, detail="Too many requests")
+
+    # тело читаем сами: размер куска ограничен до записи в память целиком
+    data = bytearray()
+    async for part in request.stream():
+        data += part
+        if len(data) > settings.UPLOAD_CHUNK_MAX_BYTES:
+            raise HTTPException(status_code=413, detail="Chunk too large")
+    if not data:
+        raise HTTPException(status_code=400, detail="Empty chunk")
+
+    return await run_in_threadpool(
+        _apply_chunk, db, session_id, current_user, offset, bytes(data), chunk_sha256
+    )
+
+
+@router.post("/{session_id}/finalize")
+def finalize_upload(
+    session_id: str,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    enforce_rate_limit(current_user)
+
+    upload = owned_session(db, session_id, current_user)
+    if upload.received != upload.total_size:
+        db.rollback()
+        raise HTTPException(
+            status_code=409,
+            detail="Upload is incomplete",
+            headers={"Upload-Offset": str(upload.received)},
+        )
+
+    tmp_path = None
+    try:
+        tmp_path, actual = stage_session(upload)
+
+        if upload.expected_sha256 and actual != upload.expected_sha256:
+            drop_session(db, upload)
+            db.commit()
+            raise checksum_error(request, current_user)
+
+        duplicate = db.scalar(duplicate_query(current_user.id, actual))
+        if duplicate:
+            drop_session(db, upload)
+            db.commit()
+            raise duplicate_error(request, current_user, duplicate)
+
+        stored_filename = acquire_blob(db, actual, upload.total_size, tmp_path)
+        doc = new_document(
+            current_user, upload.title, upload.doc_type, upload.original_filename, stored_filename, actual
+        )
+        db.add(doc)
+        drop_session(db, upload)
+        db.commit()
+        db.refresh(doc)
+    except HTTPException:
+        raise
+    except Exception:
+        # принятые байты уже перенесены из файла сессии: докачка невозможна
+        db.rollback()
+        upload = lock_session(db, session_id)
+        if upload is not None:
+            drop_session(db, upload)
+            db.commit()
+        raise
+    finally:
+        # лишний временный файл (дубликат, ошибка)
+        discard_staged(tmp_path)
+
+    return uploaded(request, current_user, doc)
+
+
+@router.delete("/{session_id}")
+def abort_upload(
+    session_id: str,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    upload = owned_session(db, session_id, current_user)
+    drop_session(db, upload)
+    db.commit()
+    return {"status": "aborted"}
@@ -0,0 +1,247 @@
+"""
+Кэш решений доступа к документам.
+
+Для пользователя хранится отсортированный массив id видимых ему документов
+(свои и выданные), собранный одним запросом; проверка доступа - поиск в
+массиве. Выдача и отзыв доступа увеличивают версию пользователя в
+acl_versions в той же транзакции; процесс, внёсший изменение, правит свой
+массив сразу, остальные сверяют версию не чаще раза в ACL_RECHECK_SECONDS
+и при расхождении перечитывают набор.
+
+Свои документы проверяются по owner_id до кэша, поэтому набор, в котором
+ещё нет только что загруженного документа, к ошибочному отказу не ведёт:
+загрузка и удаление версию не меняют.
+"""
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.deps import Principal
+from app.core.metrics import registry
+from app.db.models import Document, Role
+
+# версия и набор - одним запросом, то есть из одного снимка
+_LOAD_SQL = text("""
+    SELECT
+        coalesce((SELECT version FROM acl_versions WHERE user_id = :user_id), 0) AS version,
+        ARRAY(
+            SELECT id FROM documents WHERE owner_id = :user_id
+            UNION
+            SELECT document_id FROM document_access WHERE user_id = :user_id
+            ORDER BY 1
+            LIMIT :max_ids
+        ) AS ids
+""")
+
+# запасной путь для пользователей со слишком большим набором
+_CHECK_SQL = text(
+    "SELECT EXISTS (SELECT 1 FROM document_access WHERE document_id = :document_id AND user_id = :user_id)"
+)
+
+_VERSION_SQL = text("SELECT coalesce(max(version), 0) FROM acl_versions WHERE user_id = :user_id")
+
+# id по возрастанию - строки блокируются в одном порядке, без взаимных блокировок
+_BUMP_SQL = text("""
+    INSERT INTO acl_versions (user_id, version)
+    SELECT u, 1 FROM unnest(CAST(:user_ids AS integer[])) AS u ORDER BY u
+    ON CONFLICT (user_id) DO UPDATE SET version = acl_versions.version + 1
+    RETURNING user_id, version
+""")
+
+
+class AccessSet:
+    __slots__ = ("ids", "version", "checked_at")
+
+    def __init__(self, ids, version: int):
+        self.ids = array("q", ids)
+        self.version = version
+        self.checked_at = time.monotonic()
+
+    def __contains__(self, doc_id: int) -> bool:
+        i = bisect_left(self.ids, doc_id)
+        return i < len(self.ids) and self.ids[i] == doc_id
+
+    def add(self, doc_ids):
+        for doc_id in doc_ids:
+            if doc_id not in self:
+                insort(self.ids, doc_id)
+
+    def discard(self, doc_ids):
+        for doc_id in doc_ids:
+            i = bisect_left(self.ids, doc_id)
+            if i < len(self.ids) and self.ids[i] == doc_id:
+                del self.ids[i]
+
+
+class AclCache:
+    def __init__(self, maxsize: int, ttl: float, recheck: float, max_ids: int):
+        self.recheck = recheck
+        self.max_ids = max_ids
+        self.reloads = 0
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        # правки массивов и проверка версий - под одной блокировкой
+        self._lock = threading.Lock()
+
+    @property
+    def hits(self) -> int:
+        return self._entries.hits
+
+    @property
+    def misses(self) -> int:
+        return self._entries.misses
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, user_id: int) -> tuple[AccessSet | None, bool]:
+        """
+        (набор, нужно ли сверить версию с БД)
+        """
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None, False
+        return entry, time.monotonic() - entry.checked_at >= self.recheck
+
+    def confirm(self, user_id: int, entry: AccessSet, version: int) -> bool:
+        with self._lock:
+            if entry.version != version:
+                self._entries.pop(user_id)
+                return False
+            entry.checked_at = time.monotonic()
+            return True
+
+    def store(self, user_id: int, version: int, ids: list[int]) -> AccessSet | None:
+        self.reloads += 1
+        # слишком большой набор не кэшируем - проверка идёт запросом
+        if len(ids) > self.max_ids:
+            return None
+        entry = AccessSet(ids, version)
+        with self._lock:
+            self._entries.set(user_id, entry)
+        return entry
+
+    def _apply(self, versions: dict[int, int], doc_ids: list[int], grant: bool):
+        with self._lock:
+            for user_id, version in versions.items():
+                entry = self._entries.get(user_id)
+                if entry is None or entry.version >= version:
+                    continue
+                if entry.version != version - 1:
+                    # между нами успел измениться ещё кто-то - перечитаем
+                    self._entries.pop(user_id)
+                    continue
+                if grant:
+                    entry.add(doc_ids)
+                else:
+                    entry.discard(doc_ids)
+                entry.version = version
+
+    def granted(self, versions: dict[int, int], doc_ids: list[int]):
+        self._apply(versions, doc_ids, grant=True)
+
+    def revoked(self, versions: dict[int, int], doc_ids: list[int]):
+        self._apply(versions, doc_ids, grant=False)
+
+    def document_added(self, owner_id: int, doc_ids: list[int]):
+        with self._lock:
+            entry = self._entries.get(owner_id)
+            if entry is not None:
+                entry.add(doc_ids)
+
+    def document_removed(self, doc_id: int, user_ids: list[int]):
+        with self._lock:
+            for user_id in user_ids:
+                entry = self._entries.get(user_id)
+                if entry is not None:
+                    entry.discard([doc_id])
+
+    def clear(self):
+        self._entries.clear()
+
+
+acl_cache = AclCache(
+    maxsize=settings.ACL_CACHE_SIZE,
+    ttl=settings.ACL_CACHE_TTL,
+    recheck=settings.ACL_RECHECK_SECONDS,
+    max_ids=settings.ACL_CACHE_MAX_IDS,
+)
+
+
+def _load_params(user_id: int) -> dict:
+    return {"user_id": user_id, "max_ids": acl_cache.max_ids + 1}
+
+
+def _fast_decision(user: Principal, doc: Document) -> bool | None:
+    if user.role == Role.admin or doc.owner_id == user.id:
+        return True
+    return None
+
+
+def can_access(db: Session, user: Principal, doc: Document) -> bool:
+    decision = _fast_decision(user, doc)
+    if decision is not None:
+        return decision
+
+    entry, stale = acl_cache.lookup(user.id)
+    if entry is not None and stale:
+        if not acl_cache.confirm(user.id, entry, db.scalar(_VERSION_SQL, {"user_id": user.id})):
+            entry = None
+    if entry is None:
+        row = db.execute(_LOAD_SQL, _load_params(user.id)).one()
+        entry = acl_cache.store(user.id, row.version, row.ids)
+        if entry is None:
+            return bool(db.scalar(_CHECK_SQL, {"document_id": doc.id, "user_id": user.id}))
+    return doc.id in entry
+
+
+async def can_access_async(db: AsyncSession, user: Principal, doc: Document) -> bool:
+    decision = _fast_decision(user, doc)
+    if decision is not None:
+        return decision
+
+    entry, stale = acl_cache.lookup(user.id)
+    if entry is not None and stale:
+        version = await db.scalar(_VERSION_SQL, {"user_id": user.id})
+        if not acl_cache.confirm(user.id, entry, version):
+            entry = None
+    if entry is None:
+        row = (await db.execute(_LOAD_SQL, _load_params(user.id))).one()
+        entry = acl_cache.store(user.id, row.version, row.ids)
+        if entry is None:
+            return bool(await db.scalar(_CHECK_SQL, {"document_id": doc.id, "user_id": user.id}))
+    return doc.id in entry
+
+
+def bump_versions(db: Session, user_ids: list[int]) -> dict[int, int]:
+    """
+    Новые версии пользователей, чей доступ меняется в текущей транзакции
+    """
+    if not user_ids:
+        return {}
+    return dict(db.execute(_BUMP_SQL, {"user_ids": sorted(set(user_ids))}).tuples().all())
+
+
+async def bump_versions_async(db: AsyncSession, user_ids: list[int]) -> dict[int, int]:
+    if not user_ids:
+        return {}
+    result = await db.execute(_BUMP_SQL, {"user_ids": sorted(set(user_ids))})
+    return dict(result.tuples().all())
+
+
+registry.gauge(
+    "acl_cache_lookups_total", "ACL cache lookups by result",
+    lambda: {("hit",): acl_cache.hits, ("miss",): acl_cache.misses},
+    ("result",), kind="counter",
+)
+registry.gauge(
+    "acl_cache_reloads_total", "ACL sets loaded from the database",
+    lambda: acl_cache.reloads, kind="counter",
+)
+registry.gauge("acl_cache_users", "Users with a cached ACL set", lambda: len(acl_cache))
@@ -0,0 +1,94 @@
+"""
+Zip-архив из нескольких документов, собираемый на лету: без временного
+файла, в памяти - не больше одного куска хранилища и его сжатой копии.
+"""
+import posixpath
+import zipfile
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Iterator
+
+from app.services.integrity import is_verified, iter_verified
+from app.services.storage import iter_stored
+
+
+@dataclass
+class ArchiveEntry:
+    name: str
+    path: str
+    sha256: str
+    size: int | None
+    modified: datetime
+    on_mismatch: Callable[[], None] | None = None
+
+
+class _Sink:
+    """
+    Неперематываемый приёмник для ZipFile: накопленное забирается
+    после каждой записи и сразу уходит клиенту
+    """
+
+    def __init__(self):
+        self._parts: list[bytes] = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        out = b"".join(self._parts)
+        self._parts.clear()
+        return out
+
+
+def unique_names(names: list[str]) -> list[str]:
+    """
+    Имена внутри архива: без каталогов и без повторов ("a.txt", "a (2).txt")
+    """
+    used: set[str] = set()
+    result = []
+    for name in names:
+        name = posixpath.basename(name.replace("\\", "/")) or "file"
+        stem, ext = posixpath.splitext(name)
+        candidate, n = name, 1
+        while candidate.lower() in used:
+            n += 1
+            candidate = f"{stem} ({n}){ext}"
+        used.add(candidate.lower())
+        result.append(candidate)
+    return result
+
+
+def _entry_chunks(entry: ArchiveEntry) -> Iterator[bytes]:
+    # проверенный и не менявшийся файл не хэшируется повторно
+    if is_verified(entry.path, entry.sha256):
+        return (data for _, data in iter_stored(entry.path) if data)
+    return iter_verified(entry.path, entry.sha256, entry.on_mismatch)
+
+
+def iter_zip(entries: list[ArchiveEntry], deflate: bool = False) -> Iterator[bytes]:
+    """
+    Поток байт zip-архива. При несовпадении хэша поток обрывается
+    (IntegrityError) до последнего куска файла - архив остаётся неполным
+    и не распаковывается как целый.
+    """
+    sink = _Sink()
+    method = zipfile.ZIP_DEFLATED if deflate else zipfile.ZIP_STORED
+    with zipfile.ZipFile(sink, "w", compression=method, compresslevel=6 if deflate else None) as zf:
+        for entry in entries:
+            info = zipfile.ZipInfo(entry.name, entry.modified.timetuple()[:6])
+            info.compress_type = method
+            # размер неизвестен (старые документы) или больше 4 ГиБ
+            force_zip64 = entry.size is None or entry.size >= zipfile.ZIP64_LIMIT
+            with zf.open(info, "w", force_zip64=force_zip64) as out:
+                for chunk in _entry_chunks(entry):
+                    out.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            yield sink.drain()
+    # центральный каталог
+    yield sink.drain()
@@ -1,29 +1,213 @@
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any
+
 from fastapi import Request
-from sqlalchemy.orm import Session
+from sqlalchemy import insert
 
+from app.core.config import settings
+from app.core.logging import get_security_logger
+from app.core.metrics import registry
 from app.db.models import AccessLog
+from app.db.session import SessionLocal
 
+sec_logger = get_security_logger()
 
-def log_access(
-    db: Session,
+_STOP = object()
+
+audit_batch_seconds = registry.histogram(
+    "audit_batch_write_seconds", "Time to insert one batch of access_logs rows")
+
+
+class AuditWriter:
+    """
+    Фоновая запись журнала доступа: события копятся в ограниченной очереди,
+    фоновый поток пишет их пачками (multi-row INSERT) по размеру или по времени.
+
+    Если очередь переполнена, поведение задаётся overflow:
+    - block - обработчик ждёт места в очереди
+    - drop  - событие отбрасывается (считается в dropped)
+    - spill - событие дописывается в локальный файл и догружается при старте
+    """
+
+    def __init__(
+        self,
+        queue_size: int,
+        batch_size: int,
+        flush_interval: float,
+        overflow: str,
+        spill_path: str,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.spill_path = spill_path
+
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.written = 0
+        self.dropped = 0
+        self.spilled = 0
+
+        self._thread: threading.Thread | None = None
+        self._spill_lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._replay_spill()
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        if not self.running:
+            return
+        self.queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def submit(self, row: dict[str, Any]):
+        if not self.running:
+            # writer не запущен (CLI, скрипты) - пишем сразу
+            self._write([row])
+            return
+
+        if self.overflow == "block":
+            self.queue.put(row)
+            return
+
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            if self.overflow == "spill":
+                self._spill([row])
+            else:
+                self.dropped += 1
+
+    def _run(self):
+        batch: list[dict[str, Any]] = []
+        deadline = 0.0
+
+        while True:
+            timeout = max(0.0, deadline - time.monotonic()) if batch else None
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                self._write(batch)
+                return
+
+            if item is not None:
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._write(batch)
+                batch = []
+
+    def _write(self, rows: list[dict[str, Any]]):
+        if not rows:
+            return
+        started = time.perf_counter()
+        try:
+            with SessionLocal() as db:
+                db.execute(insert(AccessLog), rows)
+                db.commit()
+            self.written += len(rows)
+            audit_batch_seconds.observe(time.perf_counter() - started)
+        except Exception:
+            # БД недоступна - не теряем события, а откладываем в файл
+            sec_logger.exception(f"Audit write failed, spilling {len(rows)} rows")
+            self._spill(rows)
+
+    def _spill(self, rows: list[dict[str, Any]]):
+        with self._spill_lock:
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps(row, default=str) + "\n")
+        self.spilled += len(rows)
+
+    def _replay_spill(self):
+        if not os.path.exists(self.spill_path):
+            return
+
+        # переименование атомарно: при нескольких воркерах файл заберёт один
+        replay_path = f"{self.spill_path}.{os.getpid()}.replay"
+        try:
+            os.replace(self.spill_path, replay_path)
+        except FileNotFoundError:
+            return
+
+        with open(replay_path, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        for row in rows:
+            row["created_at"] = datetime.fromisoformat(row["created_at"])
+
+        for i in range(0, len(rows), self.batch_size):
+            self._write(rows[i:i + self.batch_size])
+        os.remove(replay_path)
+        sec_logger.info(f"Audit spill replayed rows={len(rows)}")
+
+
+audit_writer = AuditWriter(
+    queue_size=settings.AUDIT_QUEUE_SIZE,
+    batch_size=settings.AUDIT_BATCH_SIZE,
+    flush_interval=settings.AUDIT_FLUSH_INTERVAL,
+    overflow=settings.AUDIT_OVERFLOW,
+    spill_path=settings.AUDIT_SPILL_PATH or os.path.join(settings.STORAGE_PATH, ".audit-spill.ndjson"),
+)
+
+registry.gauge(
+    "audit_events_total", "Access log events by outcome",
+    lambda: {
+        ("written",): audit_writer.written,
+        ("dropped",): audit_writer.dropped,
+        ("spilled",): audit_writer.spilled,
+    },
+    ("outcome",), kind="counter",
+)
+registry.gauge("audit_queue_depth", "Events waiting in the audit queue", lambda: audit_writer.queue.qsize())
+
+
+def access_row(
     action: str,
     success: bool,
     user_id: int | None = None,
     document_id: int | None = None,
     reason: str | None = None,
     request: Request | None = None,
-):
+) -> dict[str, Any]:
     ip = None
     if request:
         ip = request.client.host if request.client else None
 
-    entry = AccessLog(
-        user_id=user_id,
-        action=action,
-        document_id=document_id,
-        success=success,
-        reason=reason,
-        ip=ip,
-    )
-    db.add(entry)
-    db.commit()
+    return {
+        "user_id": user_id,
+        "action": action,
+        "document_id": document_id,
+        "success": success,
+        "reason": reason,
+        "ip": ip,
+        "created_at": datetime.utcnow(),
+    }
+
+
+def log_access(
+    action: str,
+    success: bool,
+    user_id: int | None = None,
+    document_id: int | None = None,
+    reason: str | None = None,
+    request: Request | None = None,
+):
+    audit_writer.submit(access_row(action, success, user_id, document_id, reason, request))
@@ -0,0 +1,208 @@
+"""
+Обслуживание журнала доступа: секции access_logs по месяцам,
+удаление старых секций (DROP вместо DELETE) и суточные итоги.
+Тот же фоновый поток убирает просроченные сессии докачиваемой загрузки.
+"""
+import re
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.logging import get_security_logger
+from app.db.session import SessionLocal
+from app.services.uploads import collect_expired_sessions
+
+sec_logger = get_security_logger()
+
+# одна реплика обслуживает журнал, остальные пропускают запуск
+MAINTENANCE_LOCK_ID = 72_0452
+
+_UPPER_BOUND_RE = re.compile(r"TO \('([^']+)'\)")
+
+_ROLLUP_SQL = text("""
+    INSERT INTO access_log_daily (day, user_id, document_id, action, success, count)
+    SELECT created_at::date, user_id, document_id, action, success, count(*)
+    FROM access_logs
+    WHERE created_at >= :since AND created_at < :until
+    GROUP BY 1, 2, 3, 4, 5
+    ON CONFLICT ON CONSTRAINT uq_access_log_daily DO UPDATE SET count = EXCLUDED.count
+""")
+
+
+def month_start(moment: datetime) -> datetime:
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(moment: datetime, months: int) -> datetime:
+    index = moment.year * 12 + moment.month - 1 + months
+    return moment.replace(year=index // 12, month=index % 12 + 1)
+
+
+def list_partitions(db: Session) -> list[tuple[str, datetime | None]]:
+    """
+    [(имя секции, верхняя граница)], для секции DEFAULT граница None
+    """
+    rows = db.execute(text("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'access_logs'::regclass
+    """)).all()
+
+    partitions = []
+    for name, bound in rows:
+        match = _UPPER_BOUND_RE.search(bound)
+        partitions.append((name, datetime.fromisoformat(match.group(1)) if match else None))
+    return sorted(partitions, key=lambda p: p[1] or datetime.max)
+
+
+def ensure_partitions(db: Session, months_ahead: int, now: datetime | None = None) -> list[str]:
+    """
+    Создаёт секции по месяцам от последней существующей до now + months_ahead
+    """
+    now = now or datetime.utcnow()
+    partitions = list_partitions(db)
+    uppers = [upper for _, upper in partitions if upper is not None]
+    default = next((name for name, upper in partitions if upper is None), None)
+    start = max(uppers) if uppers else month_start(now)
+    target = add_months(month_start(now), months_ahead + 1)
+
+    created = []
+    while start < target:
+        end = add_months(month_start(start), 1)
+        name = f"access_logs_{start:%Y%m}"
+        bounds = f"FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        if default and _default_has_rows(db, default, start, end):
+            _split_default(db, default, name, bounds, start, end)
+        else:
+            db.execute(text(f"CREATE TABLE {name} PARTITION OF access_logs FOR VALUES {bounds}"))
+        created.append(name)
+        start = end
+    return created
+
+
+def _default_has_rows(db: Session, default: str, start: datetime, end: datetime) -> bool:
+    return db.scalar(
+        text(f"SELECT EXISTS (SELECT 1 FROM {default} WHERE created_at >= :start AND created_at < :end)"),
+        {"start": start, "end": end},
+    )
+
+
+def _split_default(db: Session, default: str, name: str, bounds: str, start: datetime, end: datetime):
+    """
+    Секцию нельзя создать, пока её строки лежат в DEFAULT: отцепляем DEFAULT,
+    создаём секцию, переносим строки и цепляем DEFAULT обратно.
+    Всё в транзакции maintain(), запись в журнал ждёт её окончания
+    """
+    db.execute(text(f"ALTER TABLE access_logs DETACH PARTITION {default}"))
+    db.execute(text(f"CREATE TABLE {name} PARTITION OF access_logs FOR VALUES {bounds}"))
+    moved = db.execute(
+        text(
+            f"WITH moved AS (DELETE FROM {default} "
+            f"WHERE created_at >= :start AND created_at < :end RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved"
+        ),
+        {"start": start, "end": end},
+    ).rowcount
+    db.execute(text(f"ALTER TABLE access_logs ATTACH PARTITION {default} DEFAULT"))
+    sec_logger.info(f"Audit maintenance moved {moved} rows from {default} to {name}")
+
+
+def rollup(db: Session, since: datetime, until: datetime) -> int:
+    """
+    Пересчитывает суточные итоги за [since, until) - повторный запуск безопасен
+    """
+    return db.execute(_ROLLUP_SQL, {"since": since, "until": until}).rowcount
+
+
+def drop_expired_partitions(db: Session, retention_months: int, now: datetime | None = None) -> list[str]:
+    if retention_months <= 0:
+        return []
+
+    now = now or datetime.utcnow()
+    cutoff = add_months(month_start(now), -retention_months)
+    expired = [
+        (name, upper)
+        for name, upper in list_partitions(db)
+        if upper is not None and upper <= cutoff
+    ]
+    if not expired:
+        return []
+
+    # итоги должны пережить сами строки
+    rollup(db, datetime.min, max(upper for _, upper in expired))
+    for name, _ in expired:
+        db.execute(text(f"DROP TABLE {name}"))
+    return [name for name, _ in expired]
+
+
+def maintain(rollup_days: int = 2) -> dict | None:
+    """
+    Один проход обслуживания. None - если им уже занята другая реплика
+    """
+    now = datetime.utcnow()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    with SessionLocal() as db:
+        locked = db.scalar(
+            text("SELECT pg_try_advisory_xact_lock(:id)"), {"id": MAINTENANCE_LOCK_ID}
+        )
+        if not locked:
+            return None
+
+        created = ensure_partitions(db, settings.AUDIT_PARTITIONS_AHEAD, now)
+        rolled_up = rollup(db, today - timedelta(days=rollup_days - 1), today + timedelta(days=1))
+        dropped = drop_expired_partitions(db, settings.AUDIT_RETENTION_MONTHS, now)
+        db.commit()
+
+    return {"created": created, "dropped": dropped, "rolled_up": rolled_up}
+
+
+class AuditMaintenance:
+    """
+    Периодическое обслуживание журнала и сессий загрузки в фоновом потоке
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="audit-maintenance", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                result = maintain()
+                if result and (result["created"] or result["dropped"]):
+                    sec_logger.info(
+                        f"Audit maintenance created={result['created']} dropped={result['dropped']}"
+                    )
+            except Exception:
+                sec_logger.exception("Audit maintenance failed")
+            try:
+                with SessionLocal() as db:
+                    removed = collect_expired_sessions(db)
+                if removed:
+                    sec_logger.info(f"Upload sessions cleanup removed files={removed}")
+            except Exception:
+                sec_logger.exception("Upload sessions cleanup failed")
+            self._stop.wait(self.interval)
+
+
+audit_maintenance = AuditMaintenance(settings.AUDIT_MAINTENANCE_INTERVAL)
@@ -0,0 +1,177 @@
+"""
+Пакетная загрузка: части multipart и содержимое zip/tar раскладываются
+на отдельные файлы, которые пишутся во временные файлы и хэшируются
+параллельно в общем пуле потоков (hashlib отпускает GIL).
+"""
+import os
+import tarfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import BinaryIO, Callable, Iterable
+
+from fastapi import UploadFile
+
+from app.core.config import settings
+from app.services.storage import UploadTooLarge, discard_staged, stage_stream
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz")
+
+# общий на процесс: параллельные пакеты не множат потоки
+staging_pool = ThreadPoolExecutor(
+    max_workers=settings.BATCH_UPLOAD_WORKERS,
+    thread_name_prefix="batch-stage",
+)
+
+
+class BatchTooLarge(Exception):
+    pass
+
+
+class BatchBudget:
+    """
+    Общий на пакет счётчик распакованных байт: маленький zip с тысячами
+    больших записей не должен заполнить диск. Проверяется по мере чтения.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def take(self, amount: int):
+        with self._lock:
+            self.used += amount
+            if self.used > self.max_bytes:
+                raise BatchTooLarge("Batch is too large")
+
+    def wrap(self, fileobj: BinaryIO) -> "_Budgeted":
+        return _Budgeted(fileobj, self)
+
+
+class _Budgeted:
+    __slots__ = ("_fileobj", "_budget")
+
+    def __init__(self, fileobj: BinaryIO, budget: BatchBudget):
+        self._fileobj = fileobj
+        self._budget = budget
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._fileobj.read(size)
+        self._budget.take(len(data))
+        return data
+
+
+@dataclass
+class BatchSource:
+    filename: str
+    open: Callable[[], BinaryIO]
+    budget: BatchBudget
+
+
+@dataclass
+class StagedFile:
+    filename: str
+    tmp_path: str | None = None
+    sha256: str | None = None
+    size: int = 0
+    error: str | None = None
+
+
+def is_archive(file: UploadFile) -> bool:
+    return (file.filename or "").lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def _zip_sources(archive: zipfile.ZipFile, budget: BatchBudget) -> list[BatchSource]:
+    # ZipFile читает общий файл под своей блокировкой, распаковка - параллельно
+    return [
+        BatchSource(os.path.basename(info.filename), lambda info=info: archive.open(info), budget)
+        for info in archive.infolist()
+        if not info.is_dir() and os.path.basename(info.filename)
+    ]
+
+
+def collect_sources(files: list[UploadFile]) -> list[BatchSource | StagedFile]:
+    """
+    Список файлов пакета. Архивы (по расширению) раскрываются;
+    записи tar выгружаются сразу и приходят уже как StagedFile.
+    """
+    sources: list[BatchSource | StagedFile] = []
+    budget = BatchBudget(settings.BATCH_UPLOAD_MAX_BYTES)
+    try:
+        for file in files:
+            if not is_archive(file):
+                sources.append(BatchSource(file.filename or "file", lambda file=file: file.file, budget))
+            elif file.filename.lower().endswith(".zip"):
+                sources.extend(_zip_sources(zipfile.ZipFile(file.file), budget))
+            else:
+                _stage_tar(file.file, budget, sources)
+
+            if len(sources) > settings.BATCH_UPLOAD_MAX_FILES:
+                raise BatchTooLarge("Too many files in batch")
+    except BaseException:
+        discard_batch(s for s in sources if isinstance(s, StagedFile))
+        raise
+    return sources
+
+
+def _stage_tar(fileobj: BinaryIO, budget: BatchBudget, sources: list[BatchSource | StagedFile]):
+    # tar (тем более сжатый) читается только последовательно,
+    # поэтому записи выгружаются здесь же, без пула; сразу в sources -
+    # при ошибке вызывающий удалит уже выгруженное
+    with tarfile.open(fileobj=fileobj, mode="r:*") as archive:
+        for member in archive:
+            name = os.path.basename(member.name)
+            if not member.isfile() or not name:
+                continue
+            sources.append(_stage(BatchSource(name, lambda member=member: archive.extractfile(member), budget)))
+            if len(sources) > settings.BATCH_UPLOAD_MAX_FILES:
+                break
+
+
+def _stage(source: BatchSource) -> StagedFile:
+    staged = StagedFile(source.filename)
+    try:
+        staged.tmp_path, staged.sha256, staged.size = stage_stream(source.budget.wrap(source.open()))
+    except UploadTooLarge:
+        staged.error = "too_large"
+    except BatchTooLarge:
+        raise
+    except Exception:
+        # битая запись архива (zlib.error, EOFError, BadZipFile...) - только этот файл
+        staged.error = "unreadable"
+    return staged
+
+
+def _resolve(source: BatchSource | StagedFile) -> StagedFile:
+    if isinstance(source, StagedFile):
+        return source
+    return _stage(source)
+
+
+def stage_sources(sources: list[BatchSource | StagedFile]) -> list[StagedFile]:
+    """
+    Пишет и хэширует файлы пакета параллельно, порядок сохраняется.
+    Если пакет прерван (BatchTooLarge), уже записанное удаляется.
+    """
+    futures = [staging_pool.submit(_resolve, source) for source in sources]
+    staged: list[StagedFile] = []
+    failure: BaseException | None = None
+    for future in futures:
+        if failure is not None:
+            future.cancel()
+        try:
+            staged.append(future.result())
+        except BaseException as e:
+            failure = failure or e
+    if failure is not None:
+        discard_batch(staged)
+        discard_batch(s for s in sources if isinstance(s, StagedFile))
+        raise failure
+    return staged
+
+
+def discard_batch(staged: Iterable[StagedFile]):
+    for item in staged:
+        discard_staged(item.tmp_path)
@@ -0,0 +1,225 @@
+"""
+HTTP-отдача файлов: валидаторы (ETag/Last-Modified), условные запросы,
+Range (одиночные и multipart/byteranges) и передача отдачи прокси
+"""
+import os
+import uuid
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Iterator
+from urllib.parse import quote
+
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+
+from app.core.config import settings
+from app.services.storage import CHUNK_SIZE
+
+MAX_RANGES = 16
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def attachment_disposition(filename: str) -> str:
+    # так же, как это делает FileResponse
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+# кодек хранилища -> значение Content-Encoding
+CONTENT_CODINGS = {"gzip": "gzip", "zstd": "zstd"}
+
+
+def etag_for(sha256: str, coding: str | None = None) -> str:
+    # содержимое документа неизменно, поэтому sha256 - сильный валидатор;
+    # у сжатого представления свой ETag
+    if coding:
+        return f'"{sha256}-{coding}"'
+    return f'"{sha256}"'
+
+
+def accepts_encoding(request: Request, coding: str) -> bool:
+    for part in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = part.strip().partition(";")
+        if name.strip().lower() not in (coding, "*"):
+            continue
+        q = params.strip().removeprefix("q=")
+        try:
+            return not params or float(q) > 0
+        except ValueError:
+            return False
+    return False
+
+
+def http_date(dt: datetime) -> str:
+    # в БД время хранится в UTC без таймзоны
+    return format_datetime(dt.replace(tzinfo=timezone.utc, microsecond=0), usegmt=True)
+
+
+def validator_headers(etag: str, last_modified: datetime, ranges: bool = True) -> dict[str, str]:
+    return {
+        "ETag": etag,
+        "Last-Modified": http_date(last_modified),
+        # права доступа могут поменяться - кэш обязан перепроверять
+        "Cache-Control": "private, no-cache",
+        "Accept-Ranges": "bytes" if ranges else "none",
+    }
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    candidates = [c.strip() for c in header.split(",")]
+    return "*" in candidates or any(c.removeprefix("W/") == etag for c in candidates)
+
+
+def is_not_modified(request: Request, etag: str, last_modified: datetime) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match важнее If-Modified-Since
+        return _etag_matches(if_none_match, etag)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        modified = last_modified.replace(tzinfo=timezone.utc, microsecond=0)
+        return modified <= since
+
+    return False
+
+
+def requested_ranges(request: Request, etag: str, size: int) -> list[tuple[int, int]] | None:
+    """
+    Диапазоны из заголовка Range (включительные границы) или None,
+    если нужно отдать файл целиком
+    """
+    header = request.headers.get("range")
+    if not header:
+        return None
+
+    # If-Range с другим валидатором - файл поменялся, отдаём целиком
+    if_range = request.headers.get("if-range")
+    if if_range is not None and if_range.strip() != etag:
+        return None
+
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+
+    ranges = []
+    for part in spec.split(","):
+        start_s, sep, end_s = part.strip().partition("-")
+        if not sep:
+            return None
+        try:
+            if start_s:
+                start = int(start_s)
+                end = int(end_s) if end_s else size - 1
+            else:
+                # "-N" - последние N байт
+                length = int(end_s)
+                if length == 0:
+                    continue
+                start, end = max(size - length, 0), size - 1
+        except ValueError:
+            return None
+
+        if start > end and end_s:
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, min(end, size - 1)))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+    if len(ranges) > MAX_RANGES:
+        # слишком дробный запрос дешевле отдать целиком
+        return None
+    return ranges
+
+
+def _iter_file_range(path: str, start: int, end: int) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def partial_response(
+    path: str,
+    ranges: list[tuple[int, int]],
+    size: int,
+    media_type: str,
+    headers: dict[str, str],
+) -> StreamingResponse:
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        return StreamingResponse(
+            _iter_file_range(path, start, end),
+            status_code=206,
+            media_type=media_type,
+            headers={
+                **headers,
+                "Content-Range": f"bytes {start}-{end}/{size}",
+                "Content-Length": str(end - start + 1),
+            },
+        )
+
+    boundary = uuid.uuid4().hex
+    part_headers = [
+        (
+            f"--{boundary}\r\n"
+            f"Content-Type: {media_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+        ).encode()
+        for start, end in ranges
+    ]
+    closing = f"--{boundary}--\r\n".encode()
+    length = (
+        sum(len(h) + (end - start + 1) + 2 for h, (start, end) in zip(part_headers, ranges))
+        + len(closing)
+    )
+
+    def body() -> Iterator[bytes]:
+        for head, (start, end) in zip(part_headers, ranges):
+            yield head
+            yield from _iter_file_range(path, start, end)
+            yield b"\r\n"
+        yield closing
+
+    return StreamingResponse(
+        body(),
+        status_code=206,
+        media_type=f"multipart/byteranges; boundary={boundary}",
+        headers={**headers, "Content-Length": str(length)},
+    )
+
+
+def offload_response(file_path: str, headers: dict[str, str]) -> Response:
+    """
+    Пустой ответ с внутренним перенаправлением: байты с диска отдаёт прокси
+    (sendfile, Range), заголовки ответа - наши
+    """
+    if settings.DOWNLOAD_DELIVERY == "x-accel":
+        relative = os.path.relpath(file_path, settings.STORAGE_PATH).replace(os.sep, "/")
+        target = {"X-Accel-Redirect": settings.X_ACCEL_PREFIX.rstrip("/") + "/" + quote(relative)}
+    else:
+        target = {"X-Sendfile": file_path}
+    return Response(
+        status_code=200,
+        media_type="application/octet-stream",
+        headers={**headers, **target},
+    )
+
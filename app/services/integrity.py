@@ -0,0 +1,108 @@
+import os
+from typing import Callable, Iterator
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.metrics import MeteredHash, registry
+from app.services.storage import iter_stored, sha256_file
+
+# ключ - "паспорт" файла на диске и ожидаемый хэш: если файл перезаписали,
+# меняется inode/размер/mtime и запись в кэше перестаёт совпадать
+verification_cache = TTLCache(
+    maxsize=settings.INTEGRITY_CACHE_SIZE,
+    ttl=settings.INTEGRITY_REVERIFY_SECONDS,
+)
+
+integrity_failures = 0
+
+
+class IntegrityError(Exception):
+    pass
+
+
+def file_identity(path: str) -> tuple[int, int, int, int]:
+    st = os.stat(path)
+    return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def is_verified(path: str, expected_sha256: str) -> bool:
+    key = (file_identity(path), expected_sha256)
+    return verification_cache.get(key) is not None
+
+
+def _register_result(identity: tuple, expected_sha256: str, actual: str) -> bool:
+    global integrity_failures
+
+    if actual == expected_sha256:
+        verification_cache.set((identity, expected_sha256), True)
+        return True
+
+    integrity_failures += 1
+    return False
+
+
+def verify_file(path: str, expected_sha256: str) -> bool:
+    """
+    Проверка целостности с кэшем: полный хэш считается только если
+    файл ещё не проверялся или истёк интервал повторной проверки
+    """
+    identity = file_identity(path)
+    if verification_cache.get((identity, expected_sha256)) is not None:
+        return True
+
+    return _register_result(identity, expected_sha256, sha256_file(path))
+
+
+def iter_verified(
+    path: str,
+    expected_sha256: str,
+    on_mismatch: Callable[[], None] | None = None,
+    passthrough: bool = False,
+) -> Iterator[bytes]:
+    """
+    Отдаёт файл по частям и одновременно считает sha256 исходного содержимого.
+    Сжатый файл распаковывается; с passthrough отдаются байты как на диске
+    (для Content-Encoding), а распакованные идут только в хэш.
+    Последний кусок придерживается до сверки хэша: при несовпадении
+    поток обрывается, и клиент не получает файл целиком.
+    """
+    identity = file_identity(path)
+    h = MeteredHash("download")
+
+    pending = b""
+    for raw, data in iter_stored(path):
+        h.update(data)
+        chunk = raw if passthrough else data
+        if not chunk:
+            continue
+        if pending:
+            yield pending
+        pending = chunk
+
+    if not _register_result(identity, expected_sha256, h.hexdigest()):
+        if on_mismatch:
+            on_mismatch()
+        raise IntegrityError(path)
+
+    if pending:
+        yield pending
+
+
+def integrity_stats() -> dict[str, int]:
+    return {
+        "cache_hits": verification_cache.hits,
+        "cache_misses": verification_cache.misses,
+        "cache_size": len(verification_cache),
+        "failures": integrity_failures,
+    }
+
+
+registry.gauge(
+    "integrity_verifications_total", "Integrity cache lookups by result",
+    lambda: {("hit",): verification_cache.hits, ("miss",): verification_cache.misses},
+    ("result",), kind="counter",
+)
+registry.gauge(
+    "integrity_failures_total", "Files whose sha256 did not match",
+    lambda: integrity_failures, kind="counter",
+)
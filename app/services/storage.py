@@ -1,46 +1,606 @@
+import itertools
+import logging
 import os
+import re
+import time
 import uuid
-import hashlib
+import zlib
+from collections import deque
+from typing import BinaryIO, Callable, Iterator
+
 from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, update, delete, exists, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
 
 from app.core.config import settings
+from app.core.metrics import MeteredHash, registry
+from app.db.migrations import DOCUMENT_BLOB_FK
+from app.db.models import Blob, Document
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
 
 
 def ensure_storage():
     os.makedirs(settings.STORAGE_PATH, exist_ok=True)
 
 
-def sha256_file(path: str) -> str:
-    h = hashlib.sha256()
+def storage_file(name: str) -> str:
+    # служебные файлы (.tmp-, .upload-, .gc-) всегда лежат в корне хранилища
+    return os.path.join(settings.STORAGE_PATH, name)
+
+
+# --- раскладка blob'ов ------------------------------------------------------
+# flat - все файлы в корне, fanout - ab/cd/<имя> по первым символам sha256:
+# при миллионах файлов один каталог замедляет поиск, stat и резервные копии
+
+BLOB_NAME = re.compile(r"^[0-9a-f]{64}(\.gz|\.zst)?$")
+
+
+def layout_path(stored_filename: str, layout: str | None = None) -> str:
+    if (layout or settings.STORAGE_LAYOUT) == "fanout":
+        return os.path.join(
+            settings.STORAGE_PATH, stored_filename[:2], stored_filename[2:4], stored_filename
+        )
+    return storage_file(stored_filename)
+
+
+def blob_path(stored_filename: str) -> str:
+    """
+    Путь к существующему файлу blob'а в любой из раскладок (сначала
+    текущая). Если файла нет нигде - путь по текущей раскладке.
+    """
+    path = layout_path(stored_filename)
+    if os.path.exists(path):
+        return path
+    other = layout_path(stored_filename, "flat" if settings.STORAGE_LAYOUT == "fanout" else "fanout")
+    return other if os.path.exists(other) else path
+
+
+def new_blob_path(stored_filename: str) -> str:
+    # место для нового файла: по текущей раскладке, каталоги создаются
+    path = layout_path(stored_filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+# --- сжатие содержимого в хранилище ---------------------------------------
+# кодек blob'а видно по суффиксу stored_filename, sha256 всегда от исходных байт
+
+IDENTITY = "identity"
+CODEC_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+# сигнатуры уже сжатых форматов (zip - в том числе docx/xlsx/odt)
+COMPRESSED_MAGIC = (
+    b"\x1f\x8b", b"PK\x03\x04", b"\x28\xb5\x2f\xfd", b"\xfd7zXZ", b"BZh", b"7z\xbc\xaf",
+    b"Rar!", b"\x89PNG", b"\xff\xd8\xff", b"GIF8", b"RIFF", b"OggS", b"ID3", b"fLaC",
+)
+# пробное сжатие начала файла: хуже этого отношения - храним как есть
+COMPRESS_SAMPLE_BYTES = 64 * 1024
+COMPRESS_MIN_RATIO = 0.9
+
+codec_bytes = registry.counter(
+    "storage_codec_bytes_total", "Bytes through the storage codec (raw/stored ratio)",
+    ("codec", "op", "side"))
+codec_seconds = registry.counter(
+    "storage_codec_seconds_total", "CPU time in the storage codec", ("codec", "op"))
+codec_skipped = registry.counter(
+    "storage_codec_skipped_total", "Uploads stored without compression", ("reason",))
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("STORAGE_CODEC=zstd requires the 'zstandard' package")
+    return zstandard
+
+
+def check_codec():
+    # при старте: настроенный кодек должен быть доступен
+    if settings.STORAGE_CODEC == "zstd":
+        _zstd()
+
+
+def codec_of(stored_filename: str) -> str:
+    for codec, suffix in CODEC_SUFFIXES.items():
+        if stored_filename.endswith(suffix):
+            return codec
+    return IDENTITY
+
+
+def _account(codec: str, op: str, raw: int, stored: int, seconds: float):
+    codec_seconds.inc(codec, op, amount=seconds)
+    codec_bytes.inc(codec, op, "raw", amount=raw)
+    codec_bytes.inc(codec, op, "stored", amount=stored)
+
+
+class _Compressor:
+    """
+    Обёртка над compressobj: считает байты и время
+    """
+    __slots__ = ("codec", "_obj")
+
+    def __init__(self, codec: str, obj):
+        self.codec = codec
+        self._obj = obj
+
+    def process(self, data: bytes) -> bytes:
+        if not data:
+            return b""
+        started = time.perf_counter()
+        out = self._obj.compress(data)
+        _account(self.codec, "compress", len(data), len(out), time.perf_counter() - started)
+        return out
+
+    def flush(self) -> bytes:
+        started = time.perf_counter()
+        out = self._obj.flush()
+        _account(self.codec, "compress", 0, len(out), time.perf_counter() - started)
+        return out
+
+
+def compressor(codec: str) -> _Compressor:
+    if codec == "gzip":
+        # wbits=31 - формат gzip: файл можно отдать как Content-Encoding: gzip
+        level = settings.STORAGE_CODEC_LEVEL or 6
+        return _Compressor(codec, zlib.compressobj(level, zlib.DEFLATED, 31))
+    level = settings.STORAGE_CODEC_LEVEL or 3
+    return _Compressor(codec, _zstd().ZstdCompressor(level=level).compressobj())
+
+
+class _RawTap:
+    """
+    Файл для stream_reader: запоминает прочитанные с диска байты,
+    чтобы отдавать их вместе с распакованными
+    """
+
+    def __init__(self, f: BinaryIO):
+        self._f = f
+        self._taken: list[bytes] = []
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._f.read(size)
+        self._taken.append(data)
+        return data
+
+    def take(self) -> bytes:
+        out = b"".join(self._taken)
+        self._taken.clear()
+        return out
+
+
+def _iter_gzip(f: BinaryIO) -> Iterator[tuple[bytes, bytes]]:
+    # распаковка кусками не больше CHUNK_SIZE: 1 МиБ сжатых нулей - это
+    # гигабайт на выходе, целиком в памяти его держать нельзя
+    decoder = zlib.decompressobj(31)
+    for raw in iter(lambda: f.read(CHUNK_SIZE), b""):
+        pending, first = raw, True
+        while True:
+            started = time.perf_counter()
+            out = decoder.decompress(pending, CHUNK_SIZE)
+            _account("gzip", "decompress", len(out), len(pending) - len(decoder.unconsumed_tail),
+                     time.perf_counter() - started)
+            yield (raw if first else b""), out
+            first = False
+            pending = decoder.unconsumed_tail
+            if not pending and len(out) < CHUNK_SIZE:
+                break
+    yield b"", decoder.flush()
+
+
+def _iter_zstd(f: BinaryIO) -> Iterator[tuple[bytes, bytes]]:
+    tap = _RawTap(f)
+    reader = _zstd().ZstdDecompressor().stream_reader(tap, read_size=CHUNK_SIZE, read_across_frames=True)
+    while True:
+        started = time.perf_counter()
+        out = reader.read(CHUNK_SIZE)
+        raw = tap.take()
+        _account("zstd", "decompress", len(out), len(raw), time.perf_counter() - started)
+        if not out and not raw:
+            break
+        yield raw, out
+
+
+def choose_codec(head: bytes, complete: bool) -> str:
+    """
+    Кодек для новой загрузки по её началу (complete - файл целиком в head)
+    """
+    codec = settings.STORAGE_CODEC
+    if codec == "none":
+        return IDENTITY
+    if complete and len(head) < settings.STORAGE_COMPRESS_MIN_BYTES:
+        codec_skipped.inc("small")
+        return IDENTITY
+    if head.startswith(COMPRESSED_MAGIC) or head[4:8] == b"ftyp":
+        codec_skipped.inc("compressed_format")
+        return IDENTITY
+
+    sample = head[:COMPRESS_SAMPLE_BYTES]
+    if len(zlib.compress(sample, 1)) > len(sample) * COMPRESS_MIN_RATIO:
+        codec_skipped.inc("incompressible")
+        return IDENTITY
+    return codec
+
+
+def iter_stored(path: str) -> Iterator[tuple[bytes, bytes]]:
+    """
+    Пары (байты файла, исходные байты), каждая часть не больше CHUNK_SIZE;
+    для несжатого файла они совпадают. Сжатый кусок может распаковаться
+    в несколько пар - байты файла идут в первой из них.
+    """
+    codec = codec_of(path)
     with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(1024 * 1024), b""):
-            h.update(chunk)
+        if codec == "gzip":
+            yield from _iter_gzip(f)
+        elif codec == "zstd":
+            yield from _iter_zstd(f)
+        else:
+            for raw in iter(lambda: f.read(CHUNK_SIZE), b""):
+                yield raw, raw
+
+
+def sha256_file(path: str) -> str:
+    # хэш исходного содержимого, даже если файл хранится сжатым
+    h = MeteredHash("file")
+    for _, chunk in iter_stored(path):
+        h.update(chunk)
     return h.hexdigest()
 
 
-def save_upload(file: UploadFile) -> tuple[str, str, str]:
+def _read_chunks(fileobj: BinaryIO):
+    size = 0
+    while True:
+        chunk = fileobj.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > settings.MAX_UPLOAD_BYTES:
+            raise UploadTooLarge(f"upload exceeds {settings.MAX_UPLOAD_BYTES} bytes")
+        yield chunk
+
+
+def stage_upload(file: UploadFile) -> tuple[str, str, int]:
+    return stage_stream(file.file)
+
+
+def stage_stream(fileobj: BinaryIO) -> tuple[str, str, int]:
     """
+    Пишет поток во временный файл, считая хэш за один проход.
+    Если включён STORAGE_CODEC и содержимое сжимается, файл пишется
+    сжатым (суффикс кодека в имени), хэш и размер - от исходных байт.
     Возвращает:
-    - stored_filename
-    - full_path
+    - tmp_path
     - sha256
+    - size
     """
     ensure_storage()
 
-    ext = ""
-    if file.filename and "." in file.filename:
-        ext = "." + file.filename.split(".")[-1]
+    chunks = _read_chunks(fileobj)
+    head = next(chunks, b"")
+    codec = choose_codec(head, complete=len(head) < CHUNK_SIZE)
+    encoder = compressor(codec) if codec != IDENTITY else None
 
-    stored_filename = f"{uuid.uuid4().hex}{ext}"
-    full_path = os.path.join(settings.STORAGE_PATH, stored_filename)
+    tmp_path = storage_file(f".tmp-{uuid.uuid4().hex}{CODEC_SUFFIXES.get(codec, '')}")
+    h = MeteredHash("upload")
+    size = 0
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in itertools.chain((head,), chunks):
+                h.update(chunk)
+                f.write(encoder.process(chunk) if encoder else chunk)
+                size += len(chunk)
+            if encoder:
+                f.write(encoder.flush())
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        # ошибка записи, превышение лимита или обрыв соединения
+        discard_staged(tmp_path)
+        raise
 
-    # пишем файл на диск
-    with open(full_path, "wb") as f:
-        while True:
-            chunk = file.file.read(1024 * 1024)
-            if not chunk:
-                break
-            f.write(chunk)
+    return tmp_path, h.hexdigest(), size
+
+
+def hash_upload(file: UploadFile) -> tuple[str, int]:
+    """
+    Только хэш и размер, без записи на диск - для случая, когда
+    содержимое с таким sha256 уже лежит в хранилище
+    """
+    h = MeteredHash("upload")
+    size = 0
+    for chunk in _read_chunks(file.file):
+        h.update(chunk)
+        size += len(chunk)
+    return h.hexdigest(), size
+
+
+def discard_staged(tmp_path: str | None):
+    if tmp_path and os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+
+def find_blob(db: Session, sha256: str) -> Blob | None:
+    return db.get(Blob, sha256)
+
+
+def _staged_blob(sha256: str, tmp_path: str | None) -> dict:
+    # имя, кодек и размер на диске для новой строки blob'а
+    codec = codec_of(tmp_path) if tmp_path else IDENTITY
+    return {
+        "stored_filename": sha256 + CODEC_SUFFIXES.get(codec, ""),
+        "codec": codec,
+        "stored_size": os.path.getsize(tmp_path) if tmp_path else None,
+    }
+
+
+def _acquire_stmt(sha256: str, size: int, tmp_path: str | None):
+    return (
+        pg_insert(Blob)
+        .values(sha256=sha256, size=size, ref_count=1, **_staged_blob(sha256, tmp_path))
+        .on_conflict_do_update(
+            index_elements=[Blob.sha256],
+            set_={"ref_count": Blob.ref_count + 1},
+        )
+        .returning(Blob.stored_filename)
+    )
+
+
+def _reuse_stmt(sha256: str):
+    # ссылка только на живой blob: строку с ref_count 0 уже удаляет release_blob,
+    # а её файл - уже надгробие. UPDATE ждёт блокировку строки и перечитывает условие
+    return (
+        update(Blob)
+        .where(Blob.sha256 == sha256, Blob.ref_count > 0)
+        .values(ref_count=Blob.ref_count + 1)
+        .returning(Blob.stored_filename)
+    )
+
+
+def _place_blob(stored_filename: str, tmp_path: str | None):
+    if not tmp_path:
+        return
+    # у существующего blob'а может быть другой кодек - такой файл не подходит
+    if os.path.exists(blob_path(stored_filename)) or codec_of(tmp_path) != codec_of(stored_filename):
+        discard_staged(tmp_path)
+    else:
+        os.replace(tmp_path, new_blob_path(stored_filename))
+
+
+def _release_stmt(sha256: str):
+    return (
+        update(Blob)
+        .where(Blob.sha256 == sha256)
+        .values(ref_count=Blob.ref_count - 1)
+        .returning(Blob.ref_count)
+    )
+
+
+def _collect_stmt(sha256: str):
+    return delete(Blob).where(Blob.sha256 == sha256, Blob.ref_count <= 0).returning(Blob.stored_filename)
+
+
+def _bury_blob(stored_filename: str | None) -> str | None:
+    if stored_filename is None:
+        return None
+
+    full_path = blob_path(stored_filename)
+    if not os.path.exists(full_path):
+        return None
+
+    tombstone = storage_file(f".gc-{uuid.uuid4().hex}-{stored_filename}")
+    os.replace(full_path, tombstone)
+    return tombstone
+
+
+def acquire_blob(db: Session, sha256: str, size: int, tmp_path: str | None = None) -> str | None:
+    """
+    Добавляет ссылку на blob (создаёт его при первой ссылке).
+    Если передан tmp_path и файла blob'а ещё нет - файл переносится на место.
+    Без tmp_path ссылка добавляется только к существующему blob'у: если его
+    успели удалить, возвращается None и содержимое нужно записать на диск.
+    Возвращает stored_filename blob'а.
+    """
+    if tmp_path is None:
+        return db.scalar(_reuse_stmt(sha256))
+    stored_filename = db.scalar(_acquire_stmt(sha256, size, tmp_path))
+    _place_blob(stored_filename, tmp_path)
+    return stored_filename
+
+
+def release_blob(db: Session, sha256: str) -> str | None:
+    """
+    Убирает ссылку на blob. Когда ссылок не осталось, строка blob'а удаляется,
+    а файл переименовывается в "надгробие" (пока держится блокировка строки,
+    чтобы параллельная загрузка того же содержимого не потеряла файл).
+    Возвращает путь надгробия - его удаляют после commit через purge_tombstone().
+    """
+    remaining = db.scalar(_release_stmt(sha256))
+    if remaining is None or remaining > 0:
+        return None
+    return _bury_blob(db.scalar(_collect_stmt(sha256)))
+
+
+def acquire_blobs(db: Session, staged: dict[str, tuple[int, str | None]]) -> dict[str, str]:
+    """
+    acquire_blob для пачки: staged = {sha256: (size, tmp_path)}, один запрос.
+    Строки блокируются в порядке sha256 - параллельные пачки не взаимоблокируются.
+    Возвращает {sha256: stored_filename}.
+    """
+    if not staged:
+        return {}
+
+    digests = sorted(staged)
+    stmt = (
+        pg_insert(Blob)
+        .values([
+            {"sha256": sha, "size": staged[sha][0], "ref_count": 1, **_staged_blob(sha, staged[sha][1])}
+            for sha in digests
+        ])
+        .on_conflict_do_update(
+            index_elements=[Blob.sha256],
+            set_={"ref_count": Blob.ref_count + 1},
+        )
+        .returning(Blob.sha256, Blob.stored_filename)
+    )
+    stored = dict(db.execute(stmt).tuples().all())
+    for sha in digests:
+        _place_blob(stored[sha], staged[sha][1])
+    return stored
+
+
+async def acquire_blob_async(
+    db: AsyncSession, sha256: str, size: int, tmp_path: str | None = None
+) -> str | None:
+    if tmp_path is None:
+        return await db.scalar(_reuse_stmt(sha256))
+    stored_filename = await db.scalar(_acquire_stmt(sha256, size, tmp_path))
+    await run_in_threadpool(_place_blob, stored_filename, tmp_path)
+    return stored_filename
+
+
+async def release_blob_async(db: AsyncSession, sha256: str) -> str | None:
+    remaining = await db.scalar(_release_stmt(sha256))
+    if remaining is None or remaining > 0:
+        return None
+    stored_filename = await db.scalar(_collect_stmt(sha256))
+    return await run_in_threadpool(_bury_blob, stored_filename)
+
+
+def purge_tombstone(tombstone: str | None):
+    if tombstone and os.path.exists(tombstone):
+        os.remove(tombstone)
+
+
+def restore_tombstone(tombstone: str | None):
+    # откат транзакции: blob снова нужен
+    if tombstone and os.path.exists(tombstone):
+        stored_filename = os.path.basename(tombstone).split("-", 2)[2]
+        os.replace(tombstone, new_blob_path(stored_filename))
+
+
+def migrate_legacy_files(db: Session, batch_size: int = 500) -> int:
+    """
+    Переводит документы со старыми файлами uuid4().hex на blob'ы по sha256.
+    Можно прерывать и запускать повторно: уже переведённые документы пропускаются.
+    В конце проверяет внешний ключ documents -> blobs (миграция 0002 добавляет его NOT VALID).
+    Возвращает число переведённых документов.
+    """
+    ensure_storage()
+    migrated = 0
+
+    while True:
+        # старые документы - те, у чьего файла нет строки blob'а
+        # (сравнение с file_sha256 приняло бы за старые сжатые blob'ы "<sha>.gz")
+        docs = db.scalars(
+            select(Document)
+            .where(~exists().where(Blob.stored_filename == Document.stored_filename))
+            .order_by(Document.id)
+            .limit(batch_size)
+        ).all()
+        if not docs:
+            break
+
+        leftovers = []
+        for doc in docs:
+            legacy_path = storage_file(doc.stored_filename)
+            # ссылка добавляется сразу, строка blob'а заблокирована до commit:
+            # параллельное удаление не соберёт blob, пока документ переводится
+            stored_filename = db.scalar(_reuse_stmt(doc.file_sha256))
+
+            if os.path.exists(legacy_path):
+                if stored_filename is not None and os.path.exists(blob_path(stored_filename)):
+                    # лишняя копия уже сохранённого содержимого
+                    leftovers.append(legacy_path)
+                else:
+                    os.replace(legacy_path, new_blob_path(doc.file_sha256))
+                    if stored_filename is not None:
+                        # файла blob'а не было - теперь это несжатая копия
+                        stored_filename = doc.file_sha256
+                        db.execute(
+                            update(Blob)
+                            .where(Blob.sha256 == doc.file_sha256)
+                            .values(stored_filename=stored_filename, codec=IDENTITY, stored_size=None)
+                        )
+
+            if stored_filename is None:
+                target_path = blob_path(doc.file_sha256)
+                size = os.path.getsize(target_path) if os.path.exists(target_path) else 0
+                stored_filename = db.scalar(_acquire_stmt(doc.file_sha256, size, None))
+            doc.stored_filename = stored_filename
+            migrated += 1
+
+        db.commit()
+
+        for path in leftovers:
+            discard_staged(path)
+
+    # у всех документов есть blob: проверяем внешний ключ, добавленный NOT VALID
+    db.execute(text(f"ALTER TABLE documents VALIDATE CONSTRAINT {DOCUMENT_BLOB_FK}"))
+    db.commit()
+    return migrated
+
+
+def migrate_layout(
+    batch_size: int = 1000,
+    pause: float = 0.5,
+    grace: float = 5.0,
+    log: Callable[[str], None] | None = None,
+) -> int:
+    """
+    Переносит blob'ы из корня хранилища в каталоги ab/cd/ при работающем API.
+    Файл сначала получает жёсткую ссылку на новом месте, старое имя удаляется
+    через grace секунд - запросы, уже выбравшие старый путь, успевают его
+    открыть. Между пачками - пауза pause. Прерванный перенос продолжается
+    повторным запуском. Возвращает число перенесённых файлов.
+    Прогресс пишется в log (по умолчанию - logger модуля).
+    """
+    log = log or logger.info
+    moved = 0
+    pending: deque[tuple[float, str]] = deque()
+
+    def unlink_due(now: float):
+        while pending and pending[0][0] <= now:
+            discard_staged(pending.popleft()[1])
+
+    with os.scandir(settings.STORAGE_PATH) as entries:
+        for entry in entries:
+            if not BLOB_NAME.match(entry.name) or not entry.is_file(follow_symlinks=False):
+                continue
+
+            target = layout_path(entry.name, "fanout")
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            try:
+                os.link(entry.path, target)
+            except FileExistsError:
+                # тот же blob уже на новом месте (загружен заново после переключения)
+                pass
+            except FileNotFoundError:
+                # blob удалили, пока шёл перенос
+                continue
+            except OSError:
+                # файловая система без жёстких ссылок
+                os.replace(entry.path, target)
+                moved += 1
+                continue
+
+            pending.append((time.monotonic() + grace, entry.path))
+            moved += 1
+            if moved % batch_size == 0:
+                log(f"moved {moved}")
+                time.sleep(pause)
+                unlink_due(time.monotonic())
+
+    if pending:
+        time.sleep(max(0.0, pending[-1][0] - time.monotonic()))
+        unlink_due(float("inf"))
+    return moved
 
-    sha256 = sha256_file(full_path)
-    return stored_filename, full_path, sha256
@@ -0,0 +1,182 @@
+"""
+Докачиваемые загрузки: сессия, куски по смещению, финализация.
+
+Куски одной сессии сериализуются блокировкой строки (SELECT ... FOR UPDATE),
+разные сессии пишутся параллельно в любых воркерах. Данные копятся в
+.upload-<id>; sha256 считается по мере приёма, пока куски приходят в тот же
+процесс, иначе - одним проходом по файлу при финализации.
+"""
+import hashlib
+import os
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.db.models import UploadSession
+from app.services.storage import CHUNK_SIZE, discard_staged, ensure_storage, stage_stream, storage_file
+
+SESSION_PREFIX = ".upload-"
+
+# состояние sha256 по сессиям этого процесса: id -> (принято байт, хэш)
+_hash_states = TTLCache(maxsize=1000, ttl=settings.UPLOAD_SESSION_TTL)
+
+
+class ChunkConflict(Exception):
+    """
+    Смещение не совпадает с принятым: клиенту нужно продолжить с received
+    """
+
+    def __init__(self, received: int):
+        super().__init__(f"expected offset {received}")
+        self.received = received
+
+
+class ChunkMismatch(Exception):
+    pass
+
+
+def session_path(session_id: str) -> str:
+    return storage_file(f"{SESSION_PREFIX}{session_id}")
+
+
+def new_expiry() -> datetime:
+    return datetime.utcnow() + timedelta(seconds=settings.UPLOAD_SESSION_TTL)
+
+
+def create_session(db: Session, **fields) -> UploadSession:
+    ensure_storage()
+    upload = UploadSession(id=uuid.uuid4().hex, received=0, expires_at=new_expiry(), **fields)
+    # пустой файл сразу: куски пишутся в него по смещению
+    open(session_path(upload.id), "wb").close()
+    db.add(upload)
+    return upload
+
+
+def lock_session(db: Session, session_id: str) -> UploadSession | None:
+    return db.scalar(
+        select(UploadSession).where(UploadSession.id == session_id).with_for_update()
+    )
+
+
+def _read_range(path: str, offset: int, length: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+def write_chunk(upload: UploadSession, offset: int, data: bytes, chunk_sha256: str | None) -> int:
+    """
+    Пишет кусок; строка сессии должна быть заблокирована. Повтор уже
+    принятого куска (те же байты) ничего не меняет. Возвращает received.
+    """
+    path = session_path(upload.id)
+    end = offset + len(data)
+
+    if end <= upload.received:
+        # повтор после обрыва: байты должны совпасть с уже записанными
+        if _read_range(path, offset, len(data)) != data:
+            raise ChunkMismatch("chunk differs from received data")
+        return upload.received
+
+    if offset != upload.received:
+        raise ChunkConflict(upload.received)
+    if end > upload.total_size:
+        raise ChunkMismatch("chunk exceeds declared size")
+    if chunk_sha256 and hashlib.sha256(data).hexdigest() != chunk_sha256:
+        raise ChunkMismatch("chunk checksum mismatch")
+
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        os.pwrite(fd, data, offset)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    state = _hash_states.get(upload.id)
+    if state is not None and state[0] == offset:
+        state[1].update(data)
+        _hash_states.set(upload.id, (end, state[1]))
+    elif offset == 0:
+        _hash_states.set(upload.id, (end, hashlib.sha256(data)))
+    else:
+        # предыдущие куски принимал другой процесс
+        _hash_states.pop(upload.id)
+
+    upload.received = end
+    upload.expires_at = new_expiry()
+    return end
+
+
+def _file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def stage_session(upload: UploadSession) -> tuple[str, str]:
+    """
+    Готовит принятый файл к передаче в acquire_blob: (tmp_path, sha256).
+    Без сжатия файл просто переименовывается; со сжатием - перекодируется
+    (stage_stream заодно считает хэш).
+    """
+    path = session_path(upload.id)
+    state = _hash_states.pop(upload.id)
+
+    if settings.STORAGE_CODEC != "none":
+        with open(path, "rb") as f:
+            tmp_path, sha256, _ = stage_stream(f)
+        discard_staged(path)
+        return tmp_path, sha256
+
+    if state is not None and state[0] == upload.received:
+        sha256 = state[1].hexdigest()
+    else:
+        sha256 = _file_sha256(path)
+    tmp_path = storage_file(f".tmp-{uuid.uuid4().hex}")
+    os.replace(path, tmp_path)
+    return tmp_path, sha256
+
+
+def drop_session(db: Session, upload: UploadSession):
+    db.delete(upload)
+    _hash_states.pop(upload.id)
+    discard_staged(session_path(upload.id))
+
+
+def collect_expired_sessions(db: Session, now: datetime | None = None) -> int:
+    """
+    Удаляет просроченные сессии и их файлы, а также файлы .upload-*
+    без строки в БД (оборванное создание). Возвращает число удалённых файлов.
+    """
+    now = now or datetime.utcnow()
+    expired = db.scalars(
+        delete(UploadSession).where(UploadSession.expires_at < now).returning(UploadSession.id)
+    ).all()
+    db.commit()
+
+    removed = 0
+    for session_id in expired:
+        _hash_states.pop(session_id)
+        if os.path.exists(session_path(session_id)):
+            discard_staged(session_path(session_id))
+            removed += 1
+
+    if not os.path.isdir(settings.STORAGE_PATH):
+        return removed
+
+    live = set(db.scalars(select(UploadSession.id)))
+    cutoff = (now - timedelta(seconds=settings.UPLOAD_SESSION_TTL)).timestamp()
+    for entry in os.scandir(settings.STORAGE_PATH):
+        if not entry.name.startswith(SESSION_PREFIX):
+            continue
+        if entry.name[len(SESSION_PREFIX):] in live or entry.stat().st_mtime > cutoff:
+            continue
+        discard_staged(entry.path)
+        removed += 1
+    return removed
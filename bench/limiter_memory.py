@@ -0,0 +1,62 @@
+"""
+Память на ключ: старый лимитер (deque с метками времени в defaultdict)
+против SlidingWindowCounter.
+
+    python -m bench.limiter_memory --keys 100000 --hits 5
+"""
+import argparse
+import time
+import tracemalloc
+from collections import defaultdict, deque
+
+from app.core.limiter import SlidingWindowCounter
+
+
+def measure(fill) -> int:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    holder = fill()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del holder
+    return after - before
+
+
+def fill_deque(keys: int, hits: int):
+    storage = defaultdict(deque)
+    now = time.time()
+    for i in range(keys):
+        q = storage[f"user{i}:10.0.{i % 256}.{i % 251}"]
+        for _ in range(hits):
+            q.append(now)
+    return storage
+
+
+def fill_counter(keys: int, hits: int):
+    counter = SlidingWindowCounter(window_seconds=60, max_keys=keys)
+    for i in range(keys):
+        key = f"user{i}:10.0.{i % 256}.{i % 251}"
+        for _ in range(hits):
+            counter.add(key)
+    return counter
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keys", type=int, default=100_000)
+    parser.add_argument("--hits", type=int, default=5)
+    args = parser.parse_args()
+
+    for name, fill in (("deque", fill_deque), ("sliding_window", fill_counter)):
+        total = measure(lambda: fill(args.keys, args.hits))
+        print(f"{name:15} total={total / 1024 / 1024:8.2f} MiB  per_key={total / args.keys:7.1f} B")
+
+    # ограничение числа ключей: в 10 раз больше ключей, чем max_keys
+    counter = SlidingWindowCounter(window_seconds=60, max_keys=args.keys // 10)
+    for i in range(args.keys):
+        counter.add(f"k{i}")
+    print(f"capped          keys={len(counter)} evicted={counter.evicted}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Нагрузочный прогон горячих путей API: задержки p50/p95/p99, пропускная
+способность и число SQL-запросов на запрос по каждому сценарию.
+
+По умолчанию app.main:app вызывается в процессе через httpx.ASGITransport
+(без сети, с подсчётом запросов к БД); с --url - против запущенного сервера.
+Нужен Postgres с данными из bench.seed (SQLite не подходит: схема
+использует секционирование, upsert'ы и массивы Postgres).
+
+    python -m bench.seed --documents 100000
+    python -m bench.run --requests 500 --concurrency 16 --out bench/results.json
+    python -m bench.run --baseline bench/results.json --tolerance 0.2
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+import httpx
+
+# счётчик SQL-запросов текущей задачи бенчмарка; контекст копируется
+# в обработчик и его пул потоков, поэтому список общий
+_queries: ContextVar[list[int] | None] = ContextVar("bench_queries", default=None)
+
+
+def count_queries(conn, cursor, statement, parameters, context, executemany):
+    counter = _queries.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+@dataclass
+class Context:
+    manifest: dict
+    tokens: dict[int, str]
+    rng: random.Random
+
+    def auth(self, user_id: int) -> dict:
+        return {"Authorization": f"Bearer {self.tokens[user_id]}"}
+
+
+@dataclass
+class Stats:
+    latencies: list[float] = field(default_factory=list)
+    queries: list[int] = field(default_factory=list)
+    errors: int = 0
+    bytes: int = 0
+
+
+async def login(client: httpx.AsyncClient, ctx: Context, username: str) -> httpx.Response:
+    return await client.post(
+        "/auth/login",
+        data={"username": username, "password": ctx.manifest["password"]},
+    )
+
+
+async def scenario_login(client, ctx):
+    return await login(client, ctx, ctx.manifest["users"][str(ctx.manifest["shared_user_id"])])
+
+
+async def scenario_me(client, ctx):
+    return await client.get("/auth/me", headers=ctx.auth(ctx.manifest["shared_user_id"]))
+
+
+async def scenario_list_owner(client, ctx):
+    # владелец большей части документов: индекс (owner_id, id)
+    return await client.get("/documents/", params={"limit": 50}, headers=ctx.auth(ctx.manifest["heavy_owner_id"]))
+
+
+async def scenario_list_shared(client, ctx):
+    # документы, выданные пользователю: EXISTS по document_access
+    return await client.get("/documents/", params={"limit": 50}, headers=ctx.auth(ctx.manifest["shared_user_id"]))
+
+
+async def scenario_view(client, ctx):
+    doc_id = ctx.rng.choice(ctx.manifest["owned_document_ids"])
+    return await client.get(f"/documents/{doc_id}", headers=ctx.auth(ctx.manifest["heavy_owner_id"]))
+
+
+async def scenario_download_large(client, ctx):
+    doc_id = ctx.manifest["large_document_id"]
+    return await client.get(f"/documents/{doc_id}/download", headers=ctx.auth(ctx.manifest["heavy_owner_id"]))
+
+
+async def scenario_upload(client, ctx):
+    return await client.post(
+        "/documents/upload",
+        params={"title": "bench upload", "doc_type": "report"},
+        files={"file": ("bench.bin", uuid.uuid4().bytes * 256, "application/octet-stream")},
+        headers=ctx.auth(ctx.manifest["heavy_owner_id"]),
+    )
+
+
+async def scenario_grant(client, ctx):
+    doc_id = ctx.rng.choice(ctx.manifest["owned_document_ids"])
+    user_id = int(ctx.rng.choice(list(ctx.manifest["users"])))
+    return await client.post(
+        f"/documents/{doc_id}/grant",
+        params={"user_id": user_id},
+        headers=ctx.auth(ctx.manifest["heavy_owner_id"]),
+    )
+
+
+SCENARIOS = {
+    "login": scenario_login,
+    "me": scenario_me,
+    "list_owner": scenario_list_owner,
+    "list_shared": scenario_list_shared,
+    "view": scenario_view,
+    "download_large": scenario_download_large,
+    "upload": scenario_upload,
+    "grant": scenario_grant,
+}
+
+
+async def run_scenario(client, ctx: Context, scenario, requests: int, concurrency: int) -> tuple[Stats, float]:
+    stats = Stats()
+    remaining = iter(range(requests))
+
+    async def worker():
+        for _ in remaining:
+            counter = [0]
+            _queries.set(counter)
+            started = time.perf_counter()
+            try:
+                response = await scenario(client, ctx)
+                ok = response.status_code < 400
+                stats.bytes += len(response.content)
+            except httpx.HTTPError:
+                ok = False
+            stats.latencies.append(time.perf_counter() - started)
+            stats.queries.append(counter[0])
+            if not ok:
+                stats.errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return stats, time.perf_counter() - started
+
+
+def summarize(stats: Stats, elapsed: float, in_process: bool) -> dict:
+    cuts = statistics.quantiles(stats.latencies, n=100, method="inclusive")
+    return {
+        "requests": len(stats.latencies),
+        "errors": stats.errors,
+        "p50_ms": round(cuts[49] * 1000, 2),
+        "p95_ms": round(cuts[94] * 1000, 2),
+        "p99_ms": round(cuts[98] * 1000, 2),
+        "rps": round(len(stats.latencies) / elapsed, 1),
+        "mb_per_sec": round(stats.bytes / elapsed / 1024 / 1024, 1),
+        "queries_per_request": round(statistics.mean(stats.queries), 2) if in_process else None,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Регрессии относительно baseline: p95 выше или rps ниже более чем на
+    tolerance, либо больше SQL-запросов на запрос
+    """
+    regressions = []
+    for name, base in baseline.items():
+        current = results.get(name)
+        if current is None:
+            continue
+        if current["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {base['p95_ms']} -> {current['p95_ms']} ms")
+        if current["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: rps {base['rps']} -> {current['rps']}")
+        if (
+            current["queries_per_request"] is not None
+            and base.get("queries_per_request") is not None
+            and current["queries_per_request"] > base["queries_per_request"] + 0.5
+        ):
+            regressions.append(
+                f"{name}: queries {base['queries_per_request']} -> {current['queries_per_request']}"
+            )
+    return regressions
+
+
+def make_client(url: str | None):
+    if url:
+        return httpx.AsyncClient(base_url=url, timeout=120), None
+
+    from sqlalchemy import event
+
+    from app.core.rate_limit import rate_limiter
+    from app.db.session import engine
+    from app.main import app
+
+    # меряем сами обработчики, а не лимитер на 20 запросов за 10 секунд
+    rate_limiter.max_requests = 10 ** 9
+    event.listen(engine, "before_cursor_execute", count_queries)
+
+    transport = httpx.ASGITransport(app=app)
+    return httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120), app
+
+
+async def main_async(args) -> int:
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+
+    client, app = make_client(args.url)
+    names = args.scenarios.split(",") if args.scenarios else list(SCENARIOS)
+
+    async with client:
+        # ASGITransport не шлёт lifespan: запускаем startup/shutdown сами
+        lifespan = app.router.lifespan_context(app) if app is not None else None
+        if lifespan is not None:
+            await lifespan.__aenter__()
+        try:
+            ctx = Context(manifest=manifest, tokens={}, rng=random.Random(args.seed))
+            for user_id in (manifest["heavy_owner_id"], manifest["shared_user_id"]):
+                response = await login(client, ctx, manifest["users"][str(user_id)])
+                response.raise_for_status()
+                ctx.tokens[user_id] = response.json()["access_token"]
+
+            results = {}
+            for name in names:
+                requests = args.requests
+                if name in ("login", "download_large"):
+                    requests = max(args.requests // 10, 10)
+                # прогрев: кэши, пул соединений, пул bcrypt
+                await run_scenario(client, ctx, SCENARIOS[name], min(requests, 10), 1)
+                stats, elapsed = await run_scenario(client, ctx, SCENARIOS[name], requests, args.concurrency)
+                results[name] = summarize(stats, elapsed, app is not None)
+                print(f"{name:15} " + "  ".join(f"{k}={v}" for k, v in results[name].items()))
+        finally:
+            if lifespan is not None:
+                await lifespan.__aexit__(None, None, None)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m bench.run")
+    parser.add_argument("--manifest", default="bench/seed.json")
+    parser.add_argument("--url", help="гонять запущенный сервер вместо ASGI в процессе")
+    parser.add_argument("--scenarios", help=f"через запятую из: {','.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="сохранить результаты (JSON) как будущий baseline")
+    parser.add_argument("--baseline", help="сравнить с результатами прошлого прогона")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main_async(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Наполнение базы для нагрузочных прогонов (bench.run).
+
+Владельцы документов распределены по Ципфу (несколько пользователей
+владеют большей частью документов), у документа в среднем --grants
+выданных доступов, содержимое - пул blob'ов с логнормальными размерами
+плюс один большой файл для скачивания.
+
+    python -m bench.seed --users 1000 --documents 100000 --manifest bench/seed.json
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import time
+
+from sqlalchemy import insert, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.core.security import pwd_context
+from app.db.migrations import upgrade
+from app.db.models import Blob, Document, DocumentAccess, DocumentType, Role, User
+from app.db.session import SessionLocal, engine
+from app.services.storage import ensure_storage, new_blob_path
+
+PASSWORD = "bench-pass"
+BATCH = 5000
+
+
+def zipf_weights(n: int, s: float = 1.1) -> list[float]:
+    return [1 / (rank ** s) for rank in range(1, n + 1)]
+
+
+def write_blob(content: bytes) -> tuple[str, int]:
+    sha = hashlib.sha256(content).hexdigest()
+    with open(new_blob_path(sha), "wb") as f:
+        f.write(content)
+    return sha, len(content)
+
+
+def insert_batched(db, model, rows: list[dict]):
+    for i in range(0, len(rows), BATCH):
+        db.execute(insert(model), rows[i:i + BATCH])
+
+
+def seed(args) -> dict:
+    rng = random.Random(args.seed)
+    ensure_storage()
+    prefix = f"bench{args.seed}_"
+
+    with SessionLocal() as db:
+        # один хэш на всех: bcrypt на каждого пользователя занял бы минуты
+        password_hash = pwd_context.hash(PASSWORD)
+        roles = [Role.admin if i == 0 else Role.executor if i % 5 == 0 else Role.user
+                 for i in range(args.users)]
+        insert_batched(db, User, [
+            {"username": f"{prefix}{i}", "password_hash": password_hash, "role": role}
+            for i, role in enumerate(roles)
+        ])
+        user_ids = list(db.scalars(
+            select(User.id).where(User.username.like(f"{prefix}%")).order_by(User.id)
+        ))
+
+        # пул содержимого: от сотен байт до нескольких мегабайт
+        blobs = []
+        for i in range(args.blobs):
+            size = min(int(rng.lognormvariate(9, 1.5)), 8 * 1024 * 1024)
+            blobs.append(write_blob(rng.randbytes(size)))
+        large = write_blob(os.urandom(args.large_mb * 1024 * 1024))
+
+        owners = rng.choices(user_ids[1:], weights=zipf_weights(len(user_ids) - 1), k=args.documents)
+        picks = rng.choices(blobs, k=args.documents)
+        doc_types = list(DocumentType)
+        docs = [
+            {
+                "title": f"bench document {i}",
+                "doc_type": rng.choice(doc_types),
+                "original_filename": f"doc{i}.bin",
+                "stored_filename": sha,
+                "file_sha256": sha,
+                "owner_id": owner,
+            }
+            for i, (owner, (sha, _)) in enumerate(zip(owners, picks))
+        ]
+        heavy_owner = max(set(owners), key=owners.count)
+        docs.append({
+            "title": "bench large document",
+            "doc_type": DocumentType.report,
+            "original_filename": "large.bin",
+            "stored_filename": large[0],
+            "file_sha256": large[0],
+            "owner_id": heavy_owner,
+        })
+
+        all_blobs = {sha: size for sha, size in blobs + [large]}
+        db.execute(
+            pg_insert(Blob)
+            .values([
+                {"sha256": sha, "stored_filename": sha, "size": size, "ref_count": 0}
+                for sha, size in all_blobs.items()
+            ])
+            .on_conflict_do_nothing(index_elements=[Blob.sha256])
+        )
+        insert_batched(db, Document, docs)
+        doc_rows = db.execute(
+            select(Document.id, Document.owner_id)
+            .where(Document.owner_id.in_(user_ids))
+            .order_by(Document.id)
+        ).all()
+        db.execute(text(
+            "UPDATE blobs SET ref_count = (SELECT count(*) FROM documents d WHERE d.file_sha256 = blobs.sha256) "
+            "WHERE sha256 = ANY(:digests)"
+        ), {"digests": list(all_blobs)})
+
+        # выданные доступы: в среднем --grants на документ
+        grants = set()
+        for doc_id, owner_id in doc_rows:
+            for _ in range(int(rng.expovariate(1 / args.grants)) if args.grants else 0):
+                user_id = rng.choice(user_ids)
+                if user_id != owner_id:
+                    grants.add((doc_id, user_id))
+        insert_batched(db, DocumentAccess, [
+            {"document_id": doc_id, "user_id": user_id} for doc_id, user_id in grants
+        ])
+        db.commit()
+
+        shared_user = db.scalar(
+            select(DocumentAccess.user_id)
+            .where(DocumentAccess.user_id.in_(user_ids))
+            .group_by(DocumentAccess.user_id)
+            .order_by(text("count(*) DESC"))
+            .limit(1)
+        )
+
+    owned = [doc_id for doc_id, owner_id in doc_rows if owner_id == heavy_owner]
+    return {
+        "password": PASSWORD,
+        "users": {str(user_id): f"{prefix}{i}" for i, user_id in enumerate(user_ids)},
+        "admin_id": user_ids[0],
+        "heavy_owner_id": heavy_owner,
+        "shared_user_id": shared_user or user_ids[1],
+        "owned_document_ids": owned[:1000],
+        "large_document_id": owned[-1],
+        "documents": len(doc_rows),
+        "grants": len(grants),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m bench.seed")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--documents", type=int, default=1000)
+    parser.add_argument("--grants", type=float, default=2.0, help="среднее число доступов на документ")
+    parser.add_argument("--blobs", type=int, default=200)
+    parser.add_argument("--large-mb", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--manifest", default="bench/seed.json")
+    args = parser.parse_args()
+
+    upgrade(engine, log=lambda message: None)
+    started = time.perf_counter()
+    manifest = seed(args)
+    with open(args.manifest, "w") as f:
+        json.dump(manifest, f)
+    print(
+        f"seeded users={len(manifest['users'])} documents={manifest['documents']} "
+        f"grants={manifest['grants']} in {time.perf_counter() - started:.1f}s -> {args.manifest}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.core.deps import Principal
+from app.db.models import Role
+from app.services import acl
+from app.services.acl import AccessSet, AclCache
+
+USER = Principal(id=7, username="reader", role=Role.user)
+
+
+class FakeDb:
+    """
+    acl_versions и document_access одного пользователя: на эти запросы
+    can_access и отвечает
+    """
+
+    def __init__(self, ids, version=0):
+        self.ids = set(ids)
+        self.version = version
+        self.queries = []
+
+    def scalar(self, stmt, params):
+        if stmt is acl._VERSION_SQL:
+            self.queries.append("version")
+            return self.version
+        assert stmt is acl._CHECK_SQL
+        self.queries.append("check")
+        return params["document_id"] in self.ids
+
+    def execute(self, stmt, params):
+        assert stmt is acl._LOAD_SQL
+        self.queries.append("load")
+        row = SimpleNamespace(version=self.version, ids=sorted(self.ids)[: params["max_ids"]])
+        return SimpleNamespace(one=lambda: row)
+
+    def revoke(self, doc_id):
+        # отзыв в другом воркере: строка и версия меняются только в БД
+        self.ids.discard(doc_id)
+        self.version += 1
+
+
+def doc(doc_id, owner_id=1):
+    return SimpleNamespace(id=doc_id, owner_id=owner_id)
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = AclCache(maxsize=100, ttl=600, recheck=0.2, max_ids=100)
+    monkeypatch.setattr(acl, "acl_cache", cache)
+    return cache
+
+
+def test_access_set_add_discard():
+    # набор приходит из БД уже отсортированным
+    s = AccessSet([1, 3, 5], version=0)
+
+    s.add([4, 3, 10, 0])
+    assert list(s.ids) == [0, 1, 3, 4, 5, 10]
+    assert 4 in s and 2 not in s
+
+    s.discard([0, 2, 10])
+    assert list(s.ids) == [1, 3, 4, 5]
+    assert 10 not in s and 0 not in s
+
+
+def test_apply_next_version_patches_set(cache):
+    cache.store(1, 3, [10])
+    cache.granted({1: 4}, [20, 30])
+    entry, _ = cache.lookup(1)
+    assert list(entry.ids) == [10, 20, 30] and entry.version == 4
+
+    cache.revoked({1: 5}, [10])
+    entry, _ = cache.lookup(1)
+    assert list(entry.ids) == [20, 30] and entry.version == 5
+
+    # уже учтённая версия не применяется повторно
+    cache.granted({1: 5}, [10])
+    assert 10 not in cache.lookup(1)[0]
+
+
+def test_apply_version_gap_drops_set(cache):
+    cache.store(1, 3, [10])
+    cache.store(2, 3, [10])
+    # версию 4 пользователю 1 выдал другой воркер: набор устарел
+    cache.granted({1: 5, 2: 4}, [20])
+
+    assert cache.lookup(1) == (None, False)
+    entry, _ = cache.lookup(2)
+    assert list(entry.ids) == [10, 20]
+
+
+def test_revoke_in_other_worker_seen_after_recheck(cache):
+    db = FakeDb([10, 20])
+    assert acl.can_access(db, USER, doc(10))
+    assert db.queries == ["load"]
+
+    db.revoke(10)
+    # до ACL_RECHECK_SECONDS ответ из кэша, без запросов
+    assert acl.can_access(db, USER, doc(10))
+    assert db.queries == ["load"]
+
+    time.sleep(cache.recheck)
+    assert not acl.can_access(db, USER, doc(10))
+    assert db.queries == ["load", "version", "load"]
+    assert acl.can_access(db, USER, doc(20))
+
+
+def test_unchanged_version_keeps_set(cache):
+    db = FakeDb([10])
+    acl.can_access(db, USER, doc(10))
+    time.sleep(cache.recheck)
+    assert acl.can_access(db, USER, doc(10))
+    assert db.queries == ["load", "version"]
+
+
+def test_oversize_set_falls_back_to_query(cache):
+    cache.max_ids = 3
+    db = FakeDb([1, 2, 3, 4, 5])
+
+    assert acl.can_access(db, USER, doc(5))
+    assert not acl.can_access(db, USER, doc(6))
+    # набор не кэшируется, каждое решение - отдельный запрос
+    assert len(cache) == 0
+    assert db.queries == ["load", "check", "load", "check"]
+
+
+def test_owner_and_admin_skip_cache(cache):
+    db = FakeDb([])
+    assert acl.can_access(db, USER, doc(1, owner_id=USER.id))
+    admin = Principal(id=8, username="admin", role=Role.admin)
+    assert acl.can_access(db, admin, doc(1))
+    assert db.queries == []
@@ -0,0 +1,56 @@
+import io
+import os
+import zipfile
+
+import pytest
+from fastapi import UploadFile
+
+from app.core.config import settings
+from app.services.batch_upload import BatchTooLarge, collect_sources, discard_batch, stage_sources
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "STORAGE_PATH", str(tmp_path))
+    return tmp_path
+
+
+def make_zip(entries: dict[str, bytes], corrupt: str | None = None) -> UploadFile:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, content in entries.items():
+            archive.writestr(name, content)
+    data = bytearray(buf.getvalue())
+    if corrupt:
+        # порча сжатых данных записи: при чтении - zlib.error, не OSError
+        info = zipfile.ZipFile(io.BytesIO(bytes(data))).getinfo(corrupt)
+        start = info.header_offset + 30 + len(info.filename.encode()) + len(info.extra)
+        data[start:start + 16] = b"\xff" * 16
+    return UploadFile(io.BytesIO(bytes(data)), filename="batch.zip")
+
+
+def leftovers(storage) -> list[str]:
+    return [name for name in os.listdir(storage) if name.startswith(".tmp-")]
+
+
+def test_corrupt_zip_member_is_unreadable(storage):
+    entries = {"a.txt": b"a" * 5000, "bad.txt": os.urandom(5000), "c.txt": b"c" * 5000}
+    staged = stage_sources(collect_sources([make_zip(entries, corrupt="bad.txt")]))
+
+    assert [(item.filename, item.error) for item in staged] == [
+        ("a.txt", None), ("bad.txt", "unreadable"), ("c.txt", None)
+    ]
+    assert len(leftovers(storage)) == 2
+    discard_batch(staged)
+    assert leftovers(storage) == []
+
+
+def test_batch_total_size_limit(storage, monkeypatch):
+    monkeypatch.setattr(settings, "BATCH_UPLOAD_MAX_BYTES", 10_000)
+    # сжатый архив мал, распакованные записи - нет
+    sources = collect_sources([make_zip({f"{i}.txt": bytes(4000) for i in range(10)})])
+
+    with pytest.raises(BatchTooLarge):
+        stage_sources(sources)
+    # уже записанные файлы пакета удалены
+    assert leftovers(storage) == []
@@ -0,0 +1,9 @@
+from app.routers.documents import search_tsquery
+
+
+def test_search_tsquery():
+    # каждое слово - префикс, все обязательны, знаки препинания отбрасываются
+    assert search_tsquery("Дог 2024") == "дог:* & 2024:*"
+    assert search_tsquery("report_q1.pdf") == "report:* & q1:* & pdf:*"
+    assert search_tsquery("a:*|b") == "a:* & b:*"
+    assert search_tsquery("!!! ") is None
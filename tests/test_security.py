@@ -1,4 +1,7 @@
+import io
 import time
+import uuid
+import zipfile
 import pytest
 import httpx
 import os
@@ -24,6 +27,35 @@ def auth_headers(token: str):
     return {"Authorization": f"Bearer {token}"}
 
 
+class ApiUser:
+    """
+    Отдельный пользователь на тест: свой лимит запросов и чистые права
+    """
+
+    def __init__(self, prefix: str):
+        username = f"{prefix}_{uuid.uuid4().hex[:8]}"
+        register(username, "1234")
+        self.headers = auth_headers(login(username, "1234").json()["access_token"])
+        self.id = httpx.get(f"{BASE_URL}/auth/me", headers=self.headers).json()["id"]
+
+    def upload(self, filename: str, title: str = "Doc", doc_type: str = "contract",
+               content: bytes | None = None) -> int:
+        content = content or f"{filename}-{uuid.uuid4().hex}".encode()
+        r = httpx.post(
+            f"{BASE_URL}/documents/upload",
+            params={"title": title, "doc_type": doc_type},
+            files={"file": (filename, content, "text/plain")},
+            headers=self.headers,
+        )
+        assert r.status_code == 200
+        return r.json()["id"]
+
+
+@pytest.fixture
+def new_user():
+    return ApiUser
+
+
 @pytest.fixture(scope="session")
 def tokens():
     # создаём пользователей (если уже есть — норм)
@@ -87,6 +119,235 @@ def test_bruteforce_protection():
     assert r.status_code in (429, 401)
 
 
+def test_list_visibility_and_pagination(tokens):
+    t1 = tokens["user1"]
+    t2 = tokens["user2"]
+
+    files = {"file": ("b.txt", f"list-{time.time()}".encode(), "text/plain")}
+    r = httpx.post(
+        f"{BASE_URL}/documents/upload",
+        params={"title": "Doc B", "doc_type": "report"},
+        files=files,
+        headers=auth_headers(t1),
+    )
+    assert r.status_code == 200
+    doc_id = r.json()["id"]
+
+    # user2 не видит чужой документ в списке
+    r = httpx.get(f"{BASE_URL}/documents/", params={"limit": 500}, headers=auth_headers(t2))
+    assert r.status_code == 200
+    assert doc_id not in [d["id"] for d in r.json()]
+
+    # страница из одного документа + курсор на следующую
+    r = httpx.get(f"{BASE_URL}/documents/", params={"limit": 1}, headers=auth_headers(t1))
+    assert r.status_code == 200
+    assert [d["id"] for d in r.json()] == [doc_id]
+    after_id = r.headers["X-Next-After-Id"]
+
+    r = httpx.get(
+        f"{BASE_URL}/documents/",
+        params={"limit": 1, "after_id": after_id},
+        headers=auth_headers(t1),
+    )
+    assert r.status_code == 200
+    assert all(d["id"] < doc_id for d in r.json())
+
+
+def test_download_etag_and_range(tokens):
+    t2 = tokens["user2"]
+    content = f"range-{time.time()}".encode()
+
+    files = {"file": ("c.txt", content, "text/plain")}
+    r = httpx.post(
+        f"{BASE_URL}/documents/upload",
+        params={"title": "Doc C", "doc_type": "invoice"},
+        files=files,
+        headers=auth_headers(t2),
+    )
+    assert r.status_code == 200
+    url = f"{BASE_URL}/documents/{r.json()['id']}/download"
+
+    r = httpx.get(url, headers=auth_headers(t2))
+    assert r.status_code == 200
+    assert r.content == content
+    etag = r.headers["ETag"]
+
+    # неизменный документ повторно не скачивается
+    r = httpx.get(url, headers={**auth_headers(t2), "If-None-Match": etag})
+    assert r.status_code == 304
+
+    r = httpx.get(url, headers={**auth_headers(t2), "Range": "bytes=0-4"})
+    assert r.status_code == 206
+    assert r.content == content[:5]
+
+    # диапазон не отменяет проверку доступа
+    r = httpx.get(url, headers={**auth_headers(tokens["user1"]), "Range": "bytes=0-4"})
+    assert r.status_code == 403
+
+
+def test_resumable_upload(tokens):
+    t1 = tokens["user1"]
+    content = f"resumable-{time.time()}".encode() * 100
+
+    r = httpx.post(
+        f"{BASE_URL}/documents/uploads",
+        params={"title": "Doc D", "doc_type": "report", "filename": "d.txt", "size": len(content)},
+        headers=auth_headers(t1),
+    )
+    assert r.status_code == 200
+    url = f"{BASE_URL}/documents/uploads/{r.json()['id']}"
+
+    r = httpx.put(url, params={"offset": 0}, content=content[:1000], headers=auth_headers(t1))
+    assert r.json()["offset"] == 1000
+
+    # пропуск куска: сервер сообщает, с какого смещения продолжать
+    r = httpx.put(url, params={"offset": 2000}, content=content[2000:], headers=auth_headers(t1))
+    assert r.status_code == 409
+    assert r.headers["Upload-Offset"] == "1000"
+
+    # чужая сессия недоступна
+    r = httpx.get(url, headers=auth_headers(tokens["user2"]))
+    assert r.status_code == 404
+
+    r = httpx.put(url, params={"offset": 1000}, content=content[1000:], headers=auth_headers(t1))
+    assert r.json()["offset"] == len(content)
+
+    r = httpx.post(f"{url}/finalize", headers=auth_headers(t1))
+    assert r.status_code == 200
+    r = httpx.get(f"{BASE_URL}/documents/{r.json()['id']}/download", headers=auth_headers(t1))
+    assert r.content == content
+
+
+def test_resumable_upload_chunks_not_rate_limited(new_user):
+    # кусков больше общего лимита запросов (20 за 10 секунд)
+    headers = new_user("chunks").headers
+    content = f"chunks-{uuid.uuid4().hex}".encode() * 30
+    step = len(content) // 30
+
+    r = httpx.post(
+        f"{BASE_URL}/documents/uploads",
+        params={"title": "Doc E", "doc_type": "report", "filename": "e.txt", "size": len(content)},
+        headers=headers,
+    )
+    url = f"{BASE_URL}/documents/uploads/{r.json()['id']}"
+    for offset in range(0, len(content), step):
+        r = httpx.put(url, params={"offset": offset}, content=content[offset:offset + step], headers=headers)
+        assert r.status_code == 200
+
+    r = httpx.post(f"{url}/finalize", headers=headers)
+    assert r.status_code == 200
+
+
+def test_bulk_grant_and_revoke(new_user):
+    owner = new_user("bulk_owner")
+    a = new_user("bulk_a")
+    b = new_user("bulk_b")
+    docs = [owner.upload("bulk1.txt"), owner.upload("bulk2.txt")]
+    foreign = a.upload("foreign.txt")
+    url = f"{BASE_URL}/documents/access"
+
+    # чужой документ в пакете - отказ целиком, со списком id
+    body = {"document_ids": [*docs, foreign], "user_ids": [b.id]}
+    r = httpx.post(f"{url}/grant", json=body, headers=owner.headers)
+    assert r.status_code == 403
+    assert r.json()["detail"]["ids"] == [foreign]
+
+    body = {"document_ids": docs, "user_ids": [a.id, 10**9]}
+    r = httpx.post(f"{url}/grant", json=body, headers=owner.headers)
+    assert r.status_code == 404
+    assert r.json()["detail"]["ids"] == [10**9]
+
+    body = {"document_ids": docs, "user_ids": [a.id, b.id]}
+    r = httpx.post(f"{url}/grant", json=body, headers=owner.headers)
+    assert r.status_code == 200
+    assert r.json()["applied"] == 4
+
+    # повторная выдача ничего не меняет
+    r = httpx.post(f"{url}/grant", json=body, headers=owner.headers)
+    assert (r.json()["applied"], r.json()["skipped"]) == (0, 4)
+
+    for user in (a, b):
+        for doc_id in docs:
+            assert httpx.get(f"{BASE_URL}/documents/{doc_id}", headers=user.headers).status_code == 200
+
+    r = httpx.post(f"{url}/revoke", json=body, headers=owner.headers)
+    assert r.status_code == 200
+    assert r.json()["applied"] == 4
+
+    # отозваны все пары documents x users
+    for user in (a, b):
+        for doc_id in docs:
+            assert httpx.get(f"{BASE_URL}/documents/{doc_id}", headers=user.headers).status_code == 403
+
+
+def test_archive_download(new_user):
+    owner = new_user("zip_owner")
+    other = new_user("zip_other")
+    contents = [f"zip-{i}-{uuid.uuid4().hex}".encode() for i in range(3)]
+    docs = [
+        owner.upload("same.txt", doc_type="invoice", content=contents[0]),
+        owner.upload("same.txt", doc_type="invoice", content=contents[1]),
+        owner.upload("dir/other.txt", doc_type="invoice", content=contents[2]),
+    ]
+    foreign = other.upload("foreign.txt", doc_type="invoice")
+    url = f"{BASE_URL}/documents/archive"
+
+    r = httpx.get(url, params={"ids": [docs[0], foreign]}, headers=owner.headers)
+    assert r.status_code == 403
+    assert r.json()["detail"]["ids"] == [foreign]
+
+    # имена без каталогов и без повторов, порядок - как в запросе
+    r = httpx.get(url, params={"ids": docs}, headers=owner.headers)
+    assert r.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(r.content))
+    assert archive.testzip() is None
+    assert archive.namelist() == ["same.txt", "same (2).txt", "other.txt"]
+    assert [archive.read(name) for name in archive.namelist()] == contents
+
+    # по фильтру - только доступные документы
+    r = httpx.get(url, params={"doc_type": "invoice", "compression": "deflate"}, headers=other.headers)
+    assert r.status_code == 200
+    assert zipfile.ZipFile(io.BytesIO(r.content)).namelist() == ["foreign.txt"]
+
+    httpx.post(f"{BASE_URL}/documents/{docs[2]}/grant", params={"user_id": other.id}, headers=owner.headers)
+    r = httpx.get(url, params={"doc_type": "invoice", "owner_id": owner.id}, headers=other.headers)
+    archive = zipfile.ZipFile(io.BytesIO(r.content))
+    assert archive.namelist() == ["other.txt"]
+    assert archive.read("other.txt") == contents[2]
+
+
+def test_search(new_user):
+    owner = new_user("search_owner")
+    other = new_user("search_other")
+    word = f"srch{uuid.uuid4().hex[:10]}"
+    docs = {owner.upload(f"{word}-{i}.txt", title=f"{word} report") for i in range(3)}
+    foreign = other.upload("secret.txt", title=f"{word} secret")
+    url = f"{BASE_URL}/documents/search"
+
+    # чужой документ не находится; слово ищется по префиксу
+    r = httpx.get(url, params={"q": word[:-3]}, headers=owner.headers)
+    assert r.status_code == 200
+    assert {d["id"] for d in r.json()} == docs
+
+    r = httpx.get(url, params={"q": f"{word} secret"}, headers=owner.headers)
+    assert r.json() == []
+    r = httpx.get(url, params={"q": f"{word} secret"}, headers=other.headers)
+    assert [d["id"] for d in r.json()] == [foreign]
+
+    # страницы по курсору: одинаковый ранг, без повторов и пропусков
+    seen, cursor = [], None
+    while True:
+        params = {"q": word, "limit": 2, **({"cursor": cursor} if cursor else {})}
+        r = httpx.get(url, params=params, headers=owner.headers)
+        assert r.status_code == 200
+        seen += [d["id"] for d in r.json()]
+        cursor = r.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert len(seen) == len(set(seen))
+    assert set(seen) == docs
+
+
 def test_rate_limit(tokens):
     t1 = tokens["user1"]
     hit_429 = False
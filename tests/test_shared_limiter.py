@@ -0,0 +1,91 @@
+import uuid
+from collections import defaultdict
+from multiprocessing import resource_tracker
+
+import pytest
+
+from app.core.shared_limiter import PostgresCounter, ShmCounter
+
+# окно с запасом: тест не должен пересечь его границу
+WINDOW = 3600
+
+
+def _in_memory(counter):
+    # общее хранилище без БД: локальная логика та же, что и с Postgres
+    store = defaultdict(int)
+
+    def push(key, index, amount):
+        store[key, index] += amount
+        return store[key, index - 1], store[key, index]
+
+    def push_many(items):
+        for item in items:
+            push(*item)
+
+    counter._push = push
+    counter._push_many = push_many
+    counter._expire = lambda now: None
+    return counter
+
+
+@pytest.fixture
+def shm_name():
+    name = f"sed_test_{uuid.uuid4().hex[:12]}"
+    yield name
+    counter = ShmCounter(name, WINDOW, sync_interval=60, slots=64)
+    resource_tracker.register(counter._shm._name, "shared_memory")
+    counter._shm.close()
+    counter._shm.unlink()
+
+
+@pytest.fixture(params=["shm", "postgres"])
+def make_counter(request, shm_name):
+    def make():
+        if request.param == "shm":
+            return ShmCounter(shm_name, WINDOW, sync_interval=60, slots=64)
+        return _in_memory(PostgresCounter("test", None, WINDOW, sync_interval=60))
+    return make
+
+
+def test_add_to_new_key_is_counted(make_counter):
+    counter = make_counter()
+    counter.add("k")
+    assert counter.count("k") == 1.0
+    counter.add("k", 2)
+    assert counter.count("k") == 3.0
+
+
+def test_acquire_below_limit_stays_local(make_counter):
+    counter = make_counter()
+    for _ in range(10):
+        assert counter.try_acquire("k", limit=100)
+    # одна синхронизация на первом обращении, дальше - локальная копия
+    assert counter.round_trips == 1
+    assert counter.count("k") == 10.0
+
+    counter.flush()
+    assert counter.count("k") == 10.0
+
+
+def test_near_limit_decides_on_shared_state(make_counter):
+    counter = make_counter()
+    allowed = sum(counter.try_acquire("k", limit=10) for _ in range(15))
+    assert allowed == 10
+    assert counter.round_trips > 1
+
+
+def test_shm_workers_share_counts(shm_name):
+    first = ShmCounter(shm_name, WINDOW, sync_interval=60, slots=64)
+    second = ShmCounter(shm_name, WINDOW, sync_interval=60, slots=64)
+
+    for _ in range(5):
+        first.try_acquire("k", limit=100)
+    assert second.count("k") == 0.0
+
+    first.flush()
+    second._local.clear()
+    assert second.count("k") == 5.0
+
+    second.add("k")
+    first._local.clear()
+    assert first.count("k") == 6.0
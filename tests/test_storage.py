@@ -0,0 +1,155 @@
+import hashlib
+import os
+import time
+import zlib
+
+import pytest
+
+from app.core.config import settings
+from app.services.storage import (
+    CHUNK_SIZE,
+    blob_path,
+    iter_stored,
+    layout_path,
+    migrate_layout,
+    new_blob_path,
+    sha256_file,
+)
+
+
+def test_gzip_blob_decodes_in_bounded_chunks(tmp_path):
+    # 64 МиБ нулей сжимаются в десятки КиБ: распаковка не должна
+    # выдавать больше CHUNK_SIZE за раз
+    path = tmp_path / ("0" * 64 + ".gz")
+    encoder = zlib.compressobj(6, zlib.DEFLATED, 31)
+    h = hashlib.sha256()
+    with open(path, "wb") as f:
+        zeros = bytes(CHUNK_SIZE)
+        for _ in range(64):
+            f.write(encoder.compress(zeros))
+            h.update(zeros)
+        f.write(encoder.compress(b"tail"))
+        h.update(b"tail")
+        f.write(encoder.flush())
+    assert path.stat().st_size < CHUNK_SIZE
+
+    raw_total = decoded_total = 0
+    for raw, data in iter_stored(str(path)):
+        assert len(data) <= CHUNK_SIZE
+        raw_total += len(raw)
+        decoded_total += len(data)
+
+    assert raw_total == path.stat().st_size
+    assert decoded_total == 64 * CHUNK_SIZE + 4
+    assert sha256_file(str(path)) == h.hexdigest()
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "STORAGE_PATH", str(tmp_path))
+    monkeypatch.setattr(settings, "STORAGE_LAYOUT", "fanout")
+    return tmp_path
+
+
+def put_blob(name: str, layout: str) -> str:
+    path = layout_path(name, layout)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(name.encode())
+    return path
+
+
+def names(n: int, suffix: str = "") -> list[str]:
+    return [hashlib.sha256(f"{suffix}{i}".encode()).hexdigest() + suffix for i in range(n)]
+
+
+def quiet(message):
+    pass
+
+
+def test_blob_path_resolves_both_layouts(storage, monkeypatch):
+    flat, fanout, missing = names(3)
+    flat_path = put_blob(flat, "flat")
+    fanout_path = put_blob(fanout, "fanout")
+
+    for layout in ("fanout", "flat"):
+        monkeypatch.setattr(settings, "STORAGE_LAYOUT", layout)
+        assert blob_path(flat) == flat_path
+        assert blob_path(fanout) == fanout_path
+        assert blob_path(missing) == layout_path(missing, layout)
+
+
+def test_migrate_layout_mixed_tree(storage):
+    flat = names(3) + names(2, ".gz")
+    for name in flat:
+        put_blob(name, "flat")
+    [done] = names(1, ".zst")
+    put_blob(done, "fanout")
+    # служебные и посторонние файлы остаются в корне
+    service = [".tmp-abc", ".upload-abc", ".gc-" + flat[0], "notes.txt"]
+    for name in service:
+        (storage / name).write_bytes(b"x")
+
+    assert migrate_layout(batch_size=2, pause=0, grace=0, log=quiet) == len(flat)
+
+    for name in flat + [done]:
+        assert not os.path.exists(layout_path(name, "flat"))
+        assert blob_path(name) == layout_path(name, "fanout")
+        with open(blob_path(name), "rb") as f:
+            assert f.read() == name.encode()
+    assert sorted(p.name for p in storage.iterdir() if p.is_file()) == sorted(service)
+    # повторный запуск ничего не делает
+    assert migrate_layout(pause=0, grace=0, log=quiet) == 0
+
+
+def test_migrate_layout_resumes_interrupted_run(storage):
+    linked, untouched = names(2)
+    # прерванный запуск: жёсткая ссылка создана, старое имя не удалено
+    put_blob(untouched, "flat")
+    os.link(put_blob(linked, "flat"), new_blob_path(linked))
+
+    assert migrate_layout(pause=0, grace=0, log=quiet) == 2
+    for name in (linked, untouched):
+        assert not os.path.exists(layout_path(name, "flat"))
+        assert os.path.exists(layout_path(name, "fanout"))
+
+
+def test_migrate_layout_skips_blob_deleted_meanwhile(storage, monkeypatch):
+    gone, kept = names(2)
+    put_blob(gone, "flat")
+    put_blob(kept, "flat")
+    link = os.link
+
+    def link_after_delete(src, dst):
+        # blob удалили между чтением каталога и переносом
+        if os.path.basename(src) == gone:
+            os.remove(src)
+        link(src, dst)
+
+    monkeypatch.setattr(os, "link", link_after_delete)
+    assert migrate_layout(pause=0, grace=0, log=quiet) == 1
+    assert not os.path.exists(layout_path(gone, "fanout"))
+    assert os.path.exists(layout_path(kept, "fanout"))
+
+
+def test_migrate_layout_unlinks_after_grace(storage):
+    blobs = names(2)
+    for name in blobs:
+        put_blob(name, "flat")
+    seen = []
+
+    def log(message):
+        # старое имя ещё на месте, а blob_path уже отдаёт новое
+        seen.append([
+            (os.path.exists(layout_path(name, "flat")), blob_path(name) == layout_path(name, "fanout"))
+            for name in blobs
+        ])
+
+    started = time.monotonic()
+    assert migrate_layout(batch_size=1, pause=0, grace=0.3, log=log) == 2
+    assert time.monotonic() - started >= 0.3
+
+    assert len(seen) == 2
+    assert all(all(state) for state in seen[-1])
+    for name in blobs:
+        assert not os.path.exists(layout_path(name, "flat"))